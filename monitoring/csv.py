@@ -24,6 +24,7 @@
 from datetime import datetime
 import os
 
+from sungrow.stats import formatValue
 from util.config import Config
 
 class Persist(object):
@@ -57,9 +58,10 @@ class Persist(object):
             if not exists:
                 ofd.write("timestamp,")
                 ofd.write(self.dumpline(self.columns))
-            cells = list()   
+            cells = list()
             for c in self.columns:
-                cells.append(status[c])
+                # Missing cells are the unchanged ones when recording changes only
+                cells.append(formatValue(status[c]) if c in status else '')
             ofd.write(f"{now},")
             ofd.write(self.dumpline(cells))
 
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# A monitoring engine that keeps the last few hours of key fields in memory
+# and serves them over a small local HTTP API.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import os
+import socketserver
+import stat
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+from util.config import Config
+from util.ringbuffer import RingBuffer
+
+# The fields kept by default
+DEFAULT_FIELDS = [
+    'battery_level_soc',
+    'battery_charging_power',
+    'battery_discharging_power',
+    'purchased_power',
+    'total_load_active_power',
+]
+
+# The first history store created in this process - see getHistory()
+_history = None
+
+def getHistory():
+    '''
+    :returns: the in-process RingBuffer of recent samples or None if no
+            history monitoring store is configured
+    '''
+    return _history
+
+def _clean(values):
+    '''
+    JSON has no NaN so convert them to null
+    '''
+    return [None if math.isnan(v) else v for v in values]
+
+class HistoryHandler(BaseHTTPRequestHandler):
+    '''
+    Serve the ring buffer as JSON.
+
+        GET /latest                          - the most recent sample
+        GET /history?seconds=3600&fields=a,b - samples from the last hour
+    '''
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        buffer = self.server.persist.buffer
+        if url.path == '/latest':
+            latest = buffer.latest()
+            if latest is not None:
+                latest = {n: (None if isinstance(v, float) and math.isnan(v) else v) for (n, v) in latest.items()}
+            self._reply(latest)
+        elif url.path == '/history':
+            try:
+                seconds = float(query.get('seconds', ['3600'])[0])
+            except ValueError:
+                self.send_error(400, 'seconds must be a number')
+                return
+            fields = query['fields'][0].split(',') if 'fields' in query else None
+            window = buffer.since(time.time() - seconds, fields)
+            self._reply({n: (v if n == 'timestamp' else _clean(v)) for (n, v) in window.items()})
+        else:
+            self.send_error(404)
+
+    def _reply(self, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Don't use address_string() - there is no address for a Unix socket
+        self.server.persist.logger.debug('history - %s', format % args)
+
+class UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+    '''
+    An HTTP server listening on a Unix domain socket
+    '''
+    daemon_threads = True
+
+class Persist(object):
+    '''
+    Keep recent status information in memory
+    '''
+    # Each save() replaces the latest values so it needs every field - see ChangeFilter
+    filterable = False
+
+    def __init__(self, parameters, column_list):
+        '''
+        Initiate myself and, if requested, start the API server.
+
+        param: parameters - configuration parameters for this monitoring engine
+        param: field_list - the list of fields that will be saved
+        '''
+        global _history
+        # Load the configurations
+        config = self.config = Config.load()
+        # Configure self.logger
+        self.logger = config.logger
+        # Size the buffer for the requested number of hours of samples
+        fields = parameters.get('fields', DEFAULT_FIELDS)
+        hours = float(parameters.get('hours', 6))
+        self.buffer = RingBuffer(fields, max(1, int(hours * 3600 / config.poll_interval)))
+        # Start the API server if asked to
+        self.server = None
+        if 'socket' in parameters:
+            path = parameters['socket']
+            if os.path.exists(path):
+                # Only replace a socket left behind by an earlier run
+                if not stat.S_ISSOCK(os.stat(path).st_mode):
+                    raise ValueError(f'The history socket {path} exists and is not a socket')
+                os.remove(path)
+            self.server = UnixHTTPServer(path, HistoryHandler)
+            self.address = path
+        elif 'port' in parameters:
+            self.server = ThreadingHTTPServer((parameters.get('address', '127.0.0.1'), int(parameters['port'])), HistoryHandler)
+            self.server.daemon_threads = True
+            self.address = self.server.server_address
+        if _history is None:
+            _history = self.buffer
+        if self.server is not None:
+            self.server.persist = self
+            threading.Thread(target=self.server.serve_forever, name='history', daemon=True).start()
+            self.logger.debug('Serving history on %s', self.address)
+
+    def save(self, status):
+        '''
+        Add a sample to the ring buffer
+        '''
+        self.buffer.append(time.time(), status)
+
+    def close(self):
+        '''
+        Stop the API server
+        '''
+        global _history
+        if _history is self.buffer:
+            _history = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            if isinstance(self.address, str) and os.path.exists(self.address):
+                os.remove(self.address)
+            self.server = None
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# A monitoring engine that writes the status to InfluxDB (or any other
+# TSDB that accepts the InfluxDB line protocol).
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import gzip
+import os
+import queue
+import threading
+import time
+import requests
+
+from sungrow.sh5params import SH5_POWER_STATS_MAP, SH5_BATTERY_STATS_MAP
+from util.config import Config
+
+#-----------------------------------------------------------------
+# The type of each of the known fields.  Everything the inverter reports
+# in the SH5 stat maps is numeric.  Unknown fields are written as strings.
+FIELD_TYPES = dict.fromkeys(list(SH5_POWER_STATS_MAP.values()) + list(SH5_BATTERY_STATS_MAP.values()), float)
+FIELD_TYPES['force_charge_status'] = float
+
+def escape(text, specials=', ='):
+    '''
+    Escape a measurement name, tag key, tag value or field key.
+    '''
+    text = str(text).replace('\\', '\\\\')
+    for c in specials:
+        text = text.replace(c, f'\\{c}')
+    return text
+
+def formatField(name, value, kind):
+    '''
+    Format a single field as name=value.  Returns None if the value
+    is missing (line protocol has no nulls).
+    '''
+    if value is None or value == '--':
+        return None
+    if kind is float:
+        try:
+            return f'{escape(name)}={float(value)!r}'
+        except (TypeError, ValueError):
+            pass
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'{escape(name)}="{value}"'
+
+class Persist(object):
+    '''
+    Save status information as batched, gzipped InfluxDB line protocol.
+
+    Batches for an InfluxDB endpoint are posted by a background thread so
+    a slow or unreachable endpoint never holds up the control loop.
+    '''
+    def __init__(self, parameters, column_list):
+        '''
+        Initiate myself.
+
+        param: parameters - configuration parameters for this monitoring engine
+        param: field_list - the list of fields to be saved
+        '''
+        # Load the configurations
+        config = self.config = Config.load()
+        # Configure self.logger
+        self.logger = config.logger
+        # Where the data goes - either an InfluxDB write URL or a local file
+        self.url = parameters.get('url', None)
+        self.dest = parameters.get('dest', None)
+        if self.url is None and self.dest is None:
+            raise ValueError(f"The influx monitoring engine needs either a url or a dest")
+        self.token = parameters.get('token', None)
+        # What gets written
+        self.measurement = escape(parameters.get('measurement', 'inverter'), ', ')
+        self.tags = ''.join(f',{escape(n)}={escape(v)}' for (n, v) in sorted(parameters.get('tags', {'host': config.sg_host}).items()))
+        self.columns = [(c, FIELD_TYPES.get(c, str)) for c in column_list]
+        # Batching and retries
+        self.batch_size = int(parameters.get('batch_size', 10))
+        self.flush_interval = float(parameters.get('flush_interval', 300))
+        self.retries = int(parameters.get('retries', 2))
+        self.retry_delay = float(parameters.get('retry_delay', 0.5))
+        self.timeout = float(parameters.get('timeout', config.timeout))
+        # Lines that could not be sent are kept here until the endpoint is back
+        self.spill = parameters.get('spill', None)
+        self.spill_max_bytes = int(parameters.get('spill_max_bytes', 50 * 1024 * 1024))
+        self.batch = list()
+        self.batch_started = 0
+        self.session = None
+        # Batches waiting for the sender thread - see flush()
+        self._queue = queue.Queue()
+        self._sender = None
+
+    def format(self, status, timestamp=None):
+        '''
+        Convert a status dict in to a single line of line protocol.
+
+        :returns: the line or None if there were no fields to write
+        '''
+        fields = list()
+        for (name, kind) in self.columns:
+            field = formatField(name, status.get(name), kind)
+            if field is not None:
+                fields.append(field)
+        if len(fields) == 0:
+            return None
+        if timestamp is None:
+            timestamp = time.time()
+        return f"{self.measurement}{self.tags} {','.join(fields)} {int(timestamp)}"
+
+    def save(self, status):
+        '''
+        Add a row of data to the batch and write the batch if it's full or old
+        '''
+        line = self.format(status)
+        if line is None:
+            return
+        if len(self.batch) == 0:
+            self.batch_started = time.time()
+        self.batch.append(line)
+        if len(self.batch) >= self.batch_size or time.time() - self.batch_started >= self.flush_interval:
+            self.flush()
+
+    def flush(self, wait=False):
+        '''
+        Write the current batch to the destination.  For an endpoint, the
+        batch is queued for the sender thread, which sends anything spilled
+        earlier first and spills the batch if it can't be sent.
+
+        :param wait: wait until everything queued has been sent or spilled
+        '''
+        batch = self.batch
+        self.batch = list()
+        if self.dest is not None:
+            self._writeFile(batch)
+            return
+        if len(batch) > 0:
+            if self._sender is None:
+                self._sender = threading.Thread(target=self._sendBatches, name='influx', daemon=True)
+                self._sender.start()
+            self._queue.put(batch)
+        if wait:
+            self._queue.join()
+
+    def close(self):
+        '''
+        Send whatever is still in the batch then stop the sender thread
+        '''
+        self.flush()
+        if self._sender is not None:
+            self._queue.put(None)
+            self._sender.join()
+            self._sender = None
+        if self.session is not None:
+            self.session.close()
+            self.session = None
+
+    # Helpers
+    def _sendBatches(self):
+        '''
+        The sender thread - send the queued batches until given None
+        '''
+        while True:
+            batch = self._queue.get()
+            try:
+                if batch is None:
+                    return
+                self._send(batch)
+            except Exception as err:
+                self.logger.error('Unexpected %s exception sending to influx - %s', type(err).__name__, err)
+            finally:
+                self._queue.task_done()
+
+    def _send(self, batch):
+        '''
+        Send anything spilled earlier then the batch, spilling the batch
+        if it can't be sent
+
+        :returns: True if everything was sent
+        '''
+        # Send anything that was spilled earlier first so the data stays in order
+        if not self._drainSpill():
+            self._spill(batch)
+            return False
+        if len(batch) > 0 and not self._post(batch):
+            self._spill(batch)
+            return False
+        return True
+
+    def _writeFile(self, lines):
+        '''
+        Append lines to the local file sink.  Files ending in .gz are
+        written as (multi-member) gzip files.
+        '''
+        if len(lines) == 0:
+            return True
+        data = ('\n'.join(lines) + '\n').encode('utf-8')
+        opener = gzip.open if self.dest.endswith('.gz') else open
+        with opener(self.dest, 'ab') as ofd:
+            ofd.write(data)
+        return True
+
+    def _post(self, lines):
+        '''
+        POST a gzipped batch of lines with a bounded number of retries.
+        '''
+        body = gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'))
+        headers = {'Content-Encoding': 'gzip', 'Content-Type': 'text/plain; charset=utf-8'}
+        if self.token is not None:
+            headers['Authorization'] = f'Token {self.token}'
+        params = None if 'precision=' in self.url else {'precision': 's'}
+        if self.session is None:
+            self.session = requests.Session()
+        delay = self.retry_delay
+        for attempt in range(self.retries + 1):
+            try:
+                r = self.session.post(self.url, data=body, headers=headers, params=params, timeout=self.timeout)
+                if r.status_code < 300:
+                    return True
+                if r.status_code in (400, 422):
+                    # The data itself is bad - keeping it would block everything after it
+                    self.logger.error('Influx rejected %d lines - %s - %s', len(lines), r.status_code, r.text)
+                    return True
+                self.logger.warning('Influx write to %s failed - %s - %s', self.url, r.status_code, r.text)
+                if r.status_code < 500 and r.status_code != 429:
+                    # Bad credentials or URL - retrying won't help
+                    return False
+            except requests.exceptions.RequestException as err:
+                self.logger.warning('Influx write to %s failed - %s', self.url, err)
+            if attempt < self.retries:
+                time.sleep(delay)
+                delay *= 2
+        return False
+
+    def _spill(self, lines):
+        '''
+        Save lines that couldn't be sent so they can be sent later
+        '''
+        if self.spill is None or len(lines) == 0:
+            if len(lines) > 0:
+                self.logger.warning('Dropped %d influx lines', len(lines))
+            return
+        if os.path.exists(self.spill) and os.path.getsize(self.spill) >= self.spill_max_bytes:
+            self.logger.warning('Influx spill file %s is full - dropped %d lines', self.spill, len(lines))
+            return
+        with open(self.spill, 'a', encoding='utf-8') as ofd:
+            ofd.write('\n'.join(lines) + '\n')
+
+    def _drainSpill(self):
+        '''
+        Send the spill file, a batch at a time, and remove it once it has all been sent.
+
+        :returns: True if there is nothing left in the spill file
+        '''
+        if self.spill is None or not os.path.exists(self.spill):
+            return True
+        chunk = max(self.batch_size, 1000)
+        sent = 0
+        failed = False
+        with open(self.spill, 'r', encoding='utf-8') as ifd:
+            lines = list()
+            for line in ifd:
+                lines.append(line.rstrip('\n'))
+                if len(lines) >= chunk:
+                    if not self._post(lines):
+                        failed = True
+                        break
+                    sent += len(lines)
+                    lines = list()
+            if not failed and len(lines) > 0 and not self._post(lines):
+                failed = True
+        if not failed:
+            os.remove(self.spill)
+            return True
+        if sent > 0:
+            # Keep only the lines that haven't been sent yet
+            with open(self.spill, 'r', encoding='utf-8') as ifd:
+                remaining = ifd.readlines()[sent:]
+            with open(f'{self.spill}.tmp', 'w', encoding='utf-8') as ofd:
+                ofd.writelines(remaining)
+            os.replace(f'{self.spill}.tmp', self.spill)
+        return False
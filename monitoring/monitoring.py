@@ -22,9 +22,67 @@
 # You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
 
 import importlib
+import time
 
 from util.config import Config
 
+class ChangeFilter(object):
+    '''
+    Optional compression stage for a monitoring store.  Drops fields that
+    haven't changed (or have changed by less than their deadband) since they
+    were last written, and writes a full keyframe every so often so that
+    every field is periodically recorded.
+    '''
+    def __init__(self, parameters):
+        '''
+        param: parameters - the monitoring store's configuration parameters
+        '''
+        self.deadband = float(parameters.get('deadband', 0))
+        self.deadbands = {n: float(v) for (n, v) in parameters.get('deadbands', {}).items()}
+        self.keyframe_seconds = float(parameters.get('keyframe', 15)) * 60
+        self.last = dict()
+        self.last_keyframe = 0
+
+    @classmethod
+    def isConfigured(cls, parameters):
+        '''
+        :returns: True if the store asks for change-only recording
+        '''
+        return bool(parameters.get('change_only', False)) or 'deadband' in parameters or 'deadbands' in parameters
+
+    def apply(self, status, now=None):
+        '''
+        :returns: a dict of the fields that need to be written or None if
+                nothing has changed
+        '''
+        if now is None:
+            now = time.time()
+        if now - self.last_keyframe >= self.keyframe_seconds:
+            # Time for a full row
+            self.last_keyframe = now
+            self.last = dict(status)
+            return self.last
+        changed = dict()
+        for (name, value) in status.items():
+            if name not in self.last or self._hasChanged(name, self.last[name], value):
+                changed[name] = value
+        if len(changed) == 0:
+            return None
+        self.last.update(changed)
+        return changed
+
+    def _hasChanged(self, name, old, new):
+        '''
+        Compare two values allowing for the field's deadband
+        '''
+        if old == new:
+            return False
+        try:
+            return abs(float(new) - float(old)) > self.deadbands.get(name, self.deadband)
+        except (TypeError, ValueError):
+            # Not numbers (e.g. '--') so any difference is a change
+            return True
+
 class Monitoring(object):
     '''
     Process the configuration information and enable all configured monitoring stores
@@ -40,14 +98,31 @@ class Monitoring(object):
         self.properties = fields
         # Create list of the configured monitoring stores
         self.stores = list()
+        self.filters = list()
         for store in stores:
             m = importlib.import_module(f'monitoring.{store['engine']}')
             self.stores.append(m.Persist(store, fields))
+            # Only stores that record rows can leave unchanged fields out
+            filtered = ChangeFilter.isConfigured(store) and getattr(m.Persist, 'filterable', True)
+            self.filters.append(ChangeFilter(store) if filtered else None)
 
     def save(self, status):
         '''
         Save the passed status to all configured monitoring stores
         '''
+        for (s, f) in zip(self.stores, self.filters):
+            if f is None:
+                s.save(status)
+            else:
+                changed = f.apply(status)
+                if changed is not None:
+                    s.save(changed)
+
+    def close(self):
+        '''
+        Flush and close any monitoring stores that buffer their data
+        '''
         for s in self.stores:
-            s.save(status)
+            if hasattr(s, 'close'):
+                s.close()
 
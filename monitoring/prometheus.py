@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# A monitoring engine that publishes the inverter status on an embedded
+# Prometheus/OpenMetrics HTTP endpoint.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+
+from util.config import Config
+from util.metrics import METRICS, formatValue
+
+# The content type for the Prometheus text exposition format
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    '''
+    Serve /metrics from the in-memory snapshot.  Never talks to the dongle.
+    '''
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/metrics', '/'):
+            self.send_error(404)
+            return
+        body = self.server.persist.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        self.server.persist.logger.debug('%s - %s', self.address_string(), format % args)
+
+class Persist(object):
+    '''
+    Publish status information as Prometheus gauges
+    '''
+    # Each save() replaces the latest values so it needs every field - see ChangeFilter
+    filterable = False
+
+    def __init__(self, parameters, column_list):
+        '''
+        Initiate myself and start the HTTP server.
+
+        param: parameters - configuration parameters for this monitoring engine
+        param: field_list - the list of fields to be published
+        '''
+        # Load the configurations
+        config = self.config = Config.load()
+        # Configure self.logger
+        self.logger = config.logger
+        # Set my paramters
+        self.columns = column_list
+        self.prefix = parameters.get('prefix', 'optmybat_inverter')
+        address = parameters.get('address', '')
+        port = int(parameters.get('port', 9105))
+        # Nothing to publish until the first save()
+        self.snapshot = None
+        self.updated = 0
+        # Start the server in the background
+        self.server = ThreadingHTTPServer((address, port), MetricsHandler)
+        self.server.daemon_threads = True
+        self.server.persist = self
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, name=f'prometheus-{self.port}', daemon=True).start()
+        self.logger.debug('Publishing metrics on port %d', self.port)
+
+    def save(self, status):
+        '''
+        Take a numeric snapshot of the status.  Replacing the reference is
+        atomic so the HTTP thread always sees a complete snapshot.
+        '''
+        snapshot = list()
+        for c in self.columns:
+            try:
+                snapshot.append((c, float(status[c])))
+            except (KeyError, TypeError, ValueError):
+                # Missing or '--' values are published as NaN
+                snapshot.append((c, float('nan')))
+        self.snapshot = snapshot
+        self.updated = time.time()
+
+    def render(self):
+        '''
+        :returns: the current snapshot and the process metrics in the
+                Prometheus text exposition format
+        '''
+        lines = list()
+        snapshot = self.snapshot
+        if snapshot is not None:
+            for (name, value) in snapshot:
+                metric = f'{self.prefix}_{name}'
+                lines.append(f'# TYPE {metric} gauge')
+                lines.append(f'{metric} {formatValue(value)}')
+            lines.append(f'# TYPE {self.prefix}_updated_timestamp_seconds gauge')
+            lines.append(f'{self.prefix}_updated_timestamp_seconds {formatValue(self.updated)}')
+        if lines:
+            lines.append('')
+        return '\n'.join(lines) + METRICS.render()
+
+    def close(self):
+        '''
+        Stop the HTTP server
+        '''
+        self.server.shutdown()
+        self.server.server_close()
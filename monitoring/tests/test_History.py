@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests the history monitoring engine and its API server.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import http.client
+import json
+import socket
+import pytest
+
+from monitoring import history
+
+class UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__('localhost', timeout=5)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+def fetch(conn, path):
+    conn.request('GET', path)
+    return json.loads(conn.getresponse().read())
+
+def test_unixSocket(tmpdir):
+    '''
+    Test the in-process and Unix socket access to the history
+    '''
+    path = f'{tmpdir}/history.sock'
+    store = history.Persist({'engine': 'history', 'hours': 1, 'socket': path}, [])
+    try:
+        assert history.getHistory() is store.buffer
+        store.save({'battery_level_soc': '50', 'purchased_power': '--'})
+        store.save({'battery_level_soc': '51', 'purchased_power': '0.5'})
+        assert history.getHistory().latest()['battery_level_soc'] == 51
+        conn = UnixConnection(path)
+        latest = fetch(conn, '/latest')
+        assert latest['battery_level_soc'] == 51
+        window = fetch(conn, '/history?seconds=60&fields=battery_level_soc,purchased_power')
+        assert window['battery_level_soc'] == [50, 51]
+        assert window['purchased_power'] == [None, 0.5]
+    finally:
+        store.close()
+    assert history.getHistory() is None
+
+def test_notSocket(tmpdir):
+    '''
+    Test that an existing file that isn't a socket is left alone
+    '''
+    path = f'{tmpdir}/history.sock'
+    with open(path, 'w') as ofd:
+        ofd.write('keep me')
+    with pytest.raises(ValueError):
+        history.Persist({'engine': 'history', 'hours': 1, 'socket': path}, [])
+    assert history.getHistory() is None
+    with open(path) as ifd:
+        assert ifd.read() == 'keep me'
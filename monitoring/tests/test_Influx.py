@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests the InfluxDB monitoring engine.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import gzip
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+import socket
+import threading
+import time
+import pytest
+
+from monitoring.influx import Persist
+
+COLUMNS = ['battery_level_soc', 'purchased_power', 'mystery']
+
+class InfluxHandler(BaseHTTPRequestHandler):
+    '''
+    A stand-in for the InfluxDB write endpoint
+    '''
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        assert self.headers['Content-Encoding'] == 'gzip'
+        self.server.received.extend(gzip.decompress(body).decode('utf-8').splitlines())
+        self.send_response(204)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def startServer(port=0):
+    server = HTTPServer(('127.0.0.1', port), InfluxHandler)
+    server.received = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def freePort():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def test_format():
+    '''
+    Test the line protocol formatting
+    '''
+    store = Persist({'engine': 'influx', 'dest': '/dev/null', 'tags': {'host': 'my inverter'}}, COLUMNS)
+    line = store.format({'battery_level_soc': '42', 'purchased_power': '--', 'mystery': 'a "b"'}, timestamp=100)
+    assert line == 'inverter,host=my\\ inverter battery_level_soc=42.0,mystery="a \\"b\\"" 100'
+    assert store.format({'purchased_power': '--'}) is None
+
+def test_fileSink(tmpdir):
+    '''
+    Test that rows are batched and written to a gzipped file
+    '''
+    dest = f'{tmpdir}/status.lp.gz'
+    store = Persist({'engine': 'influx', 'dest': dest, 'batch_size': 2}, COLUMNS)
+    store.save({'battery_level_soc': '1'})
+    assert not os.path.exists(dest)
+    store.save({'battery_level_soc': '2'})
+    store.save({'battery_level_soc': '3'})
+    store.close()
+    with gzip.open(dest, 'rt') as ifd:
+        lines = ifd.read().splitlines()
+    assert len(lines) == 3
+    assert lines[2].startswith('inverter,host=')
+    assert 'battery_level_soc=3.0' in lines[2]
+
+def test_spill(tmpdir):
+    '''
+    Test that rows are spilled while the endpoint is down and sent, in
+    order, once it's back
+    '''
+    port = freePort()
+    spill = f'{tmpdir}/influx.spill'
+    store = Persist({'engine': 'influx', 'url': f'http://127.0.0.1:{port}/api/v2/write', 'batch_size': 1,
+                     'retries': 1, 'retry_delay': 0.01, 'timeout': 1, 'spill': spill}, COLUMNS)
+    store.save({'battery_level_soc': '1'})
+    store.save({'battery_level_soc': '2'})
+    store.flush(wait=True)
+    with open(spill) as ifd:
+        assert len(ifd.readlines()) == 2
+    server = startServer(port)
+    try:
+        store.save({'battery_level_soc': '3'})
+        store.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert not os.path.exists(spill)
+    assert [l.split(' ')[1] for l in server.received] == ['battery_level_soc=1.0', 'battery_level_soc=2.0', 'battery_level_soc=3.0']
+
+def test_background(tmpdir):
+    '''
+    Test that saving doesn't wait for an endpoint that doesn't answer
+    '''
+    with socket.socket() as sock:
+        # Accepts connections but never replies
+        sock.bind(('127.0.0.1', 0))
+        sock.listen(8)
+        spill = f'{tmpdir}/influx.spill'
+        store = Persist({'engine': 'influx', 'url': f'http://127.0.0.1:{sock.getsockname()[1]}/api/v2/write', 'batch_size': 1,
+                         'retries': 1, 'retry_delay': 0.01, 'timeout': 0.5, 'spill': spill}, COLUMNS)
+        started = time.monotonic()
+        store.save({'battery_level_soc': '1'})
+        store.save({'battery_level_soc': '2'})
+        assert time.monotonic() - started < 0.5
+        store.close()
+    with open(spill) as ifd:
+        assert len(ifd.readlines()) == 2
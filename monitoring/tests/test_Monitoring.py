@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests the change-only recording of monitoring data.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from monitoring.monitoring import ChangeFilter, Monitoring
+
+def test_changeOnly():
+    '''
+    Test that unchanged fields are dropped between keyframes
+    '''
+    f = ChangeFilter({'change_only': True, 'keyframe': 10})
+    assert f.apply({'a': '1', 'b': '--'}, now=1000) == {'a': '1', 'b': '--'}
+    assert f.apply({'a': '1', 'b': '--'}, now=1030) is None
+    assert f.apply({'a': '2', 'b': '--'}, now=1060) == {'a': '2'}
+    assert f.apply({'a': '2', 'b': '5'}, now=1090) == {'b': '5'}
+    # Keyframe after 10 minutes
+    assert f.apply({'a': '2', 'b': '5'}, now=1600) == {'a': '2', 'b': '5'}
+
+def test_deadband():
+    '''
+    Test that small changes are ignored but slow drift is still caught
+    '''
+    f = ChangeFilter({'deadband': 0.5, 'deadbands': {'soc': 2}})
+    assert f.apply({'soc': '50', 't': '20.0'}, now=0) is not None
+    assert f.apply({'soc': '51', 't': '20.4'}, now=30) is None
+    assert f.apply({'soc': '52.5', 't': '20.6'}, now=60) == {'soc': '52.5', 't': '20.6'}
+    # Drift is measured from the last written value
+    assert f.apply({'soc': '53', 't': '21.0'}, now=90) is None
+    assert f.apply({'soc': '54', 't': '21.2'}, now=120) == {'t': '21.2'}
+
+def test_csv(tmpdir):
+    '''
+    Test that the CSV store leaves unchanged cells empty
+    '''
+    dest = f'{tmpdir}/status.csv'
+    m = Monitoring([{'engine': 'csv', 'name': 'test', 'dest': dest, 'change_only': True}], ['a', 'b'])
+    m.save({'a': '1', 'b': '2'})
+    m.save({'a': '1', 'b': '2'})
+    m.save({'a': '1', 'b': '3'})
+    m.close()
+    with open(dest) as ifd:
+        rows = [l.rstrip('\n').split(',')[1:] for l in ifd]
+    assert rows == [['a', 'b'], ['1', '2'], ['', '3']]
+
+def test_snapshots():
+    '''
+    Test that the stores publishing the latest values get every field
+    '''
+    m = Monitoring([{'engine': 'history', 'name': 'test', 'fields': ['a', 'b'], 'change_only': True}], ['a', 'b'])
+    m.save({'a': '1', 'b': '2'})
+    m.save({'a': '1', 'b': '3'})
+    assert m.filters == [None]
+    assert m.stores[0].buffer.latest()['a'] == 1
+    m.close()
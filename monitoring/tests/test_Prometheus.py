@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests the Prometheus monitoring engine.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import pytest
+import urllib.request
+
+from monitoring.prometheus import Persist
+
+def scrape(store, path='/metrics'):
+    with urllib.request.urlopen(f'http://127.0.0.1:{store.port}{path}', timeout=5) as r:
+        return r.read().decode('utf-8')
+
+def test_scrape():
+    '''
+    Test that saved values are published and that missing values become NaN
+    '''
+    store = Persist({'engine': 'prometheus', 'address': '127.0.0.1', 'port': 0}, ['battery_level_soc', 'purchased_power'])
+    try:
+        # Nothing saved yet so only the process metrics
+        assert 'optmybat_inverter_battery_level_soc' not in scrape(store)
+        store.save({'battery_level_soc': '42.5', 'purchased_power': '--'})
+        text = scrape(store)
+        assert 'optmybat_inverter_battery_level_soc 42.5' in text
+        assert 'optmybat_inverter_purchased_power NaN' in text
+        with pytest.raises(Exception):
+            scrape(store, '/nope')
+    finally:
+        store.close()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Household load and PV generation forecasts.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+from array import array
+import csv
+from datetime import datetime, timedelta
+import os
+
+import numpy as np
+
+from util.clock import Clock
+
+# The recorded fields used for the forecasts.  Powers are in kW and the
+# yield is in kWh since midnight.
+LOAD = 'total_load_active_power'
+PV = 'total_dc_power'
+PV_YIELD = 'daily_pv_yield'
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# How many days of history to learn from - older weeks hardly count
+HISTORY_DAYS = 56
+
+class FlatForecast(object):
+    '''
+    The simplest possible forecast - the same load and PV all the time
+    '''
+    def __init__(self, load=0.5, pv=0.0):
+        self.load = float(load)
+        self.pv = float(pv)
+
+    def observe(self, stats, t=None):
+        '''
+        Nothing to learn
+        '''
+        pass
+
+    def forecast(self, times, seconds):
+        '''
+        :param times: the start of each period in seconds since the epoch
+        :param seconds: the length of each period
+        :returns: (load, pv) arrays of the average power (kW) in each period
+        '''
+        return (np.full(len(times), self.load), np.full(len(times), self.pv))
+
+class Forecaster(object):
+    '''
+    Learns the household load and PV generation for each time slot of each
+    day of the week as an exponentially weighted moving average, so recent
+    weeks count the most.
+
+    The averages are kept in fixed size arrays (one entry per slot per
+    weekday).  Samples are summed until their slot ends, when the slot's
+    mean is folded in to the average, so each sample costs a few additions
+    and the forecast only changes once per slot.
+    '''
+    def __init__(self, slot=30, alpha=0.2, load=0.5):
+        '''
+        :param slot: the slot length in minutes - must divide in to a day
+        :param alpha: the weight of the newest day in the averages
+        :param load: the load forecast for slots with no history at all
+        '''
+        self.slot = int(slot)
+        if self.slot <= 0 or 1440 % self.slot != 0:
+            raise ValueError('The forecast slot must be a whole number of minutes that divides in to a day')
+        self.alpha = float(alpha)
+        if not 0 < self.alpha <= 1:
+            raise ValueError('The forecast alpha must be more than 0 and no more than 1')
+        self.default_load = float(load)
+        self.per_day = 1440 // self.slot
+        size = 7 * self.per_day
+        self.load = array('d', [0.0]) * size
+        self.pv = array('d', [0.0]) * size
+        # Which slots have any history
+        self.seen = array('b', [0]) * size
+        # numpy views of the same memory for the forecasts
+        self._load = np.frombuffer(self.load, dtype=np.float64)
+        self._pv = np.frombuffer(self.pv, dtype=np.float64)
+        self._seen = np.frombuffer(self.seen, dtype=np.int8)
+        # The slot being summed: index, load sum, PV sum and sample count
+        self._index = -1
+        self._load_sum = 0.0
+        self._pv_sum = 0.0
+        self._count = 0
+        # The last (time, daily_pv_yield) for working out PV power from the yield
+        self._yield = None
+
+    @classmethod
+    def fromCSV(cls, path, slot=30, alpha=0.2, load=0.5, days=None):
+        '''
+        Learn from a csv monitoring store.  Empty cells (unchanged values
+        when only changes are recorded) repeat the previous value.
+
+        :param path: the CSV file
+        :param days: only learn from this many days before the last row.
+                Defaults to all of them.
+        :returns: the new Forecaster
+        '''
+        forecaster = cls(slot, alpha, load)
+        last = {LOAD: '', PV: '', PV_YIELD: ''}
+        offset = None if days is None else _tailOffset(path, days)
+        with open(path, 'r', newline='') as ifd:
+            reader = csv.DictReader(ifd)
+            if offset is not None:
+                # Read the header then skip straight to the recent rows
+                reader.fieldnames
+                ifd.seek(offset)
+            for row in reader:
+                for name in last:
+                    if row.get(name):
+                        last[name] = row[name]
+                try:
+                    ts = datetime.strptime(row['timestamp'], TIME_FORMAT)
+                except (KeyError, TypeError, ValueError):
+                    continue
+                # The timestamps are already local times
+                index = ts.weekday() * forecaster.per_day + (ts.hour * 60 + ts.minute) // forecaster.slot
+                forecaster._sample(index, ts.timestamp(), _number(last[LOAD]), _number(last[PV]), _number(last[PV_YIELD]))
+        forecaster._fold()
+        return forecaster
+
+    @classmethod
+    def fromConfig(cls, parameters, learn=True):
+        '''
+        Learn from the planner's history file, if there is one yet
+
+        :param parameters: the planner configuration
+        :param learn: set False to not read the history - e.g. to just
+                check the settings
+        :returns: the new Forecaster
+        '''
+        args = (int(parameters.get('slot', 30)), float(parameters.get('forecast_alpha', 0.2)), float(parameters.get('load', 0.5)))
+        path = parameters.get('history')
+        if learn and path and os.path.exists(path):
+            return cls.fromCSV(path, *args, days=int(parameters.get('history_days', HISTORY_DAYS)))
+        return cls(*args)
+
+    def observe(self, stats, t=None):
+        '''
+        Learn from the latest inverter stats
+
+        :param stats: a mapping with some of the LOAD, PV and PV_YIELD fields
+        :param t: the time of the stats.  Defaults to now.
+        '''
+        clock = Clock.default()
+        if t is None:
+            t = clock.time()
+        index = clock.weekday(t) * self.per_day + clock.minuteOfDay(t) // self.slot
+        self._sample(index, t, stats.get(LOAD), stats.get(PV), stats.get(PV_YIELD))
+
+    def forecast(self, times, seconds):
+        '''
+        :param times: the start of each period in seconds since the epoch
+        :param seconds: the length of each period.  Each period gets the
+                forecast for the slot it starts in.
+        :returns: (load, pv) arrays of the average power (kW) in each period
+        '''
+        times = np.asarray(times, dtype=np.float64)
+        clock = Clock.default()
+        offset = clock.utcOffset(times[0])
+        if len(times) > 1 and clock.utcOffset(times[-1]) != offset:
+            # Daylight saving changes during the forecast
+            offset = np.array([clock.utcOffset(t) for t in times])
+        minutes = ((times + offset) // 60).astype(np.int64)
+        # The epoch was a Thursday
+        index = ((minutes // 1440 + 3) % 7) * self.per_day + (minutes % 1440) // self.slot
+        load = self._load[index]
+        pv = self._pv[index]
+        seen = self._seen[index]
+        if not seen.all():
+            # Use the other days' average for the time of day, if there is one
+            days = self._seen.reshape(7, self.per_day)
+            counts = days.sum(axis=0)
+            slots = index % self.per_day
+            known = counts[slots] > 0
+            divisor = np.maximum(counts, 1)
+            average_load = (self._load.reshape(7, self.per_day) * days).sum(axis=0) / divisor
+            average_pv = (self._pv.reshape(7, self.per_day) * days).sum(axis=0) / divisor
+            load = np.where(seen, load, np.where(known, average_load[slots], self.default_load))
+            pv = np.where(seen, pv, np.where(known, average_pv[slots], 0.0))
+        return (load, pv)
+
+    def nextDay(self, now=None):
+        '''
+        :param now: the time in seconds since the epoch.  Defaults to now.
+        :returns: (times, load, pv) for each slot in the next 24 hours,
+                starting with the current slot
+        '''
+        clock = Clock.default()
+        if now is None:
+            now = clock.time()
+        seconds = self.slot * 60
+        start = now - clock.localTime(now) % seconds
+        times = start + np.arange(self.per_day) * seconds
+        return (times,) + self.forecast(times, seconds)
+
+    def _sample(self, index, t, load, pv, pv_yield):
+        '''
+        Add a sample to the slot being summed.  Without a PV power, the
+        PV power is worked out from the change in the daily yield.
+        '''
+        if pv_yield is not None:
+            if pv is None and self._yield is not None:
+                (previous_t, previous) = self._yield
+                # The yield resets at midnight
+                if 0 < t - previous_t <= 3600 and pv_yield >= previous:
+                    pv = (pv_yield - previous) / ((t - previous_t) / 3600)
+            self._yield = (t, pv_yield)
+        if load is None or pv is None:
+            return
+        if index != self._index:
+            self._fold()
+            self._index = index
+        self._load_sum += load
+        self._pv_sum += pv
+        self._count += 1
+
+    def _fold(self):
+        '''
+        Fold the summed slot in to the averages
+        '''
+        if self._count == 0:
+            return
+        i = self._index
+        load = self._load_sum / self._count
+        pv = self._pv_sum / self._count
+        if self.seen[i]:
+            self.load[i] += self.alpha * (load - self.load[i])
+            self.pv[i] += self.alpha * (pv - self.pv[i])
+        else:
+            self.load[i] = load
+            self.pv[i] = pv
+            self.seen[i] = 1
+        self._load_sum = 0.0
+        self._pv_sum = 0.0
+        self._count = 0
+
+def _tailOffset(path, days):
+    '''
+    Find where the recent rows start in a CSV file in time order with a
+    binary search, so only a few rows are read however long the file is.
+
+    :returns: the offset of the first row less than days before the last row
+    '''
+    with open(path, 'rb') as ifd:
+        ifd.readline()
+        lo = ifd.tell()
+        size = ifd.seek(0, os.SEEK_END)
+        # The last row's timestamp
+        ifd.seek(max(size - 4096, lo))
+        rows = ifd.read().splitlines()
+        try:
+            latest = datetime.strptime(rows[-1].split(b',', 1)[0].decode(), TIME_FORMAT)
+        except (IndexError, UnicodeDecodeError, ValueError):
+            return lo
+        since = (latest - timedelta(days=days)).strftime(TIME_FORMAT).encode()
+        def rowAt(position):
+            # The first row starting at or after position
+            if position > lo:
+                ifd.seek(position - 1)
+                ifd.readline()
+            else:
+                ifd.seek(lo)
+            return (ifd.tell(), ifd.readline())
+        # The timestamps sort as text
+        (first, hi) = (lo, size)
+        while first < hi:
+            mid = (first + hi) // 2
+            row = rowAt(mid)[1]
+            if not row or row[:len(since)] > since:
+                hi = mid
+            else:
+                first = mid + 1
+        return rowAt(first)[0]
+
+def _number(text):
+    '''
+    :returns: the recorded value as a float or None if it's missing
+    '''
+    try:
+        return float(text)
+    except ValueError:
+        return None
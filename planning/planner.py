@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# A time of use tariff aware charge planner.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import math
+
+import numpy as np
+
+from planning.forecast import FlatForecast, Forecaster
+from simulator.battery import Battery
+from util.clock import Clock
+from util.hhmmtime import HHMMTime
+
+class Tariff(object):
+    '''
+    Time of use electricity prices
+    '''
+    def __init__(self, entries, default_price):
+        '''
+        :param entries: a list of dicts with a start and stop time (hh:mm), a
+                price per kWh and, optionally, a list of days (0 is Monday).
+                The first matching entry wins.
+        :param default_price: the price when no entry matches
+        '''
+        self.entries = list()
+        for e in entries:
+            days = e.get('days')
+            self.entries.append((HHMMTime(e['start']).value, HHMMTime(e['stop']).value, None if days is None else list(days), float(e['price'])))
+        self.default_price = float(default_price)
+
+    def prices(self, minutes, weekdays):
+        '''
+        :param minutes: an array of minutes of the day
+        :param weekdays: an array of days of the week
+        :returns: an array of prices
+        '''
+        prices = np.full(len(minutes), self.default_price)
+        done = np.zeros(len(minutes), dtype=bool)
+        for (start, stop, days, price) in self.entries:
+            if start <= stop:
+                inside = (minutes >= start) & (minutes < stop)
+            else:
+                # Wraps around midnight
+                inside = (minutes >= start) | (minutes < stop)
+            if days is not None:
+                inside &= np.isin(weekdays, days)
+            inside &= ~done
+            prices[inside] = price
+            done |= inside
+        return prices
+
+class Plan(object):
+    '''
+    The cheapest SOC trajectory found by the Planner
+    '''
+    def __init__(self, planner, times, soc, load, pv, prices):
+        self.planner = planner
+        # The start of each slot and the SOC at the start of each slot plus the end of the last
+        self.times = times
+        self.soc = soc
+        self.load = load
+        self.pv = pv
+        self.prices = prices
+
+    def targets(self, hours=24):
+        '''
+        Convert the plan to soc_min style targets.  A slot gets a target when
+        the plan needs the SOC to end higher than self consumption would
+        leave it - i.e. when the battery should be force charged, or held
+        rather than discharged.
+
+        :param hours: only convert the slots starting in the next few hours.
+                Targets are times of day so this can't be more than 24.
+        :returns: a list of dicts with start, stop and target
+        '''
+        planner = self.planner
+        battery = planner.battery
+        clock = Clock.default()
+        slot_minutes = planner.slot_seconds // 60
+        hours_per_slot = planner.slot_seconds / 3600
+        targets = list()
+        for t in range(len(self.times)):
+            if self.times[t] >= self.times[0] + min(hours, 24) * 3600:
+                break
+            # Where self consumption would leave the battery
+            energy = min(max(self.pv[t] - self.load[t], -battery.max_discharge), battery.max_charge) * hours_per_slot
+            natural = self.soc[t] + (energy * battery.efficiency if energy > 0 else energy) / battery.capacity * 100
+            natural = min(max(natural, battery.min_soc), battery.max_soc)
+            if self.soc[t + 1] <= natural + planner.soc_step / 2:
+                continue
+            target = int(math.ceil(self.soc[t + 1] - 1e-6))
+            start = clock.minuteOfDay(self.times[t])
+            stop = start + slot_minutes
+            stop = str(HHMMTime(stop)) if stop <= HHMMTime.ONE_DAY else str(HHMMTime(stop % HHMMTime.ONE_DAY))
+            if targets and targets[-1]['stop'] == str(HHMMTime(start)) and targets[-1]['target'] == target:
+                # Extend the previous target
+                targets[-1]['stop'] = stop
+            else:
+                targets.append({'start': str(HHMMTime(start)), 'stop': stop, 'target': target})
+        return targets
+
+class Planner(object):
+    '''
+    Finds the cheapest SOC trajectory over the next day or two, given a time
+    of use tariff, load and PV forecasts and the battery's limits, using
+    dynamic programming over discrete SOC levels.
+
+    Each slot's costs are a matrix (from level x to level y) so the backward
+    pass is a handful of numpy operations per slot.  It only runs when a new
+    slot starts or the forecasts or prices change - otherwise re-planning is
+    just a forward pass through the saved policy from the current SOC.
+    '''
+    # The cost, per kWh per slot, of keeping energy in the battery
+    HOLDING_COST = 1e-6
+
+    def __init__(self, parameters, forecast=None):
+        '''
+        :param parameters: the planner configuration - see the planner
+                section of config/sample-config.yml
+        :param forecast: provides the load and PV forecasts.  Defaults to a
+                Forecaster learning from the configured history or, without
+                one, a FlatForecast using the configured load and pv.
+        '''
+        self.parameters = parameters
+        self.battery = Battery.fromConfig(parameters)
+        self.slot_seconds = int(parameters.get('slot', 30)) * 60
+        self.slots = int(float(parameters.get('horizon', 36)) * 3600 // self.slot_seconds)
+        self.soc_step = float(parameters.get('soc_step', 1))
+        self.tariff = Tariff(parameters.get('tariff', []), parameters.get('default_price', 0.25))
+        self.export_price = float(parameters.get('export_price', 0.0))
+        self.terminal_price = parameters.get('terminal_price')
+        if forecast is None:
+            if 'history' in parameters:
+                forecast = Forecaster.fromConfig(parameters)
+            else:
+                forecast = FlatForecast(parameters.get('load', 0.5), parameters.get('pv', 0.0))
+        self.forecast = forecast
+        if self.slot_seconds <= 0 or 86400 % self.slot_seconds != 0:
+            raise ValueError('The planner slot must be a whole number of minutes that divides in to a day')
+        if self.slots < 1:
+            raise ValueError('The planner horizon must be at least one slot')
+        battery = self.battery
+        self.levels = np.arange(battery.min_soc, battery.max_soc + self.soc_step / 2, self.soc_step)
+        if len(self.levels) < 2:
+            raise ValueError('The planner needs at least two SOC levels')
+        # The energy (kWh) that moving from level x to level y takes from, or
+        # gives to, the grid side of the battery
+        hours = self.slot_seconds / 3600
+        stored = (self.levels[None, :] - self.levels[:, None]) * battery.capacity / 100
+        self._battery_in = np.where(stored > 0, stored / battery.efficiency, stored)
+        self._feasible = (self._battery_in <= battery.max_charge * hours + 1e-9) & (-self._battery_in <= battery.max_discharge * hours + 1e-9)
+        # The inputs and policy of the last backward pass
+        self._inputs = None
+        self._policy = None
+        self.backward_passes = 0
+
+    def plan(self, soc, now=None):
+        '''
+        Plan from now.
+
+        :param soc: the current SOC
+        :param now: the time in seconds since the epoch.  Defaults to now.
+        :returns: a Plan
+        '''
+        clock = Clock.default()
+        if now is None:
+            now = clock.time()
+        # Slots start on the local hour, or half hour etc.
+        start = now - clock.localTime(now) % self.slot_seconds
+        times = start + np.arange(self.slots) * self.slot_seconds
+        (load, pv) = self.forecast.forecast(times, self.slot_seconds)
+        prices = self.tariff.prices(np.array([clock.minuteOfDay(t) for t in times]), np.array([clock.weekday(t) for t in times]))
+        inputs = (start, load, pv, prices)
+        if self._inputs is None or self._inputs[0] != start or not all(np.array_equal(a, b) for (a, b) in zip(self._inputs[1:], inputs[1:])):
+            self._backward(load, pv, prices)
+            self._inputs = inputs
+        return Plan(self, times, self._forward(soc), load, pv, prices)
+
+    def targets(self, soc, now=None):
+        '''
+        :returns: the plan from now as a list of soc_min style targets
+        '''
+        return self.plan(soc, now).targets()
+
+    def coverTarget(self, stop, now=None):
+        '''
+        Size a target from the forecasts - the SOC needed at the end of
+        the target to cover the load until PV generation exceeds it.
+
+        :param stop: the time of day (hh:mm) the target ends
+        :param now: the time in seconds since the epoch.  Defaults to now.
+        :returns: the target SOC
+        '''
+        clock = Clock.default()
+        if now is None:
+            now = clock.time()
+        # The next time the target ends
+        minutes = (HHMMTime(stop).value - clock.minuteOfDay(now)) % HHMMTime.ONE_DAY
+        start = now - clock.localTime(now) % 60 + minutes * 60
+        times = start + np.arange(86400 // self.slot_seconds) * self.slot_seconds
+        (load, pv) = self.forecast.forecast(times, self.slot_seconds)
+        surplus = pv >= load
+        slots = int(surplus.argmax()) if surplus.any() else len(times)
+        energy = float((load[:slots] - pv[:slots]).sum()) * self.slot_seconds / 3600
+        battery = self.battery
+        return int(min(math.ceil(battery.min_soc + energy / battery.capacity * 100 - 1e-6), battery.max_soc))
+
+    def _backward(self, load, pv, prices):
+        '''
+        Work out the cheapest next level from every level in every slot
+        '''
+        battery = self.battery
+        hours = self.slot_seconds / 3600
+        n = len(self.levels)
+        rows = np.arange(n)
+        # Energy left at the end is worth what it would cost to buy
+        terminal = float(prices.mean() if self.terminal_price is None else self.terminal_price)
+        value = -(self.levels - self.levels[0]) * battery.capacity / 100 * terminal
+        # A token charge for keeping energy in the battery so that, when
+        # the costs are otherwise equal, the plan uses the battery sooner
+        holding = (self.levels - self.levels[0]) * battery.capacity / 100 * self.HOLDING_COST
+        policy = np.empty((self.slots, n), dtype=np.int64)
+        for t in range(self.slots - 1, -1, -1):
+            grid = (load[t] - pv[t]) * hours + self._battery_in
+            cost = np.where(grid > 0, grid * prices[t], grid * self.export_price)
+            total = np.where(self._feasible, cost + holding[None, :] + value[None, :], np.inf)
+            policy[t] = total.argmin(axis=1)
+            value = total[rows, policy[t]]
+        self._policy = policy
+        self.backward_passes += 1
+
+    def _forward(self, soc):
+        '''
+        :returns: the SOC at the start of each slot, and the end of the last,
+                following the policy from soc
+        '''
+        level = int(np.clip(round((soc - self.levels[0]) / self.soc_step), 0, len(self.levels) - 1))
+        path = np.empty(self.slots + 1, dtype=np.int64)
+        path[0] = level
+        for t in range(self.slots):
+            level = path[t + 1] = self._policy[t, level]
+        trajectory = self.levels[path]
+        trajectory[0] = soc
+        return trajectory
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests the Forecaster class.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+from array import array
+from datetime import datetime
+
+import numpy as np
+import pytest
+import pytz
+
+from planning.forecast import Forecaster
+from planning.planner import Planner
+from util.clock import Clock
+
+# Midnight UTC on a Monday
+MONDAY = 1717372800
+WEEK = 7 * 86400
+
+@pytest.fixture
+def utc():
+    '''
+    Forecast in UTC
+    '''
+    previous = Clock.install(Clock(lambda: MONDAY, timezone=pytz.utc))
+    yield
+    Clock.install(previous)
+
+def test_average(utc):
+    '''
+    Test the slot means and the weighted average across weeks
+    '''
+    forecaster = Forecaster(slot=30, alpha=0.5)
+    for (week, load) in enumerate([1.0, 3.0]):
+        start = MONDAY + week * WEEK + 3600
+        # Two samples in the 01:00 slot then one in the next to close it
+        forecaster.observe({'total_load_active_power': load, 'total_dc_power': 0.0}, start)
+        forecaster.observe({'total_load_active_power': load + 1, 'total_dc_power': 1.0}, start + 60)
+        forecaster.observe({'total_load_active_power': 9.0, 'total_dc_power': 9.0}, start + 1800)
+    # The first week sets the average and the second is weighted in
+    (load, pv) = forecaster.forecast([MONDAY + 2 * WEEK + 3600], 1800)
+    assert load[0] == pytest.approx(0.5 * 1.5 + 0.5 * 3.5)
+    assert pv[0] == pytest.approx(0.5)
+    # Tuesday has no history so uses the other days' average
+    (load, pv) = forecaster.forecast([MONDAY + 86400 + 3600, MONDAY + 86400 + 7200 + 1800], 1800)
+    assert load[0] == pytest.approx(2.5)
+    assert load[1] == pytest.approx(0.5)
+    assert pv[1] == 0.0
+
+def test_yield(utc):
+    '''
+    Test working out the PV power from the daily yield
+    '''
+    forecaster = Forecaster(slot=60)
+    start = MONDAY + 10 * 3600
+    # The yield resets (e.g. at midnight) at 12:00
+    for (minutes, pv_yield) in [(0, 5.0), (30, 6.0), (60, 7.0), (120, 0.0), (180, 0.5)]:
+        forecaster.observe({'total_load_active_power': 1.0, 'daily_pv_yield': pv_yield}, start + minutes * 60)
+    (load, pv) = forecaster.forecast([start, start + 3600, start + 7200], 3600)
+    assert pv[0] == pytest.approx(2.0)
+    assert pv[1] == pytest.approx(2.0)
+    # Nothing for Monday 12:00
+    assert not forecaster.seen[12]
+
+def test_fromCSV(tmpdir, utc):
+    '''
+    Test learning from a csv monitoring store with empty unchanged cells
+    '''
+    path = f'{tmpdir}/status.csv'
+    with open(path, 'w') as ofd:
+        ofd.write('timestamp,total_load_active_power,total_dc_power,daily_pv_yield\n')
+        ofd.write('2024-06-03 12:00:00,1.0,2.0,3.0\n')
+        ofd.write('2024-06-03 12:10:00,3.0,,\n')
+        ofd.write('2024-06-03 12:20:00,--,4.0,\n')
+        ofd.write('2024-06-03 12:30:00,2.0,--,4.0\n')
+    forecaster = Forecaster.fromCSV(path, slot=30)
+    (load, pv) = forecaster.forecast([MONDAY + 12 * 3600, MONDAY + 12 * 3600 + 1800], 1800)
+    assert load[0] == pytest.approx(2.0)
+    assert pv[0] == pytest.approx(2.0)
+    # 1kWh since the unchanged yield at 12:20
+    assert load[1] == pytest.approx(2.0)
+    assert pv[1] == pytest.approx(6.0)
+    # Planning from the same history
+    planner = Planner({'history': path, 'slot': 30})
+    assert isinstance(planner.forecast, Forecaster)
+    assert planner.forecast.load[planner.forecast.per_day // 2] == pytest.approx(2.0)
+
+def test_tail(tmpdir, utc):
+    '''
+    Test only reading the recent history
+    '''
+    path = f'{tmpdir}/status.csv'
+    with open(path, 'w') as ofd:
+        ofd.write('timestamp,total_load_active_power,total_dc_power\n')
+        # Hourly rows for 70 days - 1kW to start with then 3kW for the last 4 weeks
+        for hour in range(70 * 24):
+            ts = datetime.fromtimestamp(MONDAY - 70 * 86400 + hour * 3600, pytz.utc)
+            ofd.write(f"{ts.strftime('%Y-%m-%d %H:%M:%S')},{1.0 if hour < 42 * 24 else 3.0},0.0\n")
+    forecaster = Forecaster.fromCSV(path, slot=60, alpha=0.5, days=28)
+    assert forecaster._load == pytest.approx(3.0)
+    # Everything averages in the old load
+    forecaster = Forecaster.fromCSV(path, slot=60, alpha=0.5)
+    assert forecaster._load.min() < 3.0
+    # Asking for more than there is reads it all
+    assert np.array_equal(Forecaster.fromCSV(path, slot=60, alpha=0.5, days=100).load, forecaster.load)
+
+def test_timezone():
+    '''
+    Test the forecast slots across a daylight saving change
+    '''
+    sydney = pytz.timezone('Australia/Sydney')
+    previous = Clock.install(Clock(lambda: MONDAY, timezone=sydney))
+    try:
+        forecaster = Forecaster(slot=30)
+        # Forecast each slot's index
+        forecaster.load[:] = array('d', range(len(forecaster.load)))
+        forecaster.seen[:] = array('b', [1]) * len(forecaster.seen)
+        start = datetime(2024, 10, 5, 12, 0, tzinfo=pytz.utc).timestamp()
+        (times, load, pv) = forecaster.nextDay(start)
+        for (t, value) in zip(times, load):
+            local = datetime.fromtimestamp(t, sydney)
+            assert value == local.weekday() * 48 + (local.hour * 60 + local.minute) // 30
+    finally:
+        Clock.install(previous)
+
+def test_invalid():
+    '''
+    Test rejecting unusable settings
+    '''
+    with pytest.raises(ValueError):
+        Forecaster(slot=7)
+    with pytest.raises(ValueError):
+        Forecaster(alpha=0)
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests the Tariff, Plan and Planner classes.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import itertools
+
+import numpy as np
+import pytest
+import pytz
+
+from planning.forecast import FlatForecast
+from planning.planner import Planner, Tariff
+from sungrow.optmybat import sizeTargets, validateConfig
+from util.classydict import ClassyDict
+from util.clock import Clock
+
+# Midnight UTC on a Monday
+MONDAY = 1717372800
+
+PARAMETERS = {
+    'capacity': 10,
+    'max_charge': 5,
+    'max_discharge': 5,
+    'min_soc': 10,
+    'max_soc': 100,
+    'efficiency': 0.9,
+    'default_price': 0.30,
+    'tariff': [
+        {'start': '00:00', 'stop': '06:00', 'price': 0.10},
+        {'start': '16:00', 'stop': '21:00', 'price': 0.50, 'days': [0, 1, 2, 3, 4]},
+    ],
+    'export_price': 0.05,
+    'load': 1.0,
+    'pv': 0.0,
+}
+
+@pytest.fixture
+def utc():
+    '''
+    Plan in UTC
+    '''
+    previous = Clock.install(Clock(lambda: MONDAY, timezone=pytz.utc))
+    yield
+    Clock.install(previous)
+
+def test_tariff():
+    '''
+    Test prices, including wrapped times, days and the first match winning
+    '''
+    tariff = Tariff([
+        {'start': '22:00', 'stop': '02:00', 'price': 0.1},
+        {'start': '01:00', 'stop': '03:00', 'price': 0.2},
+        {'start': '12:00', 'stop': '24:00', 'price': 0.5, 'days': [5, 6]},
+    ], 0.3)
+    minutes = np.array([0, 90, 150, 180, 600, 720, 1380, 720])
+    weekdays = np.array([0, 0, 0, 0, 0, 0, 0, 6])
+    assert list(tariff.prices(minutes, weekdays)) == [0.1, 0.1, 0.2, 0.3, 0.3, 0.3, 0.1, 0.5]
+
+def test_optimal(utc):
+    '''
+    Test that the plan is the cheapest possible by trying every path
+    '''
+    parameters = dict(PARAMETERS, soc_step=30, slot=60, horizon=5, terminal_price=0.2, max_charge=4, load=1.5)
+    planner = Planner(parameters)
+    # 4am so the cheap prices end during the plan
+    now = MONDAY + 4 * 3600
+    plan = planner.plan(40, now)
+    capacity = parameters['capacity']
+    levels = planner.levels
+    prices = plan.prices
+
+    def cost(path):
+        total = 0.0
+        for (t, (a, b)) in enumerate(zip(path, path[1:])):
+            stored = (b - a) * capacity / 100
+            if stored / parameters['efficiency'] > parameters['max_charge'] or -stored > parameters['max_discharge']:
+                return np.inf
+            grid = parameters['load'] + (stored / parameters['efficiency'] if stored > 0 else stored)
+            total += grid * (prices[t] if grid > 0 else parameters['export_price'])
+        return total - (path[-1] - levels[0]) * capacity / 100 * parameters['terminal_price']
+
+    best = min(cost((40,) + p) for p in itertools.product(levels, repeat=5))
+    assert cost(tuple(plan.soc)) == pytest.approx(best, abs=1e-3)
+    # Charged while it's cheap
+    assert plan.soc[2] > plan.soc[0]
+
+def test_targets(utc):
+    '''
+    Test that the plan charges overnight for the evening peak
+    '''
+    planner = Planner(PARAMETERS)
+    # 22:00 on Monday
+    targets = planner.targets(10, MONDAY + 22 * 3600)
+    assert len(targets) >= 1
+    for t in targets:
+        assert 10 < t['target'] <= 100
+        # Never force charged or held during the evening peak
+        assert t['stop'] <= '16:00' or t['start'] >= '21:00'
+    # Charged from the cheap overnight prices
+    overnight = [t for t in targets if t['start'] < '06:00']
+    assert max(t['target'] for t in overnight) == max(t['target'] for t in targets)
+    # Consecutive slots with the same target are merged
+    assert all(a['stop'] != b['start'] or a['target'] != b['target'] for (a, b) in zip(targets, targets[1:]))
+    # Nothing to do with a flat tariff
+    flat = Planner(dict(PARAMETERS, tariff=[]))
+    assert flat.targets(50, MONDAY + 22 * 3600) == []
+
+def test_midnight(utc):
+    '''
+    Test a target ending at midnight
+    '''
+    parameters = dict(PARAMETERS, tariff=[{'start': '23:00', 'stop': '24:00', 'price': 0.01}])
+    targets = Planner(parameters).targets(10, MONDAY + 22 * 3600)
+    assert targets[-1]['stop'] == '24:00'
+    assert targets[0]['start'] == '23:00'
+
+def test_incremental(utc):
+    '''
+    Test that the backward pass only runs when needed
+    '''
+    forecast = FlatForecast(1.0, 0.0)
+    planner = Planner(PARAMETERS, forecast=forecast)
+    first = planner.plan(20, MONDAY + 3600)
+    assert planner.backward_passes == 1
+    # Same slot, different SOC
+    second = planner.plan(60, MONDAY + 3600 + 60)
+    assert planner.backward_passes == 1
+    assert second.soc[0] == 60
+    assert not np.array_equal(first.soc, second.soc)
+    # A new forecast
+    forecast.load = 2.0
+    planner.plan(60, MONDAY + 3600 + 120)
+    assert planner.backward_passes == 2
+    # A new slot
+    planner.plan(60, MONDAY + 3600 + 1800)
+    assert planner.backward_passes == 3
+
+def test_invalid():
+    '''
+    Test rejecting unusable settings
+    '''
+    with pytest.raises(ValueError):
+        Planner(dict(PARAMETERS, slot=7))
+    with pytest.raises(ValueError):
+        Planner(dict(PARAMETERS, horizon=0))
+    with pytest.raises(ValueError):
+        Planner(dict(PARAMETERS, min_soc=100))
+
+def test_coverTarget(utc):
+    '''
+    Test sizing a target to cover the load until there's enough PV
+    '''
+    class Morning(FlatForecast):
+        '''
+        2kW of load until 09:00 when the PV takes over
+        '''
+        def forecast(self, times, seconds):
+            hours = (np.asarray(times) % 86400) / 3600
+            return (np.full(len(times), 2.0), np.where((hours >= 9) & (hours < 17), 3.0, 0.0))
+
+    planner = Planner(PARAMETERS, forecast=Morning())
+    # 06:00 to 09:00 is 6kWh of the 10kWh battery on top of the 10% minimum
+    assert planner.coverTarget('06:00', MONDAY + 3600) == 70
+    assert planner.coverTarget('08:00', MONDAY + 3600) == 30
+    # Capped at the battery's maximum
+    assert planner.coverTarget('20:00', MONDAY + 3600) == 100
+
+def test_autoTargets(utc):
+    '''
+    Test the checks and sizing of automatic soc_min targets
+    '''
+    soc_min = [{'start': '00:00', 'stop': '06:00', 'target': 'auto'}, {'start': '00:00', 'stop': '24:00', 'target': 5}]
+    with pytest.raises(ValueError):
+        validateConfig(ClassyDict({'soc_min': soc_min, 'planner': None}))
+    validateConfig(ClassyDict({'soc_min': soc_min, 'planner': dict(PARAMETERS, pv=0.0)}))
+    planner = Planner(dict(PARAMETERS, load=0.5, pv=0.0))
+    sized = sizeTargets(soc_min, planner)
+    assert sized[0]['target'] == planner.coverTarget('06:00')
+    assert sized[1] is soc_min[1]
+    assert soc_min[0]['target'] == 'auto'
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# The battery model shared by the simulator and the planner.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+class Battery(object):
+    '''
+    The battery and the inverter's battery limits
+    '''
+    def __init__(self, capacity=10.0, max_charge=5.0, max_discharge=5.0, min_soc=5.0, max_soc=100.0, efficiency=0.95, soc=50.0):
+        '''
+        :param capacity: usable capacity in kWh
+        :param max_charge: maximum charge rate in kW
+        :param max_discharge: maximum discharge rate in kW
+        :param min_soc: the inverter's reserve - it won't discharge below this %
+        :param max_soc: the inverter won't charge above this %
+        :param efficiency: the fraction of the charging energy that is stored
+        :param soc: the starting state of charge %
+        '''
+        self.capacity = float(capacity)
+        self.max_charge = float(max_charge)
+        self.max_discharge = float(max_discharge)
+        self.min_soc = float(min_soc)
+        self.max_soc = float(max_soc)
+        self.efficiency = float(efficiency)
+        self.soc = min(max(float(soc), self.min_soc), self.max_soc)
+
+    @classmethod
+    def fromConfig(cls, parameters):
+        '''
+        :param parameters: a dict that may contain any of the constructor's arguments
+        :returns: a new Battery
+        '''
+        names = ('capacity', 'max_charge', 'max_discharge', 'min_soc', 'max_soc', 'efficiency', 'soc')
+        return cls(**{n: parameters[n] for n in names if n in parameters})
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Household load and PV generation profiles for the simulator.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import csv
+from datetime import datetime
+
+import numpy as np
+
+# The monitoring fields used for the profiles.  Both are in kW.
+LOAD = 'total_load_active_power'
+PV = 'total_dc_power'
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+SECONDS_PER_DAY = 24 * 3600
+
+class Profile(object):
+    '''
+    Load and PV power, in kW, sampled every step seconds
+    '''
+    def __init__(self, start, step, load, pv):
+        '''
+        :param start: the time of the first sample in seconds since the epoch
+        :param step: the number of seconds between samples
+        :param load: the household load for each sample
+        :param pv: the PV generation for each sample
+        '''
+        self.start = float(start)
+        self.step = int(step)
+        self.load = np.asarray(load, dtype=float)
+        self.pv = np.asarray(pv, dtype=float)
+        if len(self.load) != len(self.pv):
+            raise ValueError('The load and PV profiles must be the same length')
+
+    def __len__(self):
+        return len(self.load)
+
+    @property
+    def times(self):
+        '''
+        :returns: the time of each sample in seconds since the epoch
+        '''
+        return self.start + np.arange(len(self)) * self.step
+
+    @classmethod
+    def fromCSV(cls, path, step=30, timezone=None):
+        '''
+        Load the profiles from a csv monitoring store, resampled to a fixed step.
+        Empty cells (unchanged values when only changes are recorded) repeat
+        the previous value and rows with missing values are skipped.
+
+        :param path: the CSV file
+        :param step: the number of seconds between samples
+        :param timezone: the time zone of the timestamps.  Defaults to local time.
+        '''
+        times = []
+        load = []
+        pv = []
+        last = {LOAD: '', PV: ''}
+        with open(path, 'r', newline='') as ifd:
+            for row in csv.DictReader(ifd):
+                for name in last:
+                    if row.get(name):
+                        last[name] = row[name]
+                try:
+                    values = (float(last[LOAD]), float(last[PV]))
+                    ts = datetime.strptime(row['timestamp'], TIME_FORMAT)
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if timezone is not None:
+                    ts = timezone.localize(ts)
+                times.append(ts.timestamp())
+                load.append(values[0])
+                pv.append(values[1])
+        if len(times) < 2:
+            raise ValueError(f'Not enough load and PV history in {path}')
+        start = times[0] - times[0] % step
+        grid = np.arange(start, times[-1] + step, step)
+        return cls(start, step, np.interp(grid, times, load), np.interp(grid, times, pv))
+
+    def repeat(self, days):
+        '''
+        Build a longer profile by repeating the whole days in this one
+
+        :param days: the number of days needed
+        :returns: the new Profile
+        '''
+        per_day = SECONDS_PER_DAY // self.step
+        whole = len(self) // per_day * per_day
+        if whole == 0:
+            raise ValueError('A profile needs at least one day to be repeated')
+        n = int(days * per_day)
+        return Profile(self.start, self.step, np.resize(self.load[:whole], n), np.resize(self.pv[:whole], n))
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# A discrete time battery and inverter simulator for replaying schedules.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+from datetime import datetime
+import logging
+
+import numpy as np
+
+from simulator.battery import Battery
+from sungrow.optmybat import updateForceCharge
+from sungrow.services import Services, SH5_DISABLE, SH5_ENABLE
+from sungrow.sh5params import SH5_FORCE_CHARGE_PARAMS, SH5_POWER_STATS_MAP, SH5_BATTERY_STATS_MAP
+from sungrow.support import SungrowError, TimedTarget
+from util.classydict import ClassyDict
+from util.clock import CONFIGURED, Clock
+from util.config import Config
+from util.hhmmtime import HHMMTime
+from util.ringbuffer import RingBuffer
+
+# Our property names mapped back to the inverter's data_names
+_DATA_NAMES = {prop: name for (name, prop) in list(SH5_POWER_STATS_MAP.items()) + list(SH5_BATTERY_STATS_MAP.items())}
+
+class Result(object):
+    '''
+    The simulated history.  Powers are in kW with the battery positive when
+    charging and the grid positive when importing.
+    '''
+    def __init__(self, times, step, soc, battery, load, pv, decisions, changes):
+        self.times = times
+        self.step = step
+        self.soc = soc
+        self.battery = battery
+        self.load = load
+        self.pv = pv
+        self.grid = load - pv + battery
+        # The number of times the decision logic was run and changed something
+        self.decisions = decisions
+        self.changes = changes
+
+    @property
+    def imported_kwh(self):
+        return float(np.maximum(self.grid, 0).sum() * self.step / 3600)
+
+    @property
+    def exported_kwh(self):
+        return float(-np.minimum(self.grid, 0).sum() * self.step / 3600)
+
+class SimulatedClient(object):
+    '''
+    Stands in for sungrow.client.Client so that the real Services, and the
+    real decision logic, run against the simulated inverter.
+    '''
+    inverter_id = 1
+    inverter_type = 35
+    inverter_code = 3599
+
+    def __init__(self, simulator):
+        self.simulator = simulator
+
+    def close(self):
+        pass
+
+    def call(self, **kwargs):
+        return ClassyDict({'list': self.callList(**kwargs)})
+
+    def callList(self, service=None, **kwargs):
+        '''
+        The real time stats for the current step
+        '''
+        sim = self.simulator
+        if service == 'real':
+            stats = {
+                'total_load_active_power': sim.load,
+                'total_dc_power': sim.pv,
+                'purchased_power': max(sim.load - sim.pv + sim.power, 0.0),
+                'total_export_active__power': max(sim.pv - sim.load - sim.power, 0.0),
+            }
+        elif service == 'real_battery':
+            stats = {
+                'battery_level_soc': sim.soc,
+                'battery_charging_power': max(sim.power, 0.0),
+                'battery_discharging_power': max(-sim.power, 0.0),
+            }
+        else:
+            raise SungrowError(f'The simulator does not support {service}')
+        # repr() so the values are read back exactly
+        return [{'data_name': _DATA_NAMES[name], 'data_value': repr(float(value)), 'data_unit': '%' if name == 'battery_level_soc' else 'kW'}
+                for (name, value) in stats.items()]
+
+    def get(self, uri, **kwargs):
+        sim = self.simulator
+        if uri == '/device/getParam':
+            return ClassyDict({'list': sim.registerList()})
+        if uri == '/time/get':
+            now = datetime.fromtimestamp(sim.now, tz=Config.load().timezone)
+            return ClassyDict({'time': now.strftime('%Y-%m-%d %H:%M')})
+        raise SungrowError(f'The simulator does not support {uri}')
+
+    def post(self, uri, **kwargs):
+        return ''
+
+    def setParams(self, params, verify=None):
+        self.simulator.setRegisters(params.dump())
+        return True
+
+def _first(mask):
+    '''
+    :returns: the index of the first True in mask or its length if there isn't one
+    '''
+    found = np.flatnonzero(mask)
+    return found[0] if len(found) else len(mask)
+
+def _accumulate(soc, delta, lo, hi, out):
+    '''
+    A bounded running sum - out[k] = clip(out[k-1] + delta[k], lo, hi)
+    starting from soc.  Vectorised with numpy, it only loops when a bound
+    is reached.
+    '''
+    n = len(delta)
+    i = 0
+    while i < n:
+        # Sitting on a bound - stay there until the battery turns around
+        if soc >= hi:
+            j = i + _first(delta[i:] < 0)
+            out[i:j] = soc
+            i = j
+        elif soc <= lo:
+            j = i + _first(delta[i:] > 0)
+            out[i:j] = soc
+            i = j
+        if i >= n:
+            break
+        run = soc + np.cumsum(delta[i:])
+        j = _first((run > hi) | (run < lo))
+        out[i:i + j] = run[:j]
+        if j == len(run):
+            break
+        soc = hi if run[j] > hi else lo
+        out[i + j] = soc
+        i += j + 1
+
+def _ge(minutes, t):
+    # HHMMTime's >=, remembering that 24:00 == 00:00
+    return (minutes >= t.value) | (minutes == t.value % HHMMTime.ONE_DAY)
+
+def _le(minutes, t):
+    # HHMMTime's <=, remembering that 24:00 == 00:00
+    return (minutes <= t.value) | (minutes == t.value % HHMMTime.ONE_DAY)
+
+class Simulator(object):
+    '''
+    Replays load and PV profiles through a simulated battery and inverter,
+    running the real decision logic (updateForceCharge) against the real
+    Services talking to a SimulatedClient.
+
+    The inverter follows its fc1_*/fc2_* registers - inside a force charge
+    window it charges at full power to the target and then won't discharge
+    below it.  Otherwise it self consumes within the battery's limits.
+
+    The battery is simulated with numpy between decisions.  The decision
+    logic only does something when the active target, the force charge
+    state or the direction of the battery changes so, having decided to do
+    nothing, the simulator skips ahead to the next poll where one of those
+    changes.  A year at 30 second resolution takes seconds.
+
+    The charge rate projection (fc_projection) depends on the SOC at every
+    poll so, when it's enabled, the simulator decides at every poll.
+    '''
+    def __init__(self, profile, battery=None, soc_min=None, poll_interval=None, timezone=CONFIGURED, quiet=True):
+        '''
+        :param profile: the load and PV Profile to replay
+        :param battery: the Battery.  Defaults to Battery().
+        :param soc_min: the soc_min schedule.  Defaults to the configured one.
+        :param poll_interval: seconds between decisions.  Defaults to the configured one.
+        :param timezone: the time zone of the simulation.  Defaults to the configured one.
+        :param quiet: only log warnings from the decision logic
+        '''
+        config = Config.load()
+        self.profile = profile
+        self.battery = Battery() if battery is None else battery
+        self.soc_min = config.soc_min if soc_min is None else soc_min
+        poll_interval = config.poll_interval if poll_interval is None else poll_interval
+        self.poll_steps = max(1, int(round(poll_interval / profile.step)))
+        self.timezone = timezone
+        self.quiet = quiet
+        # Convert powers to SOC % per step
+        hours = profile.step / 3600
+        self.charge_rate = hours * self.battery.efficiency / self.battery.capacity * 100
+        self.discharge_rate = hours / self.battery.capacity * 100
+        # The simulated inverter state reported by the SimulatedClient
+        self.now = profile.start
+        self.soc = self.battery.soc
+        self.power = 0.0
+        self.load = 0.0
+        self.pv = 0.0
+        self.registers = {reg.addr: 0 for reg in SH5_FORCE_CHARGE_PARAMS.values()}
+        self.registers[SH5_FORCE_CHARGE_PARAMS['fc_enable'].addr] = SH5_DISABLE
+        self.changes = 0
+        # The SOC at each decision for the charge rate projection
+        self.history = RingBuffer(('soc',), 240)
+
+    # The simulated inverter
+    def registerList(self):
+        '''
+        :returns: the force charge registers as reported by the inverter
+        '''
+        return [{'param_id': reg.id, 'param_addr': reg.addr, 'param_type': reg.type, 'param_name': reg.pname,
+                 'param_value': str(self.registers[reg.addr])} for reg in SH5_FORCE_CHARGE_PARAMS.values()]
+
+    def setRegisters(self, dumped):
+        '''
+        :param dumped: a list of registers from Parameters.dump()
+        '''
+        for reg in dumped:
+            self.registers[reg['param_addr']] = int(reg['param_value'])
+        self.changes += 1
+
+    def _register(self, name):
+        return self.registers[SH5_FORCE_CHARGE_PARAMS[name].addr]
+
+    def forceChargeTargets(self, minutes):
+        '''
+        The force charge target for each minute of the day, using the same
+        rules as Services.getForceChargeStatus().
+
+        :param minutes: an array of minutes of the day
+        :returns: an array of targets - 0 if not force charging
+        '''
+        targets = np.zeros(len(minutes))
+        if self._register('fc_enable') != SH5_ENABLE:
+            return targets
+        done = np.zeros(len(minutes), dtype=bool)
+        for fc in ('fc1', 'fc2'):
+            soc = self._register(f'{fc}_soc')
+            start = HHMMTime(self._register(f'{fc}_start_hr'), self._register(f'{fc}_start_min'))
+            end = HHMMTime(self._register(f'{fc}_end_hr'), self._register(f'{fc}_end_min'))
+            inside = ~done & _ge(minutes, start) & _le(minutes, end)
+            targets[inside] = soc
+            done |= inside
+        return targets
+
+    # The decision logic
+    def _keys(self, timings, minutes, socs, powers):
+        '''
+        Everything updateForceCharge() bases its decision on: the target it
+        wants, the current force charge target and whether the battery is
+        charging, or at least not clearly below the wanted target.  If these
+        haven't changed since it last did nothing, it will do nothing again.
+
+        :returns: (target index, force charge target, settled) arrays
+        '''
+        hysteresis = float(Config.load().fc_hysteresis)
+        fc_targets = self.forceChargeTargets(minutes)
+        wants = np.full(len(minutes), -1)
+        floors = np.zeros(len(minutes))
+        for (index, t) in enumerate(timings):
+            threshold = t.target + np.where(fc_targets == t.target, hysteresis, 0.1)
+            match = (wants < 0) & _ge(minutes, t.start) & (minutes < t.stop.value) & (socs <= threshold)
+            wants[match] = index
+            floors[match] = t.target - hysteresis
+        # Discharging only matters below the wanted target's hysteresis
+        return (wants, fc_targets, (powers >= 0) | (socs >= floors))
+
+    def _decide(self, timings):
+        '''
+        Run the real decision logic against the current state
+
+        :returns: True if it changed the force charge settings
+        '''
+        return updateForceCharge(services=Services(client=SimulatedClient(self)), timings=timings, history=self.history)
+
+    # The battery
+    def _simulate(self, minutes, net, soc):
+        '''
+        Simulate the battery with the current register settings.
+
+        :param minutes: the minute of the day for each step
+        :param net: the PV less the load for each step
+        :param soc: the starting SOC
+        :returns: the SOC after each step
+        '''
+        battery = self.battery
+        socs = np.empty(len(net))
+        targets = self.forceChargeTargets(minutes)
+        starts = [0] + list(np.flatnonzero(np.diff(targets)) + 1) + [len(net)]
+        for (a, b) in zip(starts[:-1], starts[1:]):
+            target = targets[a]
+            k = 0
+            if target > 0 and soc < target:
+                # Force charging at full power until the target is reached
+                rate = battery.max_charge * self.charge_rate
+                k = min(b - a, int(np.ceil((target - soc) / rate)))
+                socs[a:a + k] = np.minimum(soc + rate * np.arange(1, k + 1), target)
+                soc = socs[a + k - 1]
+            if a + k < b:
+                # Self consumption, but not below the force charge target
+                delta = np.clip(net[a + k:b], -battery.max_discharge, battery.max_charge)
+                delta = np.where(delta > 0, delta * self.charge_rate, delta * self.discharge_rate)
+                _accumulate(soc, delta, max(battery.min_soc, target), battery.max_soc, socs[a + k:b])
+                soc = socs[b - 1]
+        return socs
+
+    def localise(self, times):
+        '''
+        :returns: (the local minute of the day, the local day number) for each time
+        '''
+        clock = Clock(timezone=self.timezone)
+        blocks = times // Clock.OFFSET_SECONDS
+        (unique, index) = np.unique(blocks, return_inverse=True)
+        offsets = np.array([clock.utcOffset(b * Clock.OFFSET_SECONDS) for b in unique])
+        local = times + offsets[index]
+        return (((local // 60) % HHMMTime.ONE_DAY).astype(np.int64), (local // 86400).astype(np.int64))
+
+    def run(self):
+        '''
+        Run the simulation
+
+        :returns: a Result
+        '''
+        profile = self.profile
+        n = len(profile)
+        times = profile.times
+        (minutes, days) = self.localise(times)
+        net = profile.pv - profile.load
+        # The index of the first step of each following day
+        day_ends = np.append(np.flatnonzero(np.diff(days)) + 1, n)
+        soc_out = np.empty(n)
+        power_out = np.empty(n)
+        soc = self.battery.soc
+        power = 0.0
+        decisions = 0
+        self.changes = 0
+        # The decision inputs the last time it decided to do nothing
+        memo = None
+        day = None
+        poll = self.poll_steps
+        every_poll = float(Config.load().fc_projection) > 0
+        self.history = RingBuffer(('soc',), 240)
+        previous = Clock.install(Clock(lambda: self.now, timezone=self.timezone))
+        logger = logging.getLogger()
+        level = logger.level
+        if self.quiet:
+            logger.setLevel(logging.WARNING)
+        try:
+            i = 0
+            while i < n:
+                self.now = times[i]
+                if days[i] != day:
+                    # The targets can change each day
+                    day = days[i]
+                    timings = TimedTarget.loadTargets(self.soc_min)
+                    memo = None
+                if i % poll == 0:
+                    (w, f, c) = self._keys(timings, minutes[i:i + 1], np.array([soc]), np.array([power]))
+                    key = (w[0], f[0], c[0])
+                    if key != memo:
+                        # Report the state at the end of the previous step
+                        j = max(i - 1, 0)
+                        (self.soc, self.power, self.load, self.pv) = (soc, power, profile.load[j], profile.pv[j])
+                        decisions += 1
+                        memo = None if self._decide(timings) or every_poll else key
+                # Simulate to the end of the day with the current settings
+                end = day_ends[np.searchsorted(day_ends, i, side='right')]
+                socs = self._simulate(minutes[i:end], net[i:end], soc)
+                change = np.diff(socs, prepend=soc)
+                powers = np.where(change > 0, change / self.charge_rate, change / self.discharge_rate)
+                # Find the next poll where the decision could be different
+                stop = end
+                first = i + poll - i % poll
+                if first < end:
+                    if memo is None:
+                        stop = first
+                    else:
+                        polls = np.arange(first, end, poll)
+                        (w, f, c) = self._keys(timings, minutes[polls], socs[polls - 1 - i], powers[polls - 1 - i])
+                        changed = np.flatnonzero((w != memo[0]) | (f != memo[1]) | (c != memo[2]))
+                        if len(changed):
+                            stop = polls[changed[0]]
+                soc_out[i:stop] = socs[:stop - i]
+                power_out[i:stop] = powers[:stop - i]
+                soc = soc_out[stop - 1]
+                power = power_out[stop - 1]
+                i = stop
+        finally:
+            Clock.install(previous)
+            logger.setLevel(level)
+        return Result(times, profile.step, soc_out, power_out, profile.load, profile.pv, decisions, self.changes)
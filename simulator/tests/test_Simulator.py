@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests the battery and inverter simulator.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+import pytz
+
+from simulator.profile import Profile
+from simulator.simulator import Battery, Simulator, _accumulate
+from sungrow.support import TimedTarget
+from util.clock import Clock
+from util.config import Config
+
+STEP = 30
+# Midnight UTC on a Monday
+START = 1717372800
+
+SOC_MIN = [
+    {'start': '01:00', 'stop': '05:00', 'target': 80},
+    {'start': '17:00', 'stop': '21:00', 'target': 20},
+]
+
+def dailyProfile(days):
+    '''
+    Evening peak load and a sunny day
+    '''
+    hours = np.arange(24 * 3600 // STEP) * STEP / 3600
+    load = 0.5 + 1.5 * ((hours > 17) & (hours < 22))
+    pv = np.maximum(0, 5 * np.sin((hours - 6) / 12 * np.pi))
+    return Profile(START, STEP, load, pv).repeat(days)
+
+def stepByStep(sim):
+    '''
+    A slow reference - decide at every poll and simulate one step at a time
+    '''
+    profile = sim.profile
+    times = profile.times
+    (minutes, days) = sim.localise(times)
+    net = profile.pv - profile.load
+    soc = sim.battery.soc
+    power = 0.0
+    socs = []
+    previous = Clock.install(Clock(lambda: sim.now, timezone=sim.timezone))
+    try:
+        for i in range(len(profile)):
+            sim.now = times[i]
+            if i == 0 or days[i] != days[i - 1]:
+                timings = TimedTarget.loadTargets(sim.soc_min)
+            if i % sim.poll_steps == 0:
+                j = max(i - 1, 0)
+                (sim.soc, sim.power, sim.load, sim.pv) = (soc, power, profile.load[j], profile.pv[j])
+                sim._decide(timings)
+            new = sim._simulate(minutes[i:i + 1], net[i:i + 1], soc)[0]
+            change = new - soc
+            power = change / sim.charge_rate if change > 0 else change / sim.discharge_rate
+            soc = new
+            socs.append(soc)
+    finally:
+        Clock.install(previous)
+    return np.array(socs)
+
+def test_accumulate():
+    '''
+    Test the vectorised bounded running sum against a simple loop
+    '''
+    rng = np.random.default_rng(42)
+    delta = rng.normal(0, 3, 5000)
+    delta[1000:1500] = 1
+    delta[3000:3500] = -1
+    out = np.empty(len(delta))
+    _accumulate(50.0, delta, 10.0, 90.0, out)
+    soc = 50.0
+    for (k, d) in enumerate(delta):
+        soc = min(max(soc + d, 10.0), 90.0)
+        assert out[k] == pytest.approx(soc)
+
+def test_profile(tmpdir):
+    '''
+    Test loading a profile from the monitoring CSV
+    '''
+    path = f'{tmpdir}/history.csv'
+    with open(path, 'w') as ofd:
+        ofd.write('timestamp,total_load_active_power,total_dc_power,\n')
+        ofd.write('2024-06-03 00:00:00,1.0,--,\n')
+        ofd.write('2024-06-03 00:00:30,1.0,0.0,\n')
+        ofd.write('2024-06-03 00:01:30,,3.0,\n')
+        ofd.write('2024-06-03 00:02:30,3.0,3.0,\n')
+    profile = Profile.fromCSV(path, step=30, timezone=pytz.utc)
+    assert profile.start == START + 30
+    assert list(profile.load) == [1.0, 1.0, 1.0, 2.0, 3.0]
+    assert list(profile.pv) == [0.0, 1.5, 3.0, 3.0, 3.0]
+    with pytest.raises(ValueError):
+        profile.repeat(2)
+    long = dailyProfile(3)
+    assert len(long) == 3 * 2880
+    assert np.array_equal(long.load[:2880], long.load[2880:5760])
+
+def test_forceCharge():
+    '''
+    Test that the real decision logic drives the simulated inverter
+    '''
+    result = Simulator(dailyProfile(2), Battery(soc=20), soc_min=SOC_MIN, poll_interval=30, timezone=pytz.utc).run()
+    # Charged to the target overnight
+    assert result.soc[5 * 120 - 1] == pytest.approx(80)
+    # Then full by the afternoon and held at the evening target
+    assert result.soc[15 * 120] == pytest.approx(100)
+    assert result.soc[21 * 120 - 1] >= 20
+    assert result.changes >= 2
+    assert result.imported_kwh > 0
+    assert result.exported_kwh > 0
+
+@pytest.fixture
+def settings():
+    '''
+    Change the configured decision settings for the test
+    '''
+    config = Config.load()
+    saved = {n: config[n] for n in ('fc_hysteresis', 'fc_projection')}
+    yield config
+    config.update(saved)
+
+@pytest.mark.parametrize('poll_interval', [30, 120])
+@pytest.mark.parametrize('hysteresis', [0.1, 1.0])
+def test_skipping(poll_interval, hysteresis, settings):
+    '''
+    Test that skipping the decisions that do nothing doesn't change the result
+    '''
+    settings.fc_hysteresis = hysteresis
+    fast = Simulator(dailyProfile(2), Battery(soc=20), soc_min=SOC_MIN, poll_interval=poll_interval, timezone=pytz.utc)
+    result = fast.run()
+    slow = Simulator(dailyProfile(2), Battery(soc=20), soc_min=SOC_MIN, poll_interval=poll_interval, timezone=pytz.utc)
+    expected = stepByStep(slow)
+    assert np.allclose(result.soc, expected)
+    assert result.changes == slow.changes
+    assert result.decisions < len(expected) / fast.poll_steps / 10
+
+def test_hysteresis(settings):
+    '''
+    Test that hysteresis stops force charging flipping on and off when
+    the SOC wobbles around a target
+    '''
+    steps = 24 * 3600 // STEP
+    wobbly = Profile(START, STEP, np.full(steps, 1.0), 0.95 + 0.3 * np.sin(np.arange(steps) / 20))
+    soc_min = [{'start': '00:00', 'stop': '24:00', 'target': 50}]
+    changes = []
+    for hysteresis in (0.1, 1.0):
+        settings.fc_hysteresis = hysteresis
+        result = Simulator(wobbly, Battery(soc=52), soc_min=soc_min, poll_interval=30, timezone=pytz.utc).run()
+        assert result.soc.min() >= 50 - 1e-6
+        changes.append(result.changes)
+    assert changes[0] > 10 * changes[1]
+
+def test_projection(settings):
+    '''
+    Test that force charging isn't turned on when the battery is charging
+    fast enough to reach the target anyway
+    '''
+    steps = 2 * 3600 // STEP
+    # Charging at 1kW from PV
+    sunny = Profile(START, STEP, np.full(steps, 1.0), np.full(steps, 2.0))
+    # The SOC is just below the target when it starts
+    soc_min = [{'start': '01:00', 'stop': '02:00', 'target': 60}]
+    changes = []
+    for projection in (0, 600):
+        settings.fc_projection = projection
+        result = Simulator(sunny, Battery(soc=50), soc_min=soc_min, poll_interval=30, timezone=pytz.utc).run()
+        assert result.soc[-1] > 60
+        changes.append(result.changes)
+    assert changes == [2, 0]
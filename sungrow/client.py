@@ -24,14 +24,18 @@
 from datetime import datetime
 import json
 import ssl
+import time
 import requests
 import urllib3
 import websocket
 
-from sungrow.support import SungrowError
+from sungrow.support import SungrowError, SungrowTransientError, SungrowUnavailable
+from util.circuitbreaker import CircuitBreaker, backoff
 from util.classydict import ClassyDict
 from util.config import Config
 from util.hhmmtime import HHMMTime
+from util.metrics import METRICS
+from util.ratelimit import RateLimiter
 
 #-----------------------------------------------------------------
 # Some common, but not obvious, constants
@@ -39,6 +43,69 @@ SH5_ENABLE = 170
 SH5_DISABLE = 85
 SH5_WEEKDAY_ONLY = '0'
 SH5_ALL_DAYS = '1'
+# The longest wait between retries, in seconds
+RETRY_CAP = 30
+# How long, in seconds, to leave the dongle alone after asking it to reboot
+REBOOT_SECONDS = 180
+
+# The circuit breaker shared by all Clients - see _circuitBreaker()
+_breaker = None
+# The request rate limiters for each dongle - see _rateLimiter()
+_limiters = dict()
+
+#-----------------------------------------------------------------
+# Process metrics
+_REQUEST_HELP = 'Latency of requests to the WiNet-S dongle'
+_CALL_SECONDS = METRICS.histogram('optmybat_client_request_seconds', _REQUEST_HELP, method='call')
+_GET_SECONDS = METRICS.histogram('optmybat_client_request_seconds', _REQUEST_HELP, method='get')
+_POST_SECONDS = METRICS.histogram('optmybat_client_request_seconds', _REQUEST_HELP, method='post')
+_CONNECTS = METRICS.counter('optmybat_client_connects_total', 'Connections made to the WiNet-S dongle')
+_CONNECT_FAILURES = METRICS.counter('optmybat_client_connect_failures_total', 'Failed connections to the WiNet-S dongle')
+_RETRIES = METRICS.counter('optmybat_client_retries_total', 'Requests to the WiNet-S dongle tried again after a transient failure')
+_REQUEST_FAILURES = METRICS.counter('optmybat_client_request_failures_total', 'Requests to the WiNet-S dongle that failed after any retries')
+_CIRCUIT_OPEN = METRICS.gauge('optmybat_client_circuit_open', 'Whether requests to the WiNet-S dongle are being stopped after repeated failures')
+_REBOOTS = METRICS.counter('optmybat_client_reboots_total', 'Reboots of the WiNet-S dongle after repeated failures')
+_RATE_LIMITED = METRICS.counter('optmybat_client_rate_limited_total', 'Requests to the WiNet-S dongle delayed by the rate limit')
+_RATE_LIMIT_SECONDS = METRICS.counter('optmybat_client_rate_limit_seconds_total', 'Time spent waiting for the rate limit')
+_WRITE_SECONDS = METRICS.histogram('optmybat_client_write_seconds', 'Time taken to write, and if verifying read back, parameters')
+_WRITE_RETRIES = METRICS.counter('optmybat_client_write_retries_total', 'Parameter writes repeated because the read back values differed')
+_WRITE_FAILURES = METRICS.counter('optmybat_client_write_failures_total', 'Parameter writes that failed or could not be verified')
+
+def _circuitBreaker(config):
+    '''
+    :returns: the CircuitBreaker for the configured settings.  It is kept,
+            with its count of failures, until the settings change.
+    '''
+    global _breaker
+    settings = (int(config.breaker_threshold), float(config.breaker_cooldown))
+    if _breaker is None or _breaker[0] != settings:
+        _breaker = (settings, CircuitBreaker(*settings))
+    return _breaker[1]
+
+def _rateLimiter(config, host):
+    '''
+    :returns: the RateLimiter, shared with any other process, for requests
+            to the host or None if requests aren't limited
+    '''
+    rate = float(config.request_rate)
+    if rate <= 0:
+        return None
+    key = (host, rate, int(config.request_burst))
+    if key not in _limiters:
+        _limiters[key] = RateLimiter(host, rate, int(config.request_burst))
+    return _limiters[key]
+
+def _sameValue(read, written):
+    '''
+    :returns: True if a value read back from the inverter is the value
+            written - the inverter may format numbers differently
+    '''
+    if read is None:
+        return False
+    try:
+        return float(read) == float(written)
+    except (TypeError, ValueError):
+        return str(read) == str(written)
 
 class Client(object):
     '''
@@ -64,7 +131,7 @@ class Client(object):
         self.ws_socket = None
         self.ws_token = ''
         if not self.connect():
-            raise SungrowError(f"Can't connect to {self.sg_host}")
+            raise SungrowTransientError(f"Can't connect to {self.sg_host}")
         self.logger.debug('Connected to %s', self.sg_host)
 
     # Basic methods
@@ -73,6 +140,7 @@ class Client(object):
         Connect via WebSocket to the dongle, authenticate and fetch some information.
 
         :returns: True if connection succeeded, False otherwise
+        :raises: SungrowUnavailable if the dongle has been failing
         '''
         # If already connected, reuse
         if self.ws_token != '':
@@ -83,11 +151,14 @@ class Client(object):
         self.session = requests.Session()
         # Connect to the websocket
         try:
-            self.ws_socket = websocket.WebSocket(sslopt={"cert_reqs": ssl.CERT_NONE})
-            self.ws_socket.connect(self.ws_endpoint, timeout=self.timeout)
-        except Exception as err:
-            self.logger.error('Websocket connection to %s failed - %s', self.ws_endpoint, err)
+            self._attempt('connecting', self._openSocket, retries=int(self.config.retries))
+        except SungrowUnavailable:
+            raise
+        except SungrowTransientError as err:
+            self.logger.error(err)
+            _CONNECT_FAILURES.inc()
             return False
+        _CONNECTS.inc()
         self.logger.debug('Connected to %s', self.ws_endpoint)
         # Get a new token
         result = self.call(service='connect')
@@ -140,21 +211,22 @@ class Client(object):
         :returns: a ClassyDict containing the result_data.
         :raises: SungrowError if there was a problem.
         '''
-        if 'service' not in kwargs or kwargs['service'] is None:
-            raise SungrowError('The websocket call requires a service name')
-        if 'lang' not in kwargs:
-            kwargs['lang'] = 'en_us'
-        kwargs['token'] = self.ws_token
-        try:
-            self.logger.debug('Calling %s', json.dumps(kwargs))
-            self.ws_socket.send(json.dumps(kwargs))
-            r = self.ws_socket.recv()
-        except websocket.WebSocketTimeoutException:
-            raise SungrowError(f"Timeout calling {kwargs['service']}")
-        # Convert the reponse
-        rdata = self._parse_response(r)
-        self.logger.debug("Response %s", rdata)
-        return rdata
+        return ClassyDict(self._call(kwargs))
+
+    def callList(self, **kwargs):
+        '''
+        Make a websocket call that returns a list (e.g. the real time stats).
+        The list is returned exactly as parsed, without any conversion, so
+        it can be translated in a single pass by a StatsLayout.
+
+        :param kwargs: the arguments to the websocket call
+        :returns: the result_data list
+        :raises: SungrowError if there was a problem.
+        '''
+        rdata = self._call(kwargs)
+        if not isinstance(rdata.get('list'), list):
+            raise SungrowError(f"Unexpected {kwargs['service']} response - {rdata}")
+        return rdata['list']
 
     def get(self, uri, **kwargs):
         '''
@@ -177,10 +249,10 @@ class Client(object):
         # Add the token to the params
         kwargs['params']['token'] = self.ws_token
         self.logger.debug('GET https://%s%s', self.sg_host, uri)
-        try:
-            r = self.session.get(f'https://{self.sg_host}{uri}', **kwargs)
-        except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectTimeout):
-            raise SungrowError(f"Time out while trying to access https://{self.sg_host}{uri}")
+        def request():
+            with _GET_SECONDS.time():
+                return self._request(self.session.get, uri, kwargs)
+        r = self._attempt(f'GET {uri}', request, retries=int(self.config.retries))
         if r.status_code != 200:
             raise SungrowError(f'Failed to access https://{self.sg_host}{uri} - {r.status_code} - {r.text}')
         # Convert the reponse
@@ -209,10 +281,11 @@ class Client(object):
         # Add the token to the params
         kwargs['params']['token'] = self.ws_token
         self.logger.debug('POST https://%s%s params=%s', self.sg_host, uri, kwargs['params'])
-        try:
-            r = self.session.post(f'https://{self.sg_host}{uri}', **kwargs)
-        except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectTimeout):
-            raise SungrowError(f"Time out while trying to access https://{self.sg_host}{uri}")
+        def request():
+            with _POST_SECONDS.time():
+                return self._request(self.session.post, uri, kwargs)
+        # Not retried - e.g. a reboot
+        r = self._attempt(f'POST {uri}', request)
         if r.status_code != 200:
             raise SungrowError(f'Failed to access https://{self.sg_host}{uri} - {r.status_code} - {r.text}')
         return r.text
@@ -224,14 +297,46 @@ class Client(object):
         result = self.call(service='login', passwd=password, username=username)
         self.ws_token = result.token
 
-    def setParams(self, params):
+    def setParams(self, params, verify=None):
         '''
         Set some parameter values on the inverter
 
         :param params: A Parameters object containing the registers that need to be set
+        :param verify: read the registers back, in the same session, and
+                    write again any that differ, up to verify_retries times.
+                    Defaults to the configured verify_writes.
 
         :returns: True if the setting worked
         '''
+        if verify is None:
+            verify = self.config.verify_writes
+        registers = params.dump()
+        with _WRITE_SECONDS.time():
+            ok = self._writeParams(registers)
+            retries = int(self.config.verify_retries)
+            while ok and verify:
+                registers = self._unchangedParams(registers)
+                if not registers:
+                    break
+                if retries <= 0:
+                    self.logger.warning(f"Failed to verify {[r['param_addr'] for r in registers]} - read back different values")
+                    ok = False
+                    break
+                self.logger.info(f"Writing {[r['param_addr'] for r in registers]} again - read back different values")
+                _WRITE_RETRIES.inc()
+                retries -= 1
+                ok = self._writeParams(registers)
+        if not ok:
+            _WRITE_FAILURES.inc()
+        return ok
+
+    # Utility methods
+    def _writeParams(self, registers):
+        '''
+        Write a list of dumped registers and check the result codes
+
+        :returns: True if the inverter accepted all of them
+        '''
         result = self.call(
             service='param',
             dev_code=self.inverter_code,
@@ -239,7 +344,7 @@ class Client(object):
             devid_array=[self.inverter_id],
             type='9',
             count='1',
-            list=params.dump()
+            list=registers
         )
         # Check for success
         for r in result.list:
@@ -250,12 +355,140 @@ class Client(object):
                 return False
         return True
 
-    # Utility methods
-    def _parse_response(self, body):
+    def _unchangedParams(self, registers):
+        '''
+        Read the registers back from the inverter
+
+        :param registers: a list of dumped registers that were written
+        :returns: the registers whose values on the inverter are different
+        '''
+        r = self.get('/device/getParam', params={'dev_id': self.inverter_id, 'dev_type': self.inverter_type, 'dev_code': self.inverter_code, 'type': 9})
+        if 'list' not in r:
+            raise SungrowError(f"Unexpected getParam response - {r}")
+        # The dongle returns the whole list so only compare what was written
+        current = {p['param_addr']: p['param_value'] for p in r.list}
+        return [reg for reg in registers if not _sameValue(current.get(reg['param_addr']), reg['param_value'])]
+
+    def _openSocket(self):
+        '''
+        Open the websocket
+        '''
+        try:
+            ws_socket = websocket.WebSocket(sslopt={"cert_reqs": ssl.CERT_NONE})
+            ws_socket.connect(self.ws_endpoint, timeout=self.timeout)
+        except Exception as err:
+            raise SungrowTransientError(f'Websocket connection to {self.ws_endpoint} failed - {err}')
+        self.ws_socket = ws_socket
+
+    def _request(self, method, uri, kwargs):
+        '''
+        Make an HTTP request to the dongle
+
+        :param method: the session's get or post
+        :returns: the requests Response
+        :raises: SungrowTransientError if it timed out or couldn't connect
+        '''
+        try:
+            return method(f'https://{self.sg_host}{uri}', **kwargs)
+        except requests.exceptions.Timeout:
+            raise SungrowTransientError(f"Time out while trying to access https://{self.sg_host}{uri}")
+        except requests.exceptions.ConnectionError as err:
+            raise SungrowTransientError(f"Failed to connect to https://{self.sg_host}{uri} - {err}")
+
+    def _attempt(self, what, request, retries=0):
+        '''
+        Make a request unless the circuit breaker is open, retrying
+        transient failures after a jittered exponential backoff.  Every
+        attempt waits its turn for the request rate limit.
+
+        :param what: what the request is doing - for messages
+        :param request: a function making the request
+        :param retries: how many times to retry transient failures
+        :returns: what the request returned
+        :raises: SungrowUnavailable if the circuit breaker is open or the
+                last SungrowTransientError if all the attempts failed
+        '''
+        breaker = _circuitBreaker(self.config)
+        if not breaker.allow():
+            raise SungrowUnavailable(f"Not {what} - {self.sg_host} has failed {breaker.failures} times in a row")
+        limiter = _rateLimiter(self.config, self.sg_host)
+        for attempt in range(retries + 1):
+            if limiter is not None:
+                waited = limiter.acquire()
+                if waited > 0:
+                    _RATE_LIMITED.inc()
+                    _RATE_LIMIT_SECONDS.inc(waited)
+            try:
+                result = request()
+                break
+            except SungrowTransientError as err:
+                if attempt == retries:
+                    self._failed(breaker)
+                    raise
+                delay = backoff(attempt, float(self.config.retry_delay), RETRY_CAP)
+                self.logger.warning(f"{err} - trying again in {delay:.1f}s")
+                _RETRIES.inc()
+                time.sleep(delay)
+        breaker.success()
+        _CIRCUIT_OPEN.set(0)
+        return result
+
+    def _failed(self, breaker):
+        '''
+        Record a failed request and, if the dongle keeps failing, back off
+        or ask it to reboot.  A reboot needs the dongle to be answering
+        enough to have logged in.
+        '''
+        _REQUEST_FAILURES.inc()
+        if breaker.failure():
+            _CIRCUIT_OPEN.set(1)
+            self.logger.error(f"{self.sg_host} has failed {breaker.failures} times in a row - backing off")
+        reboot_after = int(self.config.reboot_after)
+        if reboot_after <= 0 or breaker.failures < reboot_after or not self.ws_token:
+            return
+        self.logger.warning(f"{self.sg_host} has failed {breaker.failures} times in a row - rebooting it")
+        try:
+            self.session.post(f'https://{self.sg_host}/system/maintenance', params={'reboot': 1, 'token': self.ws_token}, timeout=self.timeout, verify=False)
+            _REBOOTS.inc()
+        except requests.exceptions.RequestException as err:
+            self.logger.error(f"Failed to reboot {self.sg_host} - {err}")
+        # Leave it alone while it restarts, then count afresh
+        breaker.failures = 0
+        breaker.trip(REBOOT_SECONDS)
+        _CIRCUIT_OPEN.set(1)
+
+    def _call(self, kwargs):
+        '''
+        Make a websocket call and return the unconverted result_data
+        '''
+        if 'service' not in kwargs or kwargs['service'] is None:
+            raise SungrowError('The websocket call requires a service name')
+        if 'lang' not in kwargs:
+            kwargs['lang'] = 'en_us'
+        kwargs['token'] = self.ws_token
+        def request():
+            try:
+                with _CALL_SECONDS.time():
+                    self.ws_socket.send(json.dumps(kwargs))
+                    return self.ws_socket.recv()
+            except websocket.WebSocketTimeoutException:
+                raise SungrowTransientError(f"Timeout calling {kwargs['service']}")
+            except (websocket.WebSocketConnectionClosedException, OSError) as err:
+                raise SungrowTransientError(f"Lost the connection calling {kwargs['service']} - {err}")
+        self.logger.debug('Calling %s', json.dumps(kwargs))
+        # Not retried - a late response would be read as the next call's
+        r = self._attempt(f"calling {kwargs['service']}", request)
+        # Convert the reponse
+        rdata = self._parse_response(r, convert=False)
+        self.logger.debug("Response %s", rdata)
+        return rdata
+
+    def _parse_response(self, body, convert=True):
         '''
         Parse the response from a request to the inverter.  Raises an
         SungrowError if not the expected format or the response contains
-        an error.  Otherwise it returns a ClassyDict of the result_data.
+        an error.  Otherwise it returns a ClassyDict of the result_data
+        or, if convert is False, the result_data exactly as parsed.
         '''
         try:
             r = json.loads(body)
@@ -265,4 +498,4 @@ class Client(object):
             raise SungrowError(f'Unexpected response - {r}')
         if r['result_code'] != 1:
             raise SungrowError(f'Received error response code {r["result_code"]} - {r["result_msg"]}')
-        return ClassyDict(r['result_data'])
+        return ClassyDict(r['result_data']) if convert else r['result_data']
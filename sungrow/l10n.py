@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Human readable labels for the Sungrow I18N keys.  The (large) catalogue in
+# sungrow.sh5l10n is only imported the first time a label is needed so that
+# the control loop never pays for it.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import importlib
+
+from sungrow.sh5params import SH5_POWER_STATS_MAP, SH5_BATTERY_STATS_MAP
+
+# Loaded on demand - see _catalogue() and _reverseIndex()
+_labels = None
+_index = None
+_properties = None
+
+def _catalogue():
+    '''
+    :returns: the I18N key to English text map, importing it if needed
+    '''
+    global _labels
+    if _labels is None:
+        _labels = importlib.import_module('sungrow.sh5l10n').SH5_L10N_EN
+    return _labels
+
+def _normalise(text):
+    '''
+    Normalise text for reverse lookups - case and white space are ignored
+    '''
+    return ' '.join(text.split()).casefold()
+
+def _reverseIndex():
+    '''
+    :returns: a map of normalised English text to a sorted list of I18N keys
+    '''
+    global _index
+    if _index is None:
+        index = dict()
+        for (key, text) in _catalogue().items():
+            index.setdefault(_normalise(text), list()).append(key)
+        for keys in index.values():
+            keys.sort()
+        _index = index
+    return _index
+
+def isLoaded():
+    '''
+    :returns: True if the catalogue has been imported
+    '''
+    return _labels is not None
+
+def label(key, default=None):
+    '''
+    Translate an I18N key (e.g. I18N_COMMON_BATTERY_SOC) to English.
+
+    :param key: the I18N key
+    :param default: returned if the key is unknown.  Defaults to the key itself.
+    :returns: the English text
+    '''
+    text = _catalogue().get(key)
+    if text is None:
+        return key if default is None else default
+    return text.strip()
+
+def findKeys(text):
+    '''
+    Reverse lookup - find the I18N keys for some English text.
+
+    :returns: a (possibly empty) list of keys
+    '''
+    return list(_reverseIndex().get(_normalise(text), []))
+
+def propertyLabel(name):
+    '''
+    Translate one of our stat property names (e.g. battery_level_soc) to the
+    inverter's English label.
+
+    :returns: the label or a tidied up version of the name if there isn't one
+    '''
+    global _properties
+    if _properties is None:
+        properties = dict()
+        for stats_map in (SH5_POWER_STATS_MAP, SH5_BATTERY_STATS_MAP):
+            for (key, prop) in stats_map.items():
+                properties[prop] = key
+        _properties = properties
+    key = _properties.get(name)
+    default = name.replace('__', '_').replace('_', ' ').capitalize()
+    return default if key is None else label(key, default)
@@ -21,21 +21,129 @@
 #
 # You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
 
+import copy
+import logging
+import signal
 import sys
 import time
 
 from monitoring.monitoring import Monitoring
 from sungrow.services import Services
-from sungrow.support import SungrowError, TimedTarget
+from sungrow.support import SungrowError, SungrowUnavailable, TimedTarget
 from util.config import Config
+from util.configwatcher import ConfigWatcher
+from util.clock import Clock
 from util.hhmmtime import HHMMTime
+from util.metrics import METRICS
+from util.ringbuffer import RingBuffer
 
 #---------------------------------------------------------------------
 # Some globals because I'm lazy
-logger = None
+logger = logging.getLogger()
 status_store = None
+# (the planner configuration, the Planner built from it) - see currentPlanner()
+planner = None
 
-def updateForceCharge():
+# The recent SOCs for projecting the charge rate - see updateForceCharge()
+soc_history = RingBuffer(('soc',), 240)
+
+# A soc_min target sized from the forecasts - see sizeTargets()
+AUTO = 'auto'
+
+# The longest sleep with a native_schedule, so that config changes and
+# new plans are picked up
+NATIVE_MAX_SLEEP = 900
+
+#---------------------------------------------------------------------
+# Process metrics
+_POLL_SECONDS = METRICS.histogram('optmybat_poll_duration_seconds', 'Time taken by each control cycle')
+_POLL_FAILURES = METRICS.counter('optmybat_poll_failures_total', 'Control cycles that failed with an exception')
+_POLL_TIMESTAMP = METRICS.gauge('optmybat_poll_timestamp_seconds', 'Time of the last completed control cycle')
+
+def validateConfig(config):
+    '''
+    Make sure that a new configuration is usable before it replaces the
+    current one.  Raises an exception if it isn't.
+    '''
+    for t in config.soc_min:
+        if 'days' in t and not all(isinstance(d, int) and 0 <= d <= 6 for d in t['days']):
+            raise ValueError(f"soc_min days must be 0 (Monday) to 6 (Sunday) - {t}")
+    if any(t.get('target') == AUTO for t in config.soc_min) and not config.planner:
+        raise ValueError(f"soc_min targets can only be {AUTO} with a planner section")
+    # Compile the whole schedule, whatever today is
+    TimedTarget.loadTargets([{n: (100 if n == 'target' and v == AUTO else v) for (n, v) in t.items() if n != 'days'} for t in config.soc_min])
+    if config.planner:
+        # Check the settings without reading the history
+        newPlanner(config.planner, learn=False)
+
+def sizeTargets(targets, charge_planner):
+    '''
+    Replace the automatic targets with the SOC needed to cover the
+    forecast load from the end of the target until PV exceeds it.
+
+    :param targets: soc_min style targets
+    :returns: the targets with numeric SOCs
+    '''
+    sized = list()
+    for t in targets:
+        if t['target'] == AUTO:
+            t = dict(t, target=charge_planner.coverTarget(t['stop']))
+            logger.debug("Sized the %s to %s target to %s%%", t['start'], t['stop'], t['target'])
+        sized.append(t)
+    return sized
+
+def newPlanner(parameters, learn=True):
+    '''
+    :param learn: set False to not read the forecast history
+    :returns: a Planner for the planner settings.  Planning needs numpy so
+            it's only imported when there is a planner section.
+    '''
+    from planning.forecast import Forecaster
+    from planning.planner import Planner
+    forecast = None
+    if not learn and 'history' in parameters:
+        forecast = Forecaster.fromConfig(parameters, learn=False)
+    return Planner(parameters, forecast=forecast)
+
+def currentPlanner(config):
+    '''
+    :returns: the Planner for the configured planner settings or None if
+            planning isn't enabled.  The Planner (with its saved plan and
+            what the forecasts have learnt) is kept until the settings
+            change - not just when the config is reloaded.
+    '''
+    global planner
+    parameters = config.planner
+    if not parameters:
+        return None
+    if planner is None or planner[0] != parameters:
+        planner = (copy.deepcopy(parameters), newPlanner(parameters))
+    return planner[1]
+
+def observe(client, charge_planner):
+    '''
+    Save a row of status data if requested and keep the forecasts up to date
+    '''
+    if status_store is not None or charge_planner is not None:
+        stats = client.getInverterStats()
+        if status_store is not None:
+            status_store.save(stats)
+        if charge_planner is not None:
+            charge_planner.forecast.observe(stats)
+
+def compileTargets(config, charge_planner, soc):
+    '''
+    :returns: today's TimedTargets - the configured soc_min plus, if
+            enabled, the planner's targets
+    '''
+    targets = config.soc_min
+    if charge_planner is not None:
+        targets = sizeTargets(targets, charge_planner)
+        if charge_planner.parameters.get('plan', True):
+            targets = targets + charge_planner.targets(soc)
+    return TimedTarget.loadTargets(targets)
+
+def updateForceCharge(services=None, timings=None, history=None):
     '''
     Check the targets against the current force charge state and,
     if needed, update the force charge state.
@@ -43,27 +151,58 @@ def updateForceCharge():
     Note - we deliberately get a new HTTP connection every time because
     the dongle doesn't like long running connections.  The aim is to get
     in and get out as quickly as possible.
+
+    :param services: the Services to use (e.g. a simulated inverter's).
+            Defaults to connecting to the inverter.
+    :param timings: the TimedTargets to use.  Defaults to the configured soc_min
+            plus, if enabled, the planner's targets.
+    :param history: the RingBuffer of recent SOCs.  Defaults to soc_history.
+    :returns: True if the force charge settings were changed
     '''
     # Get connected and authenticated as a power user
-    client = Services()
-    # Save a row of status data if requested
-    if status_store is not None:
-        status_store.save(client.getInverterStats())
+    client = Services() if services is None else services
+    config = Config.load()
+    charge_planner = currentPlanner(config) if timings is None else None
+    observe(client, charge_planner)
     # Get the current inverter and battery state
     soc = client.getBatterySOC()
     charge = client.getBatteryCharging()
     fc_target = client.getForceChargeStatus()
+    history = soc_history if history is None else history
+    history.append(Clock.default().time(), {'soc': soc})
+    # Where the recent charge rate will take the SOC in the next
+    # fc_projection seconds
+    hysteresis = float(config.fc_hysteresis)
+    projection = float(config.fc_projection)
+    rate = history.rate('soc', projection) if projection > 0 else None
+    projected = soc if rate is None else soc + rate * projection
     # Search for a target that is active now AND the battery level is lower
     # than the target.  If none, the target will be to disable force charging
-    timings = TimedTarget.loadTargets(Config.load().soc_min)
+    if timings is None:
+        timings = compileTargets(config, charge_planner, soc)
     logger.debug("Targets are %s", timings)
     target = None
     now = HHMMTime.now()
     for t in timings:
-        # Add a fudge factor (0.1) to the target to avoid bouncing around the target
-        if now >= t.start and now < t.stop and soc <= (t.target+0.1):
-            target = t
-            break
+        # Note that 00:00 >= 24:00 so this isn't now < start or now >= stop
+        if not (now >= t.start and now < t.stop):
+            continue
+        if fc_target == t.target:
+            # Once force charging to the target, keep going until the
+            # battery is clearly, and staying, above it
+            if min(soc, projected) > t.target + hysteresis:
+                continue
+        else:
+            # Add a fudge factor (0.1) to the target to avoid bouncing around the target
+            if soc > t.target + 0.1:
+                continue
+            if projected > soc and projected >= t.target:
+                # Already charging fast enough to reach the target soon
+                logger.debug(f"SoC is {soc}% and rising {rate * 60:.3f}%/min - not force charging to {t.target}")
+                continue
+        # A copy because the times may be adjusted below
+        target = copy.copy(t)
+        break
     logger.debug(f"SoC is {soc}%, Force Charge is {'disabled' if fc_target == 0 else fc_target}, want {target}")
     # Work out what needs to be done
     if target is None:
@@ -76,17 +215,19 @@ def updateForceCharge():
     elif fc_target == target.target:
         # the battery is less than or equal to target but
         # force charging is already correctly set
-        if charge >= 0:
-            # Everything is good - do nothing
+        if charge >= 0 or soc >= target.target - hysteresis:
+            # Everything is good, or the battery is just settling on
+            # the target - do nothing
             target = None
         else:
             # Eh? - Force charging is correctly set but the battery is discharging
             logger.warning(f"Battery discharging but charging is set to {fc_target}")
             target.stop = target.stop + 60
-            target.start = now - 60
+            target.start = HHMMTime(max(now.value - 60, 0))
     else:
-        # Need to update force charging
-        target.start = now - 60
+        # Need to update force charging.  Start an hour ago in case the
+        # inverter's clock is behind, but not yesterday
+        target.start = HHMMTime(max(now.value - 60, 0))
     # Do the needful
     if target is None:
         logger.info(f"Doing nothing - battery is {soc}%, {'' if fc_target == 0 else 'force '}{'discharging' if charge < 0 else 'charging'} at {charge}kW")
@@ -99,39 +240,115 @@ def updateForceCharge():
     client.close()
     return target is not None
 
-def doWork():
+def scheduleForceCharge(services=None, timings=None):
+    '''
+    Program the current (or next) force charge window and the one after
+    it in to the inverter, in one write, so that the inverter moves
+    between them on its own.  Nothing is written if the inverter already
+    has them.
+
+    :param services: the Services to use.  Defaults to connecting to the inverter.
+    :param timings: the TimedTargets to use.  Defaults to the configured soc_min
+            plus, if enabled, the planner's targets.
+    :returns: the number of seconds until the first window ends, when the
+            windows need moving on
+    '''
+    client = Services() if services is None else services
+    config = Config.load()
+    charge_planner = currentPlanner(config) if timings is None else None
+    observe(client, charge_planner)
+    if timings is None:
+        timings = compileTargets(config, charge_planner, client.getBatterySOC())
+    now = HHMMTime.now()
+    windows = [t for t in timings if now < t.stop and t.target > 0][:2]
+    if client.setForceChargeWindows(windows):
+        logger.info("Set the force charge windows to %s", ' and '.join(f'{t.target}% from {t.start} to {t.stop}' for t in windows) or 'none')
+    else:
+        logger.info("Doing nothing - the force charge windows are up to date")
+    client.close()
+    # Wake up when the first window ends or, if there aren't any, at midnight
+    end = windows[0].stop.value if windows else HHMMTime.ONE_DAY
+    return max(end * 60 - Clock.default().localTime() % 86400, 1)
+
+def doWork(work=updateForceCharge):
     '''
     Wrap the real work in some exception handling
+
+    :param work: the function that does the work
+    :returns: what the work returned or False if it failed
     '''
     did_it = False
     try:
-        did_it = updateForceCharge()
+        with _POLL_SECONDS.time():
+            did_it = work()
+    except SungrowUnavailable as err:
+        # Backing off while the inverter is failing
+        _POLL_FAILURES.inc()
+        logger.warning(err)
     except SungrowError as err:
+        _POLL_FAILURES.inc()
         logger.critical(err)
     except Exception as err:
+        _POLL_FAILURES.inc()
         logger.critical('Unexpected %s exception', type(err).__name__, exc_info = True)
+    _POLL_TIMESTAMP.set(time.time())
     return did_it
 
+def terminate(signum, frame):
+    '''
+    Stop on SIGTERM (e.g. from podman or systemd) the same way as on ^C so
+    that buffered monitoring data is written
+    '''
+    raise KeyboardInterrupt()
+
 def main(args):
     # Get some config
     global logger
     global status_store
     config = Config.load()
     logger = config.logger
+    # The watcher only checks the configs it reloads
+    try:
+        validateConfig(config)
+    except Exception as err:
+        logger.critical(f"Invalid configuration in {config.config_path} - {err}")
+        sys.exit(1)
     status_store = None
     if 'monitoring' in config:
         status_store = Monitoring(config.monitoring, Services.getInverterStatNames())
+    # Pick up config changes in the background
+    watcher = None
+    if not args.once:
+        watcher = ConfigWatcher(validate=validateConfig).start()
+    signal.signal(signal.SIGTERM, terminate)
     # Do the work
     try:
         if args.once:
-            did_it = doWork()
+            did_it = doWork(scheduleForceCharge if config.native_schedule else updateForceCharge)
         else:
             did_it = True
             while True:
-                if not doWork():
+                config = Config.load()
+                if not config.native_schedule:
+                    if not doWork():
+                        did_it = False
+                    time.sleep(config.poll_interval)
+                    continue
+                # The inverter moves between the windows on its own so only
+                # wake up to move them on, to monitor or to pick up changes
+                wake = doWork(scheduleForceCharge)
+                if not wake:
                     did_it = False
-                time.sleep(Config.load().poll_interval)
+                    wake = config.poll_interval
+                elif status_store is not None:
+                    wake = min(wake, config.poll_interval)
+                time.sleep(min(wake, NATIVE_MAX_SLEEP))
     except KeyboardInterrupt:
         pass
+    if watcher is not None:
+        watcher.stop()
+    # Make sure any buffered monitoring data is written
+    if status_store is not None:
+        status_store.close()
     # Exit appropriately
     sys.exit(0 if did_it else 1)
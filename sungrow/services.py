@@ -22,15 +22,17 @@
 # You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
 
 from datetime import datetime
-import time
 
 from sungrow.client import Client
 from sungrow.parameters import Parameters
 from sungrow.sh5params import SH5_FORCE_CHARGE_PARAM_MAP, SH5_FORCE_CHARGE_PARAMS, SH5_POWER_STATS_MAP, SH5_BATTERY_STATS_MAP
+from sungrow.stats import CombinedStats, StatsLayout, StatsView
 from sungrow.support import SungrowError
 from util.classydict import ClassyDict
+from util.clock import Clock
 from util.config import Config
 from util.hhmmtime import HHMMTime
+from util.metrics import METRICS
 
 #-----------------------------------------------------------------
 # Some common, but not obvious, constants
@@ -39,13 +41,27 @@ SH5_DISABLE = 85
 SH5_WEEKDAY_ONLY = '0'
 SH5_ALL_DAYS = '1'
 
+def _cacheAccess(cache, hit):
+    '''
+    Record a cache hit or miss in the process metrics.
+    '''
+    hits = METRICS.counter('optmybat_cache_hits_total', 'Reads satisfied from the inverter cache', cache=cache)
+    misses = METRICS.counter('optmybat_cache_misses_total', 'Reads that had to refresh the inverter cache', cache=cache)
+    (hits if hit else misses).inc()
+    METRICS.gauge('optmybat_cache_hit_ratio', 'Fraction of reads satisfied from the inverter cache', cache=cache).set(
+        hits.value / (hits.value + misses.value))
+
 class Services(object):
     '''
     A simple client for talking to a Sungrow inverter via a WiNet-S dongle.
     '''
-    def __init__(self, host=None):
+    def __init__(self, host=None, client=None):
         '''
         Initiate myself then connect.
+
+        :param host: the inverter's host name.  Defaults to the configured sg_host.
+        :param client: an already connected client (e.g. a simulator's) to
+                use instead of connecting to the inverter
         '''
         # Load the configurations
         config = self.config = Config.load()
@@ -54,10 +70,10 @@ class Services(object):
         # Configure self.logger
         self.logger = config.logger
         # Make the connection
-        self.client = Client(host=host)
+        self.client = Client(host=host) if client is None else client
         # Prepare the caches
-        self.battery = ClassyDict({'service': 'real_battery', 'property_map': SH5_BATTERY_STATS_MAP, 'updated': 0})
-        self.power = ClassyDict({'service': 'real', 'property_map': SH5_POWER_STATS_MAP, 'updated': 0})
+        self.battery = ClassyDict({'service': 'real_battery', 'layout': StatsLayout.compile(SH5_BATTERY_STATS_MAP), 'updated': 0})
+        self.power = ClassyDict({'service': 'real', 'layout': StatsLayout.compile(SH5_POWER_STATS_MAP), 'updated': 0})
         self.force_charge = ClassyDict({'updated': 0})
 
     def close(self):
@@ -69,37 +85,33 @@ class Services(object):
     def getCachedParams(self, cache):
         '''
         Cache and return some information from the inverter
+
+        :returns: a StatsView of the cached response
         '''
         # Use the cached info if it's less than a few seconds old
-        now = time.time()
+        now = Clock.default().time()
         if cache.updated >= now - self.cache_seconds:
-            return cache
-        # Refresh the cache
-        values = self.client.call(service=cache.service, dev_id=self.client.inverter_id).list
-        property_map = cache.property_map
-        new = dict()
-        for data in values:
-            name = data['data_name']
-            if name in property_map:
-                new[property_map[name]] = data['data_value']
-        # And set missing properties to '--'
-        for p in property_map.values():
-            if not p in new:
-                new[p] = '--'
-        cache.update(new)
+            _cacheAccess(cache.service, True)
+            return cache.view
+        _cacheAccess(cache.service, False)
+        # Refresh the cache with a single pass over the response
+        values = self.client.callList(service=cache.service, dev_id=self.client.inverter_id)
+        cache.view = StatsView.fromResponse(cache.layout, values)
         cache.updated = now
-        self.logger.debug("cached %s details are %s", cache.service, cache)
-        return cache
+        self.logger.debug("cached %s details are %s", cache.service, cache.view)
+        return cache.view
 
     def getInverterStats(self):
         '''
         Get an accumulated set of status information from the inverter
+
+        :returns: a read only, dict-like CombinedStats
         '''
-        stats = ClassyDict()
-        stats.update(self.getCachedParams(self.power))
-        stats.update(self.getCachedParams(self.battery))
-        stats['force_charge_status'] = str(self.getForceChargeStatus())
-        return stats
+        return CombinedStats(
+            self.getCachedParams(self.power),
+            self.getCachedParams(self.battery),
+            force_charge_status=self.getForceChargeStatus()
+        )
 
     @classmethod
     def getInverterStatNames(cls):
@@ -116,19 +128,19 @@ class Services(object):
         charging, negative number means it's discharging.
         '''
         info = self.getInverterStats()
-        if info.battery_charging_power == '--' or info.battery_discharging_power == '--':
+        if info.battery_charging_power is None or info.battery_discharging_power is None:
             raise SungrowError(f"Current battery charge rate is undefined")
-        return float(info.battery_charging_power) - float(info.battery_discharging_power)
+        return info.battery_charging_power - info.battery_discharging_power
 
     def getBatterySOC(self):
         '''
         Return the current battery State of Charge
         '''
         soc = self.getInverterStats().battery_level_soc
-        if soc == '--':
+        if soc is None:
             raise SungrowError(f"Current battery state of charge is undefined")
         self.logger.debug(f'Current SOC is {soc}%')
-        return float(soc)
+        return soc
 
     def getForceChargeStatus(self):
         '''
@@ -138,10 +150,12 @@ class Services(object):
         Note: assumes that force charging is applied every day
         '''
         # Use the cached info if it's less than a few seconds old
-        now = time.time()
+        now = Clock.default().time()
         fcp = self.force_charge
         if fcp.updated >= now - self.cache_seconds:
+            _cacheAccess('force_charge', True)
             return fcp.status
+        _cacheAccess('force_charge', False)
         # Read the force charg status from the inverter
         fcp = self.force_charge = Parameters().loadAddressMap(SH5_FORCE_CHARGE_PARAM_MAP)
         # Get the energy management parameters
@@ -197,7 +211,7 @@ class Services(object):
             # Request the time from the inverter
             r = self.client.get('/time/get')
             # Convert it to an epoch time
-            now = datetime.now(tz=self.config.timezone)
+            now = datetime.fromtimestamp(Clock.default().time(), tz=self.config.timezone)
             inverter_now = datetime.strptime(r.time, '%Y-%m-%d %H:%M')
             if self.config.timezone is not None:
                 inverter_now = self.config.timezone.localize(inverter_now)
@@ -221,7 +235,7 @@ class Services(object):
         stats.soc = self.getBatterySOC()
         stats.fc_state = self.getForceChargeStatus()
         stats.battery = self.getBatteryCharging()
-        stats.mains = float(power.purchased_power)
+        stats.mains = power.purchased_power
         stats.raw = power
         return stats
 
@@ -247,6 +261,75 @@ class Services(object):
         :param target: an TimedTarget specifying the start and end times and
                     the target battery level
         '''
+        # Get the inverter time shift and calculate the real start
+        # and end times accounting for time wrapping
+        if target.target == 0:
+            # Target is 0 - force disable
+            windows = []
+        else:
+            windows = self._inverterWindows(target, self.getInverterTimeShift())
+        if not self._writeWindows(windows):
+            raise SungrowError(f"Failed to set forced charge to minimum {target}")
+        self.logger.debug(f"Set force charge to minimum {target}")
+
+    def setForceChargeWindows(self, targets):
+        '''
+        Program up to two force charge windows in one write so that the
+        inverter moves between them on its own.  Nothing is written if the
+        inverter already has these windows.
+
+        A target that the inverter's time shift pushes across midnight
+        needs both of the inverter's windows, so the second target is
+        left out.
+
+        :param targets: up to two TimedTargets, in time order, that don't
+                    wrap around midnight
+        :returns: True if the windows were written
+        '''
+        if len(targets) > 2:
+            raise SungrowError(f"The inverter only has two force charge windows - not {len(targets)}")
+        timeslip = self.getInverterTimeShift()
+        windows = list()
+        for t in targets:
+            needed = self._inverterWindows(t, timeslip)
+            if len(windows) + len(needed) > 2:
+                self.logger.debug(f"No force charge window left for {t}")
+                break
+            windows += needed
+        written = self._writeWindows(windows, changes_only=True)
+        if written is None:
+            return False
+        if not written:
+            raise SungrowError(f"Failed to set the force charge windows to {targets}")
+        self.logger.debug(f"Set the force charge windows to {targets}")
+        return True
+
+    def _inverterWindows(self, target, timeslip):
+        '''
+        :param target: a TimedTarget in local time
+        :param timeslip: the inverter's time shift - see getInverterTimeShift()
+        :returns: the target as (start, end, target) tuples in the inverter's
+                time - two if the time shift makes it wrap around midnight
+        '''
+        start = target.start + timeslip
+        end = target.stop + timeslip
+        if end.value == 0:
+            # Ending at midnight is the end of the day, not the start
+            end = HHMMTime('24:00')
+        if start > end:
+            # time wrap!
+            return [(start, HHMMTime('24:00'), target.target), (HHMMTime('00:00'), end, target.target)]
+        return [(start, end, target.target)]
+
+    def _writeWindows(self, windows, changes_only=False):
+        '''
+        Write the force charge registers in one go
+
+        :param windows: up to two (start, end, target) tuples in the
+                    inverter's time.  Missing windows are disabled.
+        :param changes_only: don't write if the registers already match
+        :returns: the result of the write or None if nothing was written
+        '''
         # Load the status
         self.getForceChargeStatus()
         fcp = self.force_charge
@@ -257,45 +340,25 @@ class Services(object):
             self.client.setParams(fcp)
             # Then do another call to get the values
             self.getForceChargeStatus()
+            fcp = self.force_charge
             if not 'fc1_start_hr' in fcp:
                 raise SungrowError(f'Eh? Not getting the parameters from the inverter')
-        # Convenience variables
-        fc1_soc = target.target
-        fc2_soc = 0     # Assume we won't need the second time slot
-        # Get the inverter time shift and calculate the real start
-        # and end times accounting for time wrapping
-        if fc1_soc == 0:
-            # Target is 0 - force disable
-            fc1_start = fc1_end = HHMMTime('00:00')
-        else:
-            timeslip = self.getInverterTimeShift()
-            fc1_start = target.start + timeslip
-            fc1_end = target.stop + timeslip
-            if fc1_start > fc1_end:
-                # time wrap!
-                fc2_start = HHMMTime('00:00')
-                fc2_end = fc1_end
-                fc2_soc = fc1_soc
-                fc1_end = HHMMTime('24:00')
-        if fc2_soc == 0:
-            # Don't need the second time slot
-            fc2_start = fc2_end = HHMMTime('00:00')
+        # Don't need the unused time slots
+        windows = list(windows) + [(HHMMTime('00:00'), HHMMTime('00:00'), 0)] * (2 - len(windows))
+        values = {'fc_enable': SH5_ENABLE, 'fc_weekdays_only': SH5_ALL_DAYS}
+        for (n, (start, end, soc)) in enumerate(windows, 1):
+            values[f'fc{n}_start_hr'] = start.hours
+            values[f'fc{n}_start_min'] = start.minutes
+            values[f'fc{n}_end_hr'] = end.hours
+            values[f'fc{n}_end_min'] = end.minutes
+            values[f'fc{n}_soc'] = soc
+        if changes_only and all(str(fcp[name].value) == str(value) for (name, value) in values.items()):
+            return None
         # Update the force charge parameters for the new settings
-        fcp.fc_enable.value = SH5_ENABLE
-        fcp.fc_weekdays_only.value = SH5_ALL_DAYS
-        fcp.fc1_start_hr.value = fc1_start.hours
-        fcp.fc1_start_min.value = fc1_start.minutes
-        fcp.fc1_end_hr.value = fc1_end.hours
-        fcp.fc1_end_min.value = fc1_end.minutes
-        fcp.fc1_soc.value = fc1_soc
-        fcp.fc2_start_hr.value = fc2_start.hours
-        fcp.fc2_start_min.value = fc2_start.minutes
-        fcp.fc2_end_hr.value = fc2_end.hours
-        fcp.fc2_end_min.value = fc2_end.minutes
-        fcp.fc2_soc.value = fc2_soc
+        for (name, value) in values.items():
+            fcp[name].value = value
         # Apply the new settings
-        if not self.client.setParams(fcp):
-            raise SungrowError(f"Failed to set forced charge to minimum {target}")
+        result = self.client.setParams(fcp)
         # Make sure that the parameters are read again next time
         fcp.updated = 0
-        self.logger.debug(f"Set force charge to minimum {target}")
+        return result
@@ -3,7 +3,7 @@
 # Copyright 2024 Magus Verde
 #
 # Localised content for the Sungrow SH5 inverter.  Obtained by analysing the web interface
-# traffic and not actually used by optmybat.
+# traffic.  Only used, via sungrow.l10n, when a human readable label is needed.
 #
 # This file is part of Optmybat.
 #
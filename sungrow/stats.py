@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Read only views of the inverter's stats responses.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+from collections.abc import Mapping
+
+# The value the inverter uses for stats that it can't report
+MISSING = '--'
+
+def parseValue(value):
+    '''
+    Convert a value from the inverter to its Python type.
+
+    :returns: a float, None if the value is missing or the original string
+            if it's not a number
+    '''
+    if value is None or value == MISSING:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+def formatValue(value):
+    '''
+    Convert a parsed value back to text, the way the inverter shows it.
+    Missing values are '--'.
+    '''
+    if value is None:
+        return MISSING
+    if isinstance(value, float):
+        return format(value, '.10g')
+    return str(value)
+
+class StatsLayout(object):
+    '''
+    A property map (inverter data_name to our property name) compiled in to
+    a fixed record layout.  Each property has a slot in the record so a
+    response is translated with a single pass over the response list
+    (e.g. [{'data_name': 'I18N_COMMON_BATTERY_SOC', 'data_value': '55', 'data_unit': '%'}, ...])
+    and reading a property is a single index.  Values are parsed once, when
+    the record is filled - see parseValue().
+
+    Use StatsLayout.compile() so that each map is only compiled once.
+    '''
+    # Compiled layouts keyed by the id of their property map
+    _compiled = dict()
+
+    def __init__(self, property_map):
+        '''
+        :param property_map: maps the inverter's data_names to our property names
+        '''
+        self.property_map = property_map
+        self.names = tuple(dict.fromkeys(property_map.values()))
+        self.positions = {prop: i for (i, prop) in enumerate(self.names)}
+        self.slots = {name: self.positions[prop] for (name, prop) in property_map.items()}
+        self.defaults = [None] * len(self.names)
+
+    @classmethod
+    def compile(cls, property_map):
+        '''
+        :returns: the (cached) StatsLayout for a property map
+        '''
+        layout = cls._compiled.get(id(property_map))
+        # The layout keeps a reference to its map so the id can't be reused
+        if layout is None or layout.property_map is not property_map:
+            layout = cls._compiled[id(property_map)] = cls(property_map)
+        return layout
+
+    def fill(self, values):
+        '''
+        Translate a response list in to a record for this layout
+
+        :param values: the response list
+        :returns: (record, units) - lists with a parsed value and a unit
+                for every property
+        '''
+        record = self.defaults.copy()
+        units = self.defaults.copy()
+        slots = self.slots
+        for data in values:
+            i = slots.get(data['data_name'])
+            if i is not None:
+                record[i] = parseValue(data['data_value'])
+                units[i] = data.get('data_unit') or None
+        return (record, units)
+
+class StatsView(Mapping):
+    '''
+    A read only, dict-like view of a stats record that maps our property
+    names on to the record without copying it.  Stats that the
+    inverter didn't report have the value None.
+    '''
+    def __init__(self, layout, record, units=None):
+        '''
+        :param layout: the StatsLayout for the record
+        :param record: the record from StatsLayout.fill()
+        :param units: the units from StatsLayout.fill()
+        '''
+        self._layout = layout
+        self._record = record
+        self._units = units
+
+    @classmethod
+    def fromResponse(cls, layout, values):
+        '''
+        :returns: a view of a response list
+        '''
+        return cls(layout, *layout.fill(values))
+
+    def unit(self, name):
+        '''
+        :returns: the unit reported for a stat (e.g. 'kW') or None
+        '''
+        return None if self._units is None else self._units[self._layout.positions[name]]
+
+    def __getitem__(self, name):
+        return self._record[self._layout.positions[name]]
+
+    def __contains__(self, name):
+        return name in self._layout.positions
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(f"{self.__class__.__name__} has no attribute {name}") from None
+
+    def __iter__(self):
+        return iter(self._layout.names)
+
+    def __len__(self):
+        return len(self._layout.names)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({dict(self)})"
+
+class CombinedStats(Mapping):
+    '''
+    A read only, dict-like view over several stats views (and any extra
+    values) without copying them.  Earlier views win if a name is repeated.
+    '''
+    def __init__(self, *views, **extra):
+        self._views = views + (extra,)
+
+    def __getitem__(self, name):
+        for view in self._views:
+            if name in view:
+                return view[name]
+        raise KeyError(name)
+
+    def unit(self, name):
+        '''
+        :returns: the unit reported for a stat (e.g. 'kW') or None
+        '''
+        for view in self._views:
+            if name in view:
+                return view.unit(name) if isinstance(view, StatsView) else None
+        raise KeyError(name)
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(f"{self.__class__.__name__} has no attribute {name}") from None
+
+    def __iter__(self):
+        seen = set()
+        for view in self._views:
+            for name in view:
+                if name not in seen:
+                    seen.add(name)
+                    yield name
+
+    def __len__(self):
+        return sum(1 for name in self)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({dict(self)})"
@@ -21,7 +21,7 @@
 #
 # You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
 
-from datetime import datetime
+from util.clock import Clock
 from util.hhmmtime import HHMMTime
 
 #-----------------------------------------------------------------
@@ -33,6 +33,17 @@ class SungrowError(Exception):
     def __init__(self, msg):
         super().__init__(msg)
 
+class SungrowTransientError(SungrowError):
+    '''
+    A failure that may go away if tried again - e.g. a time out or
+    a dropped connection
+    '''
+
+class SungrowUnavailable(SungrowTransientError):
+    '''
+    Not tried because the inverter has been failing - see CircuitBreaker
+    '''
+
 #-----------------------------------------------------------------
 # Support classes
 class SungrowTimer(object):
@@ -94,10 +105,10 @@ class TimedTarget(SungrowTimer):
         '''
         # Step 1 - get the configured list converted to HHMMTimes
         targets = []
+        dow = Clock.default().weekday()
         for t in conf:
             if 'days' in t:
                 # only applies on certain days
-                dow = datetime.today().weekday()
                 if dow not in t['days']:
                     continue
             if t['start'] == '24:00':
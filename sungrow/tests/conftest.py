@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Shared fixtures for the Sungrow tests.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+import pytz
+
+from simulator.profile import Profile
+from simulator.simulator import Simulator
+from util.clock import Clock
+
+# Midnight UTC on a Monday
+START = 1717372800
+
+@pytest.fixture
+def sim():
+    '''
+    A simulated inverter with a controllable clock
+    '''
+    profile = Profile(START, 60, np.ones(1440), np.zeros(1440))
+    sim = Simulator(profile, poll_interval=60, timezone=pytz.utc)
+    previous = Clock.install(Clock(lambda: sim.now, timezone=pytz.utc))
+    yield sim
+    Clock.install(previous)
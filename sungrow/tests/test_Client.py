@@ -22,11 +22,19 @@
 #
 # You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
 
+import json
 import pytest
+import requests
 import time
+import websocket
 
+import sungrow.client as client_module
 from sungrow.client import Client
-from sungrow.support import SungrowError
+from sungrow.parameters import Parameters, Register
+from sungrow.support import SungrowError, SungrowTransientError, SungrowUnavailable
+from util.classydict import ClassyDict
+from util.clock import Clock
+from util.config import Config
 
 def testBadHost():
     '''
@@ -48,3 +56,157 @@ def testConnect():
     time.sleep(1)
     assert client.ws_socket is None
     assert not client.ws_token
+
+class LossyClient(Client):
+    '''
+    A Client, without a connection, talking to a dongle that silently
+    drops the first writes to some registers
+    '''
+    def __init__(self, drops):
+        self.config = Config.load()
+        self.logger = self.config.logger
+        (self.inverter_id, self.inverter_type, self.inverter_code) = ('1', '35', '3599')
+        self.registers = {1: '0', 2: '0', 3: '0'}
+        self.drops = drops
+        self.writes = []
+
+    def call(self, **kwargs):
+        self.writes.append(sorted(p['param_addr'] for p in kwargs['list']))
+        for p in kwargs['list']:
+            if self.drops.get(p['param_addr'], 0) > 0:
+                self.drops[p['param_addr']] -= 1
+            else:
+                self.registers[p['param_addr']] = p['param_value']
+        return ClassyDict({'list': [{'param_pid': -1, 'result': 0}]})
+
+    def get(self, uri, **kwargs):
+        return ClassyDict({'list': [{'param_addr': a, 'param_value': v} for (a, v) in self.registers.items()]})
+
+def params():
+    '''
+    Some registers to write
+    '''
+    registers = Parameters()
+    registers.loadRegisters({f'r{a}': Register(f'r{a}', id=a, addr=a, type=2, pname='', value=a * 10) for a in (1, 2, 3)})
+    return registers
+
+def testVerify():
+    '''
+    Test that verified writes retry only the registers that didn't take
+    '''
+    client = LossyClient({2: 1})
+    assert client.setParams(params(), verify=True)
+    assert client.writes == [[1, 2, 3], [2]]
+    assert client.registers == {1: 10, 2: 20, 3: 30}
+    # Unverified writes trust the result codes
+    client = LossyClient({2: 1})
+    assert client.setParams(params(), verify=False)
+    assert client.writes == [[1, 2, 3]]
+    assert client.registers[2] == '0'
+    # The retries are bounded
+    client = LossyClient({3: 10})
+    assert not client.setParams(params(), verify=True)
+    assert client.writes == [[1, 2, 3], [3], [3]]
+
+class FlakySocket(object):
+    '''
+    A websocket that times out a number of times before answering
+    '''
+    def __init__(self, failures):
+        self.failures = failures
+
+    def send(self, body):
+        pass
+
+    def recv(self):
+        if self.failures > 0:
+            self.failures -= 1
+            raise websocket.WebSocketTimeoutException('too slow')
+        return json.dumps({'result_code': 1, 'result_msg': 'success', 'result_data': {'ok': 1}})
+
+class RebootSession(object):
+    '''
+    Records reboot requests
+    '''
+    def __init__(self):
+        self.posts = []
+
+    def post(self, url, **kwargs):
+        self.posts.append(url)
+
+class FlakyClient(Client):
+    '''
+    A Client, without a connection, talking to a flaky dongle
+    '''
+    def __init__(self, failures):
+        self.config = Config.load()
+        self.logger = self.config.logger
+        (self.sg_host, self.timeout, self.ws_token) = ('inverter', 1, 'token')
+        self.ws_socket = FlakySocket(failures)
+        self.session = RebootSession()
+
+@pytest.fixture
+def resilience():
+    '''
+    A fresh circuit breaker, a controllable clock and no waiting or rate limit
+    '''
+    config = Config.load()
+    names = ('request_rate', 'retries', 'retry_delay', 'breaker_threshold', 'breaker_cooldown', 'reboot_after')
+    saved = {n: config[n] for n in names}
+    config.update({'request_rate': 0, 'retry_delay': 0, 'breaker_threshold': 3, 'breaker_cooldown': 60, 'reboot_after': 0})
+    now = [1000.0]
+    previous = Clock.install(Clock(lambda: now[0]))
+    client_module._breaker = None
+    yield (config, now)
+    client_module._breaker = None
+    Clock.install(previous)
+    config.update(saved)
+
+def testCircuitBreaker(resilience):
+    '''
+    Test that repeated failures stop the calls until the cooldown passes
+    '''
+    (config, now) = resilience
+    client = FlakyClient(3)
+    for _ in range(3):
+        with pytest.raises(SungrowTransientError):
+            client.call(service='test')
+    # Open - the dongle isn't even asked
+    with pytest.raises(SungrowUnavailable):
+        client.call(service='test')
+    now[0] += 70
+    assert client.call(service='test').ok == 1
+    assert client_module._circuitBreaker(config).failures == 0
+
+def testReboot(resilience):
+    '''
+    Test asking the dongle to reboot after too many failures
+    '''
+    (config, now) = resilience
+    config.reboot_after = 2
+    client = FlakyClient(10)
+    with pytest.raises(SungrowTransientError):
+        client.call(service='test')
+    assert not client.session.posts
+    with pytest.raises(SungrowTransientError):
+        client.call(service='test')
+    assert client.session.posts == ['https://inverter/system/maintenance']
+    # Then left alone while it reboots
+    now[0] += 70
+    with pytest.raises(SungrowUnavailable):
+        client.call(service='test')
+
+def testRetries(resilience):
+    '''
+    Test retrying HTTP requests that time out
+    '''
+    client = FlakyClient(0)
+    attempts = []
+    def flaky(url, **kwargs):
+        attempts.append(url)
+        if len(attempts) < 3:
+            raise requests.exceptions.ConnectTimeout('too slow')
+        return ClassyDict({'status_code': 200, 'text': json.dumps({'result_code': 1, 'result_msg': 'success', 'result_data': {'time': 'now'}})})
+    client.session.get = flaky
+    assert client.get('/time/get').time == 'now'
+    assert len(attempts) == 3
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests the lazily loaded localisation service.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import subprocess
+import sys
+import pytest
+
+from sungrow import l10n
+
+def test_lazyImport():
+    '''
+    Test that importing the control path doesn't load the catalogue
+    '''
+    code = 'import sys; import sungrow.l10n, sungrow.services; print("sungrow.sh5l10n" in sys.modules)'
+    r = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True)
+    assert r.stdout.strip() == 'False', r.stderr
+
+def test_label():
+    assert l10n.label('I18N_COMMON_BATTERY_SOC') == 'Battery Level (SOC)'
+    assert l10n.label('I18N_COMMON_FORCED_CHARGE_ENABLE') == 'Forced Charging'
+    assert l10n.label('I18N_NOT_A_KEY') == 'I18N_NOT_A_KEY'
+    assert l10n.label('I18N_NOT_A_KEY', 'nope') == 'nope'
+    assert l10n.isLoaded()
+
+def test_findKeys():
+    assert l10n.findKeys('battery level  (soc)') == ['I18N_COMMON_BATTERY_SOC']
+    assert len(l10n.findKeys('Total Yield')) == 3
+    assert l10n.findKeys('Not a label') == []
+
+def test_propertyLabel():
+    assert l10n.propertyLabel('purchased_power') == 'Purchased Power'
+    assert l10n.propertyLabel('force_charge_status') == 'Force charge status'
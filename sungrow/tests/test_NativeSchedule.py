@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests programming the inverter's native force charge windows.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import numpy as np
+
+from simulator.simulator import SimulatedClient
+from sungrow.optmybat import scheduleForceCharge
+from sungrow.services import Services
+from sungrow.support import TimedTarget
+from sungrow.tests.conftest import START
+
+SOC_MIN = [
+    {'start': '01:00', 'stop': '05:00', 'target': 80},
+    {'start': '13:00', 'stop': '14:00', 'target': 60},
+    {'start': '17:00', 'stop': '21:00', 'target': 20},
+]
+
+def schedule(sim, hhmm, soc_min=SOC_MIN, timeslip=0):
+    '''
+    Run the native scheduling at a time of day
+
+    :param timeslip: how many minutes the inverter's clock is ahead
+    '''
+    (hours, minutes) = hhmm.split(':')
+    sim.now = START + int(hours) * 3600 + int(minutes) * 60
+    services = Services(client=SimulatedClient(sim))
+    services.sg_timeslip = timeslip
+    return scheduleForceCharge(services=services, timings=TimedTarget.loadTargets(soc_min))
+
+def test_windows(sim):
+    '''
+    Test programming the next two windows and waking when the first ends
+    '''
+    # Before the first window
+    assert schedule(sim, '00:30') == 4.5 * 3600
+    assert sim.changes == 1
+    targets = sim.forceChargeTargets(np.arange(1440))
+    assert targets[60] == 80 and targets[299] == 80
+    assert targets[13 * 60] == 60 and targets[14 * 60] == 60
+    assert targets[12 * 60] == 0 and targets[18 * 60] == 0
+    # Nothing changes until the first window ends
+    assert schedule(sim, '03:00') == 2 * 3600
+    assert sim.changes == 1
+    # Then the windows move on
+    assert schedule(sim, '05:00') == 9 * 3600
+    assert sim.changes == 2
+    targets = sim.forceChargeTargets(np.arange(1440))
+    assert targets[13 * 60] == 60 and targets[18 * 60] == 20
+    assert targets[3 * 60] == 0
+    # Only one window left
+    assert schedule(sim, '20:00') == 3600
+    targets = sim.forceChargeTargets(np.arange(1440))
+    assert targets[20 * 60] == 20 and targets[13 * 60] == 0
+    # None left today - wake at midnight
+    assert schedule(sim, '22:00') == 2 * 3600
+    assert not sim.forceChargeTargets(np.arange(1440)).any()
+
+def test_timeShift(sim):
+    '''
+    Test splitting a window that the inverter's time shift pushes across
+    midnight - e.g. an inverter that doesn't follow daylight saving
+    '''
+    soc_min = [{'start': '00:00', 'stop': '05:00', 'target': 80}] + SOC_MIN[1:]
+    assert schedule(sim, '00:30', soc_min, timeslip=-60) == 4.5 * 3600
+    # Both of the inverter's windows are needed for the first target
+    targets = sim.forceChargeTargets(np.arange(1440))
+    assert targets[23 * 60] == 80 and targets[0] == 80 and targets[4 * 60] == 80
+    assert targets[22 * 60] == 0 and targets[4 * 60 + 1] == 0
+    assert targets[12 * 60] == 0
+    # Then the next two fit
+    schedule(sim, '05:00', soc_min, timeslip=-60)
+    targets = sim.forceChargeTargets(np.arange(1440))
+    assert targets[12 * 60] == 60 and targets[16 * 60] == 20
+    assert targets[23 * 60] == 0 and targets[0] == 0
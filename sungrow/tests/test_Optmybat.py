@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests the auto targets and configuration validation of optmybat.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+
+from planning.forecast import FlatForecast
+from planning.planner import Planner
+from simulator.simulator import SimulatedClient
+from sungrow import optmybat
+from sungrow.optmybat import AUTO, compileTargets, main, updateForceCharge, validateConfig
+from sungrow.services import Services
+from sungrow.tests.conftest import START
+from util.classydict import ClassyDict
+from util.config import Config
+
+PLANNER = {
+    'capacity': 10,
+    'min_soc': 10,
+    'max_charge': 5,
+    'default_price': 0.30,
+    'tariff': [
+        {'start': '00:00', 'stop': '06:00', 'price': 0.10},
+        {'start': '16:00', 'stop': '21:00', 'price': 0.50},
+    ],
+}
+
+SOC_MIN = [{'start': '00:00', 'stop': '06:00', 'target': AUTO}]
+
+class Morning(FlatForecast):
+    '''
+    2kW of load and PV that takes over from 09:00 to 17:00
+    '''
+    def forecast(self, times, seconds):
+        hours = (np.asarray(times) % 86400) / 3600
+        return (np.full(len(times), 2.0), np.where((hours >= 9) & (hours < 17), 3.0, 0.0))
+
+@pytest.fixture
+def sim(sim):
+    '''
+    The shared simulated inverter at 01:00 with the configured soc_min and
+    planner restored afterwards
+    '''
+    sim.now = START + 3600
+    config = Config.load()
+    saved = {n: config[n] for n in ('soc_min', 'planner')}
+    yield sim
+    optmybat.planner = None
+    config.update(saved)
+
+def usePlanner(parameters):
+    '''
+    Configure a planner with the Morning forecast
+    '''
+    config = Config.load()
+    config.soc_min = SOC_MIN
+    config.planner = parameters
+    optmybat.planner = (parameters, Planner(parameters, forecast=Morning()))
+    return optmybat.planner[1]
+
+def test_auto(sim):
+    '''
+    Test that an auto target is sized from the forecast and drives the
+    force charging
+    '''
+    usePlanner(dict(PLANNER, plan=False))
+    # 06:00 to 09:00 is 6kWh of the 10kWh battery on top of the 10% minimum
+    assert updateForceCharge(services=Services(client=SimulatedClient(sim)))
+    assert sim.forceChargeTargets(np.array([60, 6 * 60 - 1, 7 * 60])).tolist() == [70, 70, 0]
+    # Already set so nothing more to do
+    assert not updateForceCharge(services=Services(client=SimulatedClient(sim)))
+
+def test_plan(sim):
+    '''
+    Test that the planner's own targets are only added if asked for
+    '''
+    config = Config.load()
+    charge_planner = usePlanner(dict(PLANNER, plan=False))
+    timings = compileTargets(config, charge_planner, 50)
+    assert [(str(t.start), str(t.stop), t.target) for t in timings] == [('00:00', '06:00', 70)]
+    charge_planner = usePlanner(dict(PLANNER, plan=True))
+    planned = charge_planner.targets(50)
+    assert len(planned) > 0
+    assert len(compileTargets(config, charge_planner, 50)) > 1
+
+def test_validate(sim, tmpdir):
+    '''
+    Test validating auto targets
+    '''
+    with pytest.raises(ValueError):
+        validateConfig(ClassyDict({'soc_min': SOC_MIN, 'planner': None}))
+    # Compiled as if the target were 100 without touching the live planner
+    current = usePlanner(dict(PLANNER))
+    parameters = dict(PLANNER, history=f'{tmpdir}/missing.csv')
+    validateConfig(ClassyDict({'soc_min': SOC_MIN + [{'start': '05:00', 'stop': '07:00', 'target': 20}], 'planner': parameters}))
+    assert optmybat.currentPlanner(ClassyDict({'planner': dict(PLANNER)})) is current
+    # Only replaced when the settings change
+    assert optmybat.currentPlanner(ClassyDict({'planner': dict(PLANNER, export_price=0.1)})) is not current
+    with pytest.raises(ValueError):
+        validateConfig(ClassyDict({'soc_min': SOC_MIN, 'planner': dict(PLANNER, slot=7)}))
+    with pytest.raises(ValueError):
+        validateConfig(ClassyDict({'soc_min': [{'start': '00:00', 'stop': '06:00', 'target': 'most'}], 'planner': parameters}))
+
+def test_invalidStart(sim):
+    '''
+    Test refusing to start with an invalid config
+    '''
+    config = Config.load()
+    config.soc_min = SOC_MIN
+    config.planner = None
+    with pytest.raises(SystemExit) as exit:
+        main(ClassyDict({'once': True}))
+    assert exit.value.code == 1
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests reading the inverter stats in place.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from sungrow.stats import CombinedStats, StatsLayout, StatsView, formatValue, parseValue
+
+MAP = {'I18N_SOC': 'battery_level_soc', 'I18N_LOAD': 'load_power', 'I18N_PV': 'pv_power'}
+
+def response(*names):
+    return [{'data_name': n, 'data_value': f'{i}.5', 'data_unit': 'kW'} for (i, n) in enumerate(names)]
+
+def test_values():
+    '''
+    Test parsing and formatting values
+    '''
+    assert parseValue('55') == 55.0
+    assert parseValue('-1.25') == -1.25
+    assert parseValue('--') is None
+    assert parseValue(None) is None
+    assert parseValue('Running') == 'Running'
+    assert formatValue(55.0) == '55'
+    assert formatValue(-1.25) == '-1.25'
+    assert formatValue(None) == '--'
+    assert formatValue('Running') == 'Running'
+    assert formatValue(parseValue('0.123456789')) == '0.123456789'
+
+def test_layout():
+    '''
+    Test compiling a property map
+    '''
+    layout = StatsLayout.compile(MAP)
+    assert StatsLayout.compile(MAP) is layout
+    assert StatsLayout.compile(dict(MAP)) is not layout
+    assert layout.names == ('battery_level_soc', 'load_power', 'pv_power')
+    assert layout.slots == {'I18N_SOC': 0, 'I18N_LOAD': 1, 'I18N_PV': 2}
+    # Each refresh gets a fresh record
+    (record, units) = layout.fill(response('I18N_UNKNOWN', 'I18N_LOAD', 'I18N_SOC'))
+    assert record == [2.5, 1.5, None]
+    assert units == ['kW', 'kW', None]
+    assert layout.defaults == [None, None, None]
+
+def test_view():
+    '''
+    Test reading stats from a view
+    '''
+    stats = StatsView.fromResponse(StatsLayout.compile(MAP), response('I18N_UNKNOWN', 'I18N_LOAD', 'I18N_SOC'))
+    assert stats['battery_level_soc'] == 2.5
+    assert stats.load_power == 1.5
+    assert stats.unit('load_power') == 'kW'
+    # Not reported by the inverter
+    assert stats.pv_power is None
+    assert stats.unit('pv_power') is None
+    assert 'pv_power' in stats
+    assert sorted(stats) == ['battery_level_soc', 'load_power', 'pv_power']
+    assert len(stats) == 3
+    assert dict(stats) == {'battery_level_soc': 2.5, 'load_power': 1.5, 'pv_power': None}
+    # Not one of our properties
+    with pytest.raises(KeyError):
+        stats['I18N_SOC']
+    with pytest.raises(AttributeError):
+        stats.nothing
+    assert stats.get('nothing', 'x') == 'x'
+
+def test_combined():
+    '''
+    Test combining views
+    '''
+    first = StatsView.fromResponse(StatsLayout.compile(MAP), response('I18N_SOC'))
+    second = {'load_power': '7', 'extra': '8'}
+    stats = CombinedStats(first, second, force_charge_status=0.0)
+    # The first view wins
+    assert stats.load_power is None
+    assert stats.extra == '8'
+    assert stats['force_charge_status'] == 0.0
+    assert stats.unit('battery_level_soc') == 'kW'
+    assert stats.unit('extra') is None
+    assert list(stats) == ['battery_level_soc', 'load_power', 'pv_power', 'extra', 'force_charge_status']
+    assert len(stats) == 5
+    with pytest.raises(AttributeError):
+        stats.nothing
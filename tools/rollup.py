@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Build 5 minute, hourly and daily rollups from the CSV monitoring history.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import csv
+from datetime import datetime
+import json
+import os
+import sys
+
+from util.clock import CONFIGURED
+from util.config import Config
+
+# The fields used by the rollups.  Powers are in kW as reported by the inverter.
+SOC = 'battery_level_soc'
+CHARGE = 'battery_charging_power'
+DISCHARGE = 'battery_discharging_power'
+PURCHASED = 'purchased_power'
+FIELDS = (SOC, CHARGE, DISCHARGE, PURCHASED)
+
+# Don't integrate power across gaps longer than this (seconds) - optmybat wasn't running
+MAX_GAP = 600
+
+# The rollup tables: name -> function mapping a timestamp to the start of its period
+PERIODS = {
+    '5min': lambda ts: ts.replace(minute=ts.minute - ts.minute % 5, second=0, microsecond=0),
+    'hourly': lambda ts: ts.replace(minute=0, second=0, microsecond=0),
+    'daily': lambda ts: ts.replace(hour=0, minute=0, second=0, microsecond=0),
+}
+
+COLUMNS = ['period_start', 'samples', 'soc_min', 'soc_max', 'soc_mean', 'charge_kwh', 'discharge_kwh', 'purchased_kwh']
+
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def newBucket(start):
+    '''
+    :returns: an empty accumulator for the period starting at start
+    '''
+    return {'start': start, 'samples': 0, 'soc_n': 0, 'soc_min': None, 'soc_max': None, 'soc_sum': 0.0,
+            'charge_kwh': 0.0, 'discharge_kwh': 0.0, 'purchased_kwh': 0.0}
+
+def bucketRow(bucket):
+    '''
+    :returns: an accumulator converted to a row of output cells
+    '''
+    def fmt(v):
+        return '' if v is None else f'{v:.4f}'.rstrip('0').rstrip('.')
+    mean = bucket['soc_sum'] / bucket['soc_n'] if bucket['soc_n'] > 0 else None
+    return [bucket['start'], str(bucket['samples']), fmt(bucket['soc_min']), fmt(bucket['soc_max']), fmt(mean),
+            fmt(bucket['charge_kwh']), fmt(bucket['discharge_kwh']), fmt(bucket['purchased_kwh'])]
+
+def toFloat(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+class Rollup(object):
+    '''
+    Incrementally rolls up a CSV monitoring file.  Progress (the byte offset
+    of the next unread row, the time of the last row used, the last values
+    seen and the still open periods) is kept in a small JSON state file so
+    that each run only reads the rows that were added since the last run.
+    '''
+    def __init__(self, source, dest=None, timezone=CONFIGURED):
+        '''
+        :param source: the CSV file written by the csv monitoring engine
+        :param dest: the prefix for the output files.  Defaults to the source
+                    less its extension.
+        :param timezone: the time zone of the timestamps - a tzinfo (e.g. from
+                    pytz), None for the local time zone or, by default, the
+                    configured timezone
+        '''
+        self.source = source
+        self.timezone = Config.load().timezone if timezone is CONFIGURED else timezone
+        self.dest = dest if dest is not None else os.path.splitext(source)[0]
+        self.state_path = f'{self.dest}-rollup.json'
+        self.state = self._loadState()
+
+    def outputPath(self, period):
+        return f'{self.dest}-{period}.csv'
+
+    def run(self):
+        '''
+        Process any new rows and append the completed periods to the rollup tables.
+
+        :returns: the number of rows processed
+        '''
+        state = self.state
+        if not os.path.exists(self.source):
+            return 0
+        if os.path.getsize(self.source) < state['offset']:
+            # The source has been truncated or rotated - read it from the
+            # start.  Rows that were already used are before the watermark.
+            state['offset'] = 0
+        completed = {p: list() for p in PERIODS}
+        rows = 0
+        with open(self.source, 'rb') as ifd:
+            header = ifd.readline()
+            if not header.endswith(b'\n'):
+                return 0
+            columns = next(csv.reader([header.decode('utf-8')]))
+            index = {name: columns.index(name) for name in ('timestamp',) + FIELDS if name in columns}
+            start = ifd.tell()
+            first = ifd.readline().decode('utf-8')
+            if first != state.get('first', first):
+                # A different file that has already grown past the offset
+                state['offset'] = 0
+            if state['offset'] == 0:
+                state['offset'] = start
+            if first.endswith('\n'):
+                state['first'] = first
+            ifd.seek(state['offset'])
+            while True:
+                line = ifd.readline()
+                if not line.endswith(b'\n'):
+                    # End of file or a partially written row - leave it for next time
+                    break
+                state['offset'] += len(line)
+                cells = next(csv.reader([line.decode('utf-8')]), None)
+                if cells is None or len(cells) < len(columns):
+                    continue
+                if self._addRow(cells, index, completed):
+                    rows += 1
+        self._writeTables(completed)
+        self._saveState()
+        return rows
+
+    # Helpers
+    def _addRow(self, cells, index, completed):
+        '''
+        Add a single row to the accumulators.
+
+        :returns: True if the row was used
+        '''
+        state = self.state
+        try:
+            ts = datetime.strptime(cells[index['timestamp']], TIME_FORMAT)
+        except ValueError:
+            return False
+        # The first time after the watermark that the local time could be -
+        # the repeated hour when daylight saving ends is read twice
+        later = [t for t in self._epochs(ts) if state['watermark'] is None or t > state['watermark']]
+        if len(later) == 0:
+            return False
+        epoch = later[0]
+        # Empty cells mean "unchanged" (see change-only recording) so carry
+        # the last value forward
+        values = state['values']
+        for name in FIELDS:
+            if name in index:
+                v = toFloat(cells[index[name]]) if cells[index[name]] != '' else values.get(name)
+                values[name] = v
+        # Integrate the power since the previous row using the previous row's values
+        energy = dict()
+        if state['watermark'] is not None:
+            dt = epoch - state['watermark']
+            if 0 < dt <= MAX_GAP:
+                last = state['last']
+                for name in (CHARGE, DISCHARGE, PURCHASED):
+                    if last.get(name) is not None:
+                        energy[name] = max(last[name], 0.0) * dt / 3600
+        soc = values.get(SOC)
+        for (period, floor) in PERIODS.items():
+            start = floor(ts).strftime(TIME_FORMAT)
+            bucket = state['open'].get(period)
+            if bucket is not None and bucket['start'] != start:
+                completed[period].append(bucketRow(bucket))
+                bucket = None
+            if bucket is None:
+                bucket = state['open'][period] = newBucket(start)
+            bucket['samples'] += 1
+            if soc is not None:
+                bucket['soc_n'] += 1
+                bucket['soc_sum'] += soc
+                bucket['soc_min'] = soc if bucket['soc_min'] is None else min(bucket['soc_min'], soc)
+                bucket['soc_max'] = soc if bucket['soc_max'] is None else max(bucket['soc_max'], soc)
+            bucket['charge_kwh'] += energy.get(CHARGE, 0.0)
+            bucket['discharge_kwh'] += energy.get(DISCHARGE, 0.0)
+            bucket['purchased_kwh'] += energy.get(PURCHASED, 0.0)
+        state['watermark'] = epoch
+        state['last'] = dict(values)
+        return True
+
+    def _epochs(self, ts):
+        '''
+        :param ts: a naive local time
+        :returns: the sorted times since the epoch that it could be - two
+                for the repeated hour when daylight saving ends
+        '''
+        if self.timezone is None:
+            return sorted({ts.replace(fold=0).timestamp(), ts.replace(fold=1).timestamp()})
+        return sorted({self.timezone.localize(ts, is_dst=True).timestamp(), self.timezone.localize(ts, is_dst=False).timestamp()})
+
+    def _writeTables(self, completed):
+        for (period, rows) in completed.items():
+            if len(rows) == 0:
+                continue
+            path = self.outputPath(period)
+            exists = os.path.exists(path)
+            with open(path, 'a', newline='') as ofd:
+                writer = csv.writer(ofd)
+                if not exists:
+                    writer.writerow(COLUMNS)
+                writer.writerows(rows)
+
+    def _loadState(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, 'r', encoding='utf-8') as ifd:
+                return json.load(ifd)
+        return self._emptyState()
+
+    def _emptyState(self):
+        return {'offset': 0, 'watermark': None, 'values': dict(), 'last': dict(), 'open': dict()}
+
+    def _saveState(self):
+        # Write then rename so an interrupted run never leaves a corrupt state file
+        with open(f'{self.state_path}.tmp', 'w', encoding='utf-8') as ofd:
+            json.dump(self.state, ofd)
+        os.replace(f'{self.state_path}.tmp', self.state_path)
+
+def findSource(config):
+    '''
+    :returns: the destination of the first csv monitoring store or None
+    '''
+    for store in config.get('monitoring', []):
+        if store.get('engine') == 'csv':
+            return store.get('dest')
+    return None
+
+def main(source):
+    '''
+    Roll up the monitoring history.
+
+    :param source: the CSV file to roll up.  If None, uses the first
+        configured csv monitoring store.
+    '''
+    config = Config.load()
+    logger = config.logger
+    if source is None:
+        source = findSource(config)
+    if source is None:
+        logger.critical('No CSV monitoring store is configured - please specify the file to roll up')
+        sys.exit(1)
+    rollup = Rollup(source)
+    rows = rollup.run()
+    logger.info('Rolled up %d new rows from %s', rows, source)
+    sys.exit(0)
@@ -24,19 +24,43 @@
 import sys
 import time
 
+from sungrow import l10n
+from sungrow.parameters import Register
 from sungrow.services import Services
+from sungrow.stats import formatValue
 from sungrow.support import SungrowError
 from util.config import Config
 
 def status(config):
     '''
-    Reset to known good state
+    Fetch the current status and the force charge registers
     '''
     # Get connected and authenticated as a power user
     client = Services()
-    did_it = client.getStatus()
+    stats = client.getStatus()
+    stats.registers = client.force_charge
     client.close()
-    return did_it
+    return stats
+
+def printStatus(stats):
+    '''
+    Print the status using the inverter's own labels
+    '''
+    print(f"Battery SOC is {stats.soc}%")
+    print(f"Force charge is {'disabled' if stats.fc_state == 0 else f'{stats.fc_state}%'}")
+    print(f"Battery is {'discharging' if stats.battery < 0 else 'charging'} at {abs(stats.battery)}kW")
+    print(f"Purchased power is {formatValue(stats.mains)}kW")
+    print()
+    print("Inverter status:")
+    for name in sorted(stats.raw.keys()):
+        value = stats.raw[name]
+        unit = '' if value is None else stats.raw.unit(name) or ''
+        print(f"    {l10n.propertyLabel(name):50} {formatValue(value)}{unit}")
+    print()
+    print("Force charge registers:")
+    for (name, reg) in stats.registers.items():
+        if isinstance(reg, Register) and reg.initialised:
+            print(f"    {l10n.label(reg.pname):50} {reg.value}")
 
 def doWork():
     '''
@@ -46,10 +70,9 @@ def doWork():
     config = Config.load()
     logger = config.logger
     try:
-        did_it = status(config)
-        if did_it:
-            print("Force charge is ")
-            print("Battery SOC is ")
+        stats = status(config)
+        printStatus(stats)
+        did_it = True
     except SungrowError as err:
         logger.critical(err)
     except Exception as err:
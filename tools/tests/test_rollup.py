@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests the incremental rollup tool.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import csv
+import pytest
+import pytz
+
+from tools.rollup import Rollup
+
+HEADER = 'timestamp,battery_charging_power,battery_discharging_power,battery_level_soc,purchased_power\n'
+
+def readTable(path):
+    with open(path, newline='') as ifd:
+        return list(csv.DictReader(ifd))
+
+def test_rollup(tmpdir):
+    '''
+    Test the rollups and that each run only processes new rows
+    '''
+    source = f'{tmpdir}/status.csv'
+    with open(source, 'w') as ofd:
+        ofd.write(HEADER)
+        # 1kW charging for 10 minutes from 10:00
+        for m in range(0, 11):
+            ofd.write(f'2024-05-01 10:{m:02d}:00,1.0,0,{50 + m},0.5\n')
+    r = Rollup(source)
+    assert r.run() == 11
+    # Only the first 5 minute period is complete
+    rows = readTable(r.outputPath('5min'))
+    assert len(rows) == 2
+    assert rows[0]['period_start'] == '2024-05-01 10:00:00'
+    assert rows[0]['soc_min'] == '50'
+    assert rows[0]['soc_max'] == '54'
+    assert rows[0]['soc_mean'] == '52'
+    assert abs(float(rows[1]['charge_kwh']) - 5 / 60) < 1e-3
+    # Nothing new so nothing to do
+    assert Rollup(source).run() == 0
+    # Add an empty (unchanged) cell, a partial row and the next day
+    with open(source, 'a') as ofd:
+        ofd.write('2024-05-01 10:11:00,1.0,0,,0.5\n')
+        ofd.write('2024-05-02 00:00:00,0,0.5,60,0\n')
+        ofd.write('2024-05-02 00:00:30,0,0.5')
+    r = Rollup(source)
+    assert r.run() == 2
+    daily = readTable(r.outputPath('daily'))
+    assert len(daily) == 1
+    assert daily[0]['samples'] == '12'
+    assert daily[0]['soc_max'] == '60'
+    assert abs(float(daily[0]['charge_kwh']) - 11 / 60) < 1e-3
+    assert abs(float(daily[0]['purchased_kwh']) - 5.5 / 60) < 1e-3
+    hourly = readTable(r.outputPath('hourly'))
+    assert len(hourly) == 1
+
+def test_rotation(tmpdir):
+    '''
+    Test that a rotated source keeps the rollups and only adds the new rows
+    '''
+    source = f'{tmpdir}/status.csv'
+    with open(source, 'w') as ofd:
+        ofd.write(HEADER)
+        for m in range(0, 10):
+            ofd.write(f'2024-05-01 10:{m:02d}:00,1.0,0,50,0\n')
+    r = Rollup(source, timezone=pytz.utc)
+    assert r.run() == 10
+    assert len(readTable(r.outputPath('5min'))) == 1
+    # Rotated - a new file with one old row and the rest of the hour
+    with open(source, 'w') as ofd:
+        ofd.write(HEADER)
+        for m in range(9, 60):
+            ofd.write(f'2024-05-01 10:{m:02d}:00,1.0,0,50,0\n')
+        ofd.write('2024-05-01 11:00:00,0,0,50,0\n')
+    r = Rollup(source, timezone=pytz.utc)
+    assert r.run() == 51
+    rows = readTable(r.outputPath('5min'))
+    assert len(rows) == 12
+    assert [row['samples'] for row in rows] == ['5'] * 12
+    hourly = readTable(r.outputPath('hourly'))
+    assert hourly[0]['samples'] == '60'
+    # The last minute is integrated in to the next hour
+    assert abs(float(hourly[0]['charge_kwh']) - 59 / 60) < 1e-3
+
+def test_fallBack(tmpdir):
+    '''
+    Test that the repeated hour when daylight saving ends is rolled up
+    '''
+    source = f'{tmpdir}/status.csv'
+    with open(source, 'w') as ofd:
+        ofd.write(HEADER)
+        # Clocks go back from 03:00 to 02:00 in Sydney
+        for hour in (1, 2, 2, 3):
+            for m in range(0, 60, 10):
+                ofd.write(f'2024-04-07 {hour:02d}:{m:02d}:00,1.0,0,50,0\n')
+        ofd.write('2024-04-08 00:00:00,0,0,50,0\n')
+    r = Rollup(source, timezone=pytz.timezone('Australia/Sydney'))
+    assert r.run() == 25
+    daily = readTable(r.outputPath('daily'))
+    assert daily[0]['samples'] == '24'
+    # Four hours charging at 1kW - the gap to midnight isn't counted
+    assert abs(float(daily[0]['charge_kwh']) - (4 - 1 / 6)) < 1e-3
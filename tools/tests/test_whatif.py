@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests the what-if comparison of soc_min schedules.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import numpy as np
+import pytest
+import pytz
+
+from simulator.profile import Profile
+from tools.whatif import WhatIf, _initWorker, evaluate
+
+STEP = 60
+# Midnight UTC on a Monday
+START = 1717372800
+
+PARAMETERS = {
+    'capacity': 10,
+    'soc': 50,
+    'default_price': 0.40,
+    'tariff': [{'start': '00:00', 'stop': '06:00', 'price': 0.10}],
+    'export_price': 0.05,
+}
+
+CANDIDATES = [
+    {'name': 'none', 'soc_min': []},
+    {'name': 'night', 'soc_min': [{'start': '00:00', 'stop': '06:00', 'target': 80}]},
+    {'name': 'floor', 'soc_min': [{'start': '00:00', 'stop': '24:00', 'target': 30}]},
+]
+
+def profile(days=2):
+    '''
+    A steady load and a little sun
+    '''
+    hours = np.arange(days * 24 * 3600 // STEP) * STEP / 3600 % 24
+    pv = np.maximum(0, 2 * np.sin((hours - 6) / 12 * np.pi))
+    return Profile(START, STEP, np.full(len(hours), 1.0), pv)
+
+def test_whatif():
+    '''
+    Test that the parallel results match running each candidate directly
+    '''
+    history = profile()
+    results = WhatIf(CANDIDATES, history, PARAMETERS, poll_interval=60, timezone=pytz.utc, jobs=2).run()
+    assert [r['name'] for r in results] == ['night', 'none', 'floor']
+    _initWorker(history, PARAMETERS, 60, pytz.utc)
+    for r in results:
+        expected = evaluate(next(c for c in CANDIDATES if c['name'] == r['name']))
+        assert r == pytest.approx(expected)
+    floor = next(r for r in results if r['name'] == 'floor')
+    assert floor['min_soc'] >= 29.9
+    assert all(r['cycles'] > 0 for r in results)
+
+def test_invalid():
+    '''
+    Test rejecting candidates that can't be simulated
+    '''
+    with pytest.raises(ValueError):
+        WhatIf([{'soc_min': []}], profile(1))
+    with pytest.raises(ValueError):
+        WhatIf([CANDIDATES[0], CANDIDATES[0]], profile(1))
+    with pytest.raises(ValueError):
+        WhatIf([{'name': 'auto', 'soc_min': [{'start': '00:00', 'stop': '06:00', 'target': 'auto'}]}], profile(1))
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Compare soc_min schedules by replaying the monitoring history.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+from concurrent.futures import ProcessPoolExecutor
+import os
+import sys
+
+import numpy as np
+import yaml
+
+from planning.planner import Tariff
+from simulator.battery import Battery
+from simulator.profile import Profile
+from simulator.simulator import Simulator
+from tools.rollup import findSource
+from util.config import Config
+
+# The replayed history and settings shared by every candidate in a worker
+# process - see _initWorker()
+_shared = None
+
+def _initWorker(profile, parameters, poll_interval, timezone):
+    '''
+    Keep the (possibly large) profile in each worker process rather than
+    sending it with every candidate
+    '''
+    global _shared
+    _shared = (profile, parameters, poll_interval, timezone)
+
+def evaluate(candidate):
+    '''
+    Replay the history with a candidate soc_min schedule
+
+    :param candidate: a dict with a name and a soc_min schedule
+    :returns: a dict of the results
+    '''
+    (profile, parameters, poll_interval, timezone) = _shared
+    battery = Battery.fromConfig(parameters)
+    simulator = Simulator(profile, battery, soc_min=candidate['soc_min'], poll_interval=poll_interval, timezone=timezone)
+    result = simulator.run()
+    hours = profile.step / 3600
+    (minutes, days) = simulator.localise(result.times)
+    # Day 0 was a Thursday
+    prices = Tariff(parameters.get('tariff', []), parameters.get('default_price', 0.25)).prices(minutes, (days + 3) % 7)
+    imported = np.maximum(result.grid, 0)
+    cost = float((imported * prices).sum() * hours) - result.exported_kwh * float(parameters.get('export_price', 0.0))
+    return {
+        'name': candidate['name'],
+        'cost': cost,
+        'imported_kwh': result.imported_kwh,
+        'exported_kwh': result.exported_kwh,
+        # Full discharges' worth of energy
+        'cycles': float(-np.minimum(result.battery, 0).sum() * hours / battery.capacity),
+        'min_soc': float(result.soc.min()),
+        'changes': result.changes,
+    }
+
+class WhatIf(object):
+    '''
+    Runs candidate soc_min schedules through the simulator, in parallel
+    '''
+    def __init__(self, candidates, profile, parameters=None, poll_interval=None, timezone=None, jobs=None):
+        '''
+        :param candidates: a list of dicts with a name and a soc_min schedule
+        :param profile: the load and PV Profile to replay
+        :param parameters: the battery and tariff settings - as for the
+                planner section of the configuration
+        :param poll_interval: seconds between decisions.  Defaults to the configured one.
+        :param timezone: the time zone of the history.  Defaults to local time.
+        :param jobs: the number of worker processes.  Defaults to one per CPU.
+        '''
+        self.candidates = candidates
+        self.profile = profile
+        self.parameters = dict() if parameters is None else parameters
+        self.poll_interval = Config.load().poll_interval if poll_interval is None else poll_interval
+        self.timezone = timezone
+        self.jobs = jobs or os.cpu_count() or 1
+        names = [c.get('name') for c in candidates]
+        if None in names or len(set(names)) != len(names):
+            raise ValueError('Every candidate needs a unique name')
+        for c in candidates:
+            if any(t.get('target') == 'auto' for t in c.get('soc_min', [])):
+                raise ValueError(f"{c['name']}: the simulator can't size auto targets")
+
+    def run(self):
+        '''
+        :returns: the results for each candidate, cheapest first
+        '''
+        args = (self.profile, self.parameters, self.poll_interval, self.timezone)
+        jobs = min(self.jobs, len(self.candidates))
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_initWorker, initargs=args) as pool:
+            results = list(pool.map(evaluate, self.candidates))
+        return sorted(results, key=lambda r: r['cost'])
+
+def printResults(results):
+    '''
+    Print a table of the results
+    '''
+    width = max(len('Candidate'), *(len(r['name']) for r in results))
+    print(f"{'Candidate':{width}} {'Cost':>10} {'Import kWh':>11} {'Export kWh':>11} {'Cycles':>8} {'Min SOC':>8} {'Changes':>8}")
+    for r in results:
+        print(f"{r['name']:{width}} {r['cost']:10.2f} {r['imported_kwh']:11.1f} {r['exported_kwh']:11.1f} {r['cycles']:8.1f} {r['min_soc']:7.1f}% {r['changes']:8}")
+
+def main(path, history=None):
+    '''
+    Compare the candidate soc_min schedules in a YAML file.  The file has
+    a list of candidates, each with a name and a soc_min schedule, and
+    optionally the battery and tariff settings (as for the planner
+    section of the configuration), which default to the configured ones.
+
+    :param path: the YAML file of candidates
+    :param history: the CSV monitoring history to replay.  Defaults to the
+            first configured csv monitoring store.
+    '''
+    config = Config.load()
+    logger = config.logger
+    with open(path, 'r', encoding='utf-8') as ifd:
+        settings = yaml.safe_load(ifd)
+    parameters = dict(config.planner or {})
+    parameters.update({n: v for (n, v) in settings.items() if n not in ('candidates', 'jobs')})
+    if history is None:
+        history = findSource(config)
+    if history is None:
+        logger.critical('No CSV monitoring store is configured - please specify the history to replay')
+        sys.exit(1)
+    profile = Profile.fromCSV(history, timezone=config.timezone)
+    logger.info('Replaying %.1f days of history for %d candidates', len(profile) * profile.step / 86400, len(settings['candidates']))
+    try:
+        whatif = WhatIf(settings['candidates'], profile, parameters, timezone=config.timezone, jobs=settings.get('jobs'))
+    except ValueError as err:
+        logger.critical(err)
+        sys.exit(1)
+    printResults(whatif.run())
+    sys.exit(0)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Jittered exponential backoff and a circuit breaker for talking to
+# something that falls over when pushed too hard.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import random
+
+from util.clock import Clock
+
+def backoff(attempt, delay, cap):
+    '''
+    Full jitter exponential backoff - a random time up to delay doubled
+    for each previous attempt.  The randomness stops retries from several
+    processes arriving together.
+
+    :param attempt: the number of attempts so far, starting at 0
+    :param delay: the longest delay after the first attempt, in seconds
+    :param cap: the longest delay, in seconds
+    :returns: the number of seconds to wait
+    '''
+    return random.uniform(0, min(cap, delay * 2 ** attempt))
+
+class CircuitBreaker(object):
+    '''
+    Stops calls once there have been a number of failures in a row.
+
+    Once open, nothing is allowed until the cooldown has passed.  Then a
+    single trial is allowed - if it works, the breaker closes, otherwise
+    it opens again for twice as long (up to max_cooldown).
+    '''
+    def __init__(self, threshold=5, cooldown=60, max_cooldown=900):
+        '''
+        :param threshold: the number of consecutive failures that open the breaker
+        :param cooldown: how long, in seconds, to stay open the first time
+        :param max_cooldown: the longest time, in seconds, to stay open
+        '''
+        if threshold < 1:
+            raise ValueError(f"The circuit breaker threshold must be at least 1 - not {threshold}")
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        # The number of consecutive failures
+        self.failures = 0
+        # Closed until then
+        self.opened_until = 0
+        self._next_cooldown = cooldown
+
+    def isOpen(self):
+        '''
+        :returns: True if calls are being stopped
+        '''
+        return Clock.default().time() < self.opened_until
+
+    def allow(self):
+        '''
+        :returns: True if a call can be made
+        '''
+        return not self.isOpen()
+
+    def success(self):
+        '''
+        Record a call that worked - closes the breaker
+        '''
+        self.failures = 0
+        self.opened_until = 0
+        self._next_cooldown = self.cooldown
+
+    def failure(self):
+        '''
+        Record a call that failed
+
+        :returns: True if the breaker is now open
+        '''
+        self.failures += 1
+        if self.failures < self.threshold:
+            return False
+        self.trip(self._next_cooldown)
+        self._next_cooldown = min(self._next_cooldown * 2, self.max_cooldown)
+        return True
+
+    def trip(self, seconds):
+        '''
+        Open the breaker for a number of seconds, with up to 10% jitter
+        '''
+        self.opened_until = Clock.default().time() + seconds * random.uniform(1.0, 1.1)
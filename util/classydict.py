@@ -43,61 +43,78 @@ class ClassyDict(dict):
     '''
 
     def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
-        # Make all private items into private attributes
-        for name in list(super().keys()):
-            if isinstance(name, str) and name[0] == '_':
-                v = super().__getitem__(name)
-                super().__delitem__(name)
-                super().__setattr__(name, v)
-
-    def __delattr__(self, name):
-        '''
-        Delete the item from my data
-        '''
-        if isinstance(name, str) and name[0] == '_':
-            super().__delattr__(name)
-        else:
-            super().__delitem__(name)
+        dict.__init__(self, *args, **kwargs)
+        if len(self) > 0:
+            try:
+                # A quick check, done in C, for any key starting with '_'
+                private = '\0_' in '\0' + '\0'.join(self)
+            except TypeError:
+                # Not all of the keys are strings - check the slow way
+                private = True
+            if private:
+                # Make all private items into private attributes
+                for name in [k for k in self if k.__class__ is str and k[:1] == '_']:
+                    object.__setattr__(self, name, dict.pop(self, name))
 
+    # Public items are plain dict entries so item reads go straight to the C
+    # dict implementation and only get to __missing__() if the key isn't in
+    # the dict.  Attribute reads only get to __getattr__() if normal attribute
+    # lookup fails (i.e. it isn't a method or a private attribute).
     def __getattr__(self, name):
         '''
         Return a field element as if it was an attribute.
         '''
         try:
-            if isinstance(name, str) and name[0] == '_':
-                return super().__getattribute__(name)
-            else:
-                return super().__getitem__(name)
+            return self[name]
         except KeyError:
-            raise AttributeError(f"{self.__class__.__name__} has no attribute {name}")
+            raise AttributeError(f"{self.__class__.__name__} has no attribute {name}") from None
+
+    def __missing__(self, name):
+        '''
+        Private items are stored as attributes, not in the dict
+        '''
+        if name.__class__ is str and name[:1] == '_':
+            try:
+                return self.__dict__[name]
+            except KeyError:
+                pass
+        raise KeyError(name)
 
     def __setattr__(self, name, value):
         '''
         Update/add a field to the underlying dict
         '''
-        if isinstance(name, str) and name[0] == '_':
-            super().__setattr__(name, value)
+        if name[0] == '_':
+            object.__setattr__(self, name, value)
         else:
-            super().__setitem__(name, value)
+            dict.__setitem__(self, name, value)
 
-    def __delitem__(self, name):
-        try:
-            return self.__delattr__(name)
-        except AttributeError:
-            raise KeyError(name)
+    def __setitem__(self, name, value):
+        if name.__class__ is str and name[:1] == '_':
+            object.__setattr__(self, name, value)
+        else:
+            dict.__setitem__(self, name, value)
 
-    def __getitem__(self, name):
-        try:
-            return self.__getattr__(name)
-        except AttributeError:
-            raise KeyError(name)
+    def __delattr__(self, name):
+        '''
+        Delete the item from my data
+        '''
+        if name[0] == '_':
+            object.__delattr__(self, name)
+        else:
+            dict.__delitem__(self, name)
 
-    def __setitem__(self, name, value):
-        return self.__setattr__(name, value)
+    def __delitem__(self, name):
+        if name.__class__ is str and name[:1] == '_':
+            try:
+                object.__delattr__(self, name)
+            except AttributeError:
+                raise KeyError(name) from None
+        else:
+            dict.__delitem__(self, name)
 
     def __repr__(self):
-        return f"{self.__class__.__name__}({super().__repr__()})"
+        return f"{self.__class__.__name__}({dict.__repr__(self)})"
 
     def __str__(self):
-        return super().__repr__()
\ No newline at end of file
+        return dict.__repr__(self)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# A cheap, replaceable source for the current time of day.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+from datetime import datetime
+import time
+
+from util.config import Config
+
+# Use the configured time zone - see Clock()
+CONFIGURED = object()
+
+class Clock(object):
+    '''
+    The current time, minute of the day and day of the week.
+
+    By default the time comes from the monotonic clock anchored to the
+    wall clock, re-anchoring every minute to follow any adjustments (e.g.
+    NTP stepping the clock of a Raspberry Pi, which has no RTC, after boot).  The
+    time zone's UTC offset is worked out once per half hour (when daylight
+    saving can change) so the time of day is simple arithmetic.
+
+    Pass a time source to control time - e.g. to fast forward through a
+    day in a simulation or test.
+    '''
+    # How often to re-anchor the monotonic clock to the wall clock
+    ANCHOR_SECONDS = 60
+    # How often the UTC offset can change
+    OFFSET_SECONDS = 1800
+
+    # The clock used by HHMMTime.now() etc. - see default() and install()
+    _default = None
+
+    def __init__(self, source=None, timezone=CONFIGURED):
+        '''
+        :param source: a function returning seconds since the epoch.  Defaults
+                to the anchored monotonic clock.
+        :param timezone: a tzinfo (e.g. from pytz), None for the local time
+                zone or, by default, the configured timezone
+        '''
+        self.source = source
+        self.timezone = timezone
+        # (epoch, monotonic, monotonic time to re-anchor)
+        self._anchor = (0.0, 0.0, -1.0)
+        # (start, end, UTC offset in seconds) - the offset applies from start to end
+        self._offset = (0.0, -1.0, 0)
+
+    @classmethod
+    def default(cls):
+        '''
+        :returns: the shared clock
+        '''
+        if cls._default is None:
+            cls._default = Clock()
+        return cls._default
+
+    @classmethod
+    def install(cls, clock):
+        '''
+        Replace the shared clock.  Pass None to go back to the real clock.
+
+        :returns: the previous shared clock
+        '''
+        previous = cls._default
+        cls._default = clock
+        return previous
+
+    def time(self):
+        '''
+        :returns: the current time in seconds since the epoch
+        '''
+        if self.source is not None:
+            return self.source()
+        now = time.monotonic()
+        (epoch, mono, reanchor) = self._anchor
+        if now >= reanchor:
+            (epoch, mono) = (time.time(), time.monotonic())
+            self._anchor = (epoch, mono, mono + self.ANCHOR_SECONDS)
+            return epoch
+        return epoch + (now - mono)
+
+    def utcOffset(self, t=None):
+        '''
+        :returns: the time zone's UTC offset, in seconds, at time t (default now)
+        '''
+        if t is None:
+            t = self.time()
+        (start, end, offset) = self._offset
+        if t < start or t >= end:
+            tz = Config.load().timezone if self.timezone is CONFIGURED else self.timezone
+            if tz is None:
+                offset = datetime.fromtimestamp(t).astimezone().utcoffset()
+            else:
+                offset = datetime.fromtimestamp(t, tz).utcoffset()
+            offset = int(offset.total_seconds())
+            start = t - t % self.OFFSET_SECONDS
+            self._offset = (start, start + self.OFFSET_SECONDS, offset)
+        return offset
+
+    def localTime(self, t=None):
+        '''
+        :returns: the local time at t (default now) in seconds since the
+                local epoch - i.e. without the time zone.
+        '''
+        if t is None:
+            t = self.time()
+        return t + self.utcOffset(t)
+
+    def minuteOfDay(self, t=None):
+        '''
+        :returns: the local minute of the day (0 to 1439)
+        '''
+        return int(self.localTime(t) // 60) % 1440
+
+    def weekday(self, t=None):
+        '''
+        :returns: the local day of the week - 0 is Monday and 6 is Sunday
+        '''
+        # The epoch was a Thursday
+        return (int(self.localTime(t) // 86400) + 3) % 7
@@ -23,7 +23,8 @@
 
 import logging
 import os
-import pytz
+import threading
+import time
 import yaml
 
 from util.classydict import ClassyDict
@@ -41,22 +42,39 @@ class Config(ClassyDict):
         'admin_user': 'user',
         'admin_passwd': 'pw1111',
         'timeout': 10,
+        'request_rate': 1.0,
+        'request_burst': 20,
+        'retries': 2,
+        'retry_delay': 1.0,
+        'breaker_threshold': 5,
+        'breaker_cooldown': 60,
+        'reboot_after': 0,
+        'verify_writes': False,
+        'verify_retries': 2,
         'log_level': 'INFO',
         'poll_interval': 30,
+        'config_check_interval': 1,
         'soc_min': [ ],
         'soc_max': [ ],
+        'fc_hysteresis': 1.0,
+        'fc_projection': 0,
+        'native_schedule': False,
+        'planner': None,
         'timezone': None
     }
 
+    # Only _create() is allowed to make instances
+    _creating = False
+    _lock = threading.Lock()
+    # True while a ConfigWatcher is reloading the config for us
+    _watched = False
+
     def __init__(self):
         '''
-        Throw an exception if _instance class variable doesn't exist, otherwise
-        create it and set it to myself.
+        Throw an exception unless called from _create()
         '''
-        clz = self.__class__
-        if not hasattr(clz, '_instance') or clz._instance is not None:
+        if not self.__class__._creating:
             raise Exception('Invalid call to Config() - use Config.load() instead')
-        clz._instance = self
         # Find the config file
         if 'SH5_CONFIG' in os.environ:
             self.config_path = os.environ['SH5_CONFIG']
@@ -65,6 +83,8 @@ class Config(ClassyDict):
         else:
             self.config_path = 'config/config.yml'
         self.config_mtime = 0
+        # Don't look at the file again until then - see _hasConfigChanged()
+        self._next_check = 0
         # Init myself from the default values
         super().__init__(Config._DEFAULTS)
 
@@ -83,23 +103,68 @@ class Config(ClassyDict):
         Returns a "new" instance of the configuration which is really a singleton shared
         across all instances.
         '''
-        if not hasattr(clz, '_instance') or clz._instance._hasConfigChanged():
-            clz._instance = None
-            config = Config()
-            # Merge in whatever was read from the config file
-            for (name, value) in config._readConfig().items():
-                config[name] = value
-            # Allow the environment to override debuging
-            config.log_level = os.environ.get('LOG_LEVEL', config.log_level)
-            # Set the logging level
+        if not hasattr(clz, '_instance') or (not clz._watched and clz._instance._hasConfigChanged()):
+            config = clz._create()
             config._init_logger()
-            # Set the time zone
-            if not config.timezone:
-                config.timezone = None
-            else:
-                config.timezone = pytz.timezone(config.timezone)
+            clz._instance = config
+        return clz._instance
+
+    @classmethod
+    def reload(clz, validate=None):
+        '''
+        Read the config file in to a new instance and, only if it's valid,
+        make it the shared instance.  Replacing the instance is atomic so
+        callers see either the old or the new config, never a mix.
+
+        :param validate: an optional function that is passed the new config
+                and raises an exception if it isn't usable
+        :returns: the new config or None if it was invalid, in which case
+                the current config is kept
+        '''
+        try:
+            config = clz._create()
+            if validate is not None:
+                validate(config)
+        except Exception as err:
+            logging.getLogger().error("Ignoring invalid configuration - %s", err)
+            return None
+        config._init_logger()
+        clz._instance = config
+        return config
+
+    @classmethod
+    def _create(clz):
+        '''
+        Read the configuration in to a new, unshared, instance.
+
+        :raises: an exception if the file can't be read or isn't valid
+        '''
+        with clz._lock:
+            clz._creating = True
+            try:
+                config = Config()
+            finally:
+                clz._creating = False
+        # Merge in whatever was read from the config file
+        settings = config._readConfig()
+        if not isinstance(settings, dict):
+            raise ValueError(f"{config.config_path} does not contain a map of settings")
+        for (name, value) in settings.items():
+            config[name] = value
+        config._next_check = time.monotonic() + float(config.config_check_interval)
+        # Allow the environment to override debuging
+        config.log_level = os.environ.get('LOG_LEVEL', config.log_level)
+        if not isinstance(config.log_level, int) and config.log_level not in logging.getLevelNamesMapping():
+            raise ValueError(f"Unknown log_level {config.log_level}")
+        if float(config.poll_interval) <= 0:
+            raise ValueError(f"poll_interval must be more than 0")
+        # Set the time zone
+        if not config.timezone:
+            config.timezone = None
         else:
-            config = clz._instance
+            # Only pay for pytz if a time zone is configured
+            import pytz
+            config.timezone = pytz.timezone(config.timezone)
         return config
 
     def _init_logger(self):
@@ -113,11 +178,20 @@ class Config(ClassyDict):
     def _hasConfigChanged(self):
         '''
         Finds the config file and checks if it's modified time
-        has changed.
+        has changed.  load() is called a lot so the file is only checked
+        once every config_check_interval seconds.
 
         :returns: True if the file has changed
         '''
-        return self.config_path != '' and (self.config_mtime == 0 or self.config_mtime != os.stat(self.config_path).st_mtime)
+        if self.config_path == '':
+            return False
+        if self.config_mtime == 0:
+            return True
+        now = time.monotonic()
+        if now < self._next_check:
+            return False
+        self._next_check = now + float(self.config_check_interval)
+        return self.config_mtime != os.stat(self.config_path).st_mtime
 
     def _readConfig(self):
         '''
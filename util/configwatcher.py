@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Reload the configuration in the background when the config file changes.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import ctypes
+import os
+import select
+import struct
+import threading
+
+from util.config import Config
+
+class Inotify(object):
+    '''
+    A minimal ctypes wrapper for watching a directory with Linux inotify
+    '''
+    # From <sys/inotify.h>
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    # struct inotify_event without the name
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self, directory):
+        '''
+        Start watching a directory.  Editors often replace files rather
+        than rewriting them so watching the directory catches both.
+
+        :raises: OSError if inotify isn't available
+        '''
+        libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            raise OSError('inotify is not available')
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f'Failed to watch {directory}')
+
+    def read(self, timeout):
+        '''
+        Wait for changes.
+
+        :param timeout: the maximum number of seconds to wait
+        :returns: the names of the files that changed - empty if none did
+        '''
+        (ready, _, _) = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        names = []
+        offset = 0
+        while offset < len(data):
+            (wd, mask, cookie, length) = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            names.append(os.fsdecode(data[offset:offset + length].rstrip(b'\0')))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+class ConfigWatcher(object):
+    '''
+    Watch the config file (using inotify if possible, otherwise by polling
+    its modified time) and reload it in a background thread.  A new config
+    only replaces the current one if it's valid so a half written file, or
+    a typo, never breaks a control cycle.  While the watcher is running,
+    Config.load() simply returns the current config.
+    '''
+    # How long to wait for more changes before reloading
+    SETTLE_SECONDS = 0.2
+    # How often to check whether we've been stopped
+    WAKE_SECONDS = 1.0
+
+    def __init__(self, validate=None, use_inotify=True):
+        '''
+        :param validate: an optional function that is passed each new config
+                and raises an exception if it isn't usable
+        :param use_inotify: set False to always poll
+        '''
+        config = Config.load()
+        self.logger = config.logger
+        self.path = config.config_path
+        self.validate = validate
+        self.use_inotify = use_inotify
+        self.mode = None
+        self._inotify = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._seen = self._signature()
+
+    def start(self):
+        '''
+        Start watching in a background thread
+
+        :returns: myself
+        '''
+        if self.path == '':
+            # Only using the defaults so there's nothing to watch
+            return self
+        self.mode = 'poll'
+        if self.use_inotify:
+            try:
+                self._inotify = Inotify(os.path.dirname(os.path.abspath(self.path)))
+                self.mode = 'inotify'
+            except OSError as err:
+                self.logger.debug('Polling for config changes - %s', err)
+        Config._watched = True
+        self._thread = threading.Thread(target=self._run, name='configwatcher', daemon=True)
+        self._thread.start()
+        self.logger.debug('Watching %s for changes using %s', self.path, self.mode)
+        return self
+
+    def stop(self):
+        '''
+        Stop watching.  Config.load() goes back to checking the file itself.
+        '''
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+        Config._watched = False
+
+    def check(self):
+        '''
+        Reload the config if the file has changed since it was last seen
+
+        :returns: True if a new config was loaded
+        '''
+        signature = self._signature()
+        if signature == self._seen:
+            return False
+        # Remember it even if it's invalid so it's not reported again
+        self._seen = signature
+        config = Config.reload(self.validate)
+        if config is None:
+            return False
+        self.logger = config.logger
+        self.logger.info('Reloaded the configuration from %s', self.path)
+        return True
+
+    def _signature(self):
+        '''
+        :returns: something that changes whenever the file does
+        '''
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            # Probably being replaced
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _run(self):
+        name = os.path.basename(self.path)
+        while not self._stop.is_set():
+            try:
+                if self._inotify is None:
+                    self._stop.wait(float(Config.load().config_check_interval))
+                elif name in self._inotify.read(self.WAKE_SECONDS):
+                    # Let the writer finish
+                    while self._inotify.read(self.SETTLE_SECONDS):
+                        pass
+                else:
+                    continue
+                self.check()
+            except Exception as err:
+                self.logger.error('Config watcher failed - %s', err)
+                self._stop.wait(self.WAKE_SECONDS)
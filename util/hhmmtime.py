@@ -22,15 +22,21 @@
 #
 # You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
 
-from datetime import datetime
-from util.config import Config
+from util.clock import Clock
 
 class HHMMTime(object):
     '''
-    The maximum value of an HHMMTime.
+    A time of day, in minutes, from 00:00 to 24:00.  There are only 1,441
+    possible values so they are all created up front and shared - creating
+    an HHMMTime, or doing arithmetic with one, just looks one up.  Because
+    they are shared, HHMMTimes are immutable.
     '''
     ONE_DAY = 24 * 60
 
+    # value is minutes since midnight and key is the same but with 24:00
+    # folded on to 00:00 for comparisons
+    __slots__ = ('value', 'hours', 'minutes', '_key')
+
     # Helper methods
     @classmethod
     def __parse(cls, hhmmstr):
@@ -54,80 +60,128 @@ class HHMMTime(object):
             value = int(value) % HHMMTime.ONE_DAY
         if value < 0:
             value += HHMMTime.ONE_DAY
-        return value
+        return int(value)
+
+    @classmethod
+    def __make(cls, value):
+        '''
+        Create one of the shared instances
+        '''
+        t = object.__new__(cls)
+        object.__setattr__(t, 'value', value)
+        object.__setattr__(t, 'hours', value // 60)
+        object.__setattr__(t, 'minutes', value % 60)
+        object.__setattr__(t, '_key', value % HHMMTime.ONE_DAY)
+        return t
+
+    @classmethod
+    def _intern(cls):
+        '''
+        Create the table of shared instances, indexed by value
+        '''
+        cls._TABLE = tuple(cls.__make(v) for v in range(HHMMTime.ONE_DAY + 1))
 
     @classmethod
     def now(cls):
         '''
         :returns: an HHMMTime representing the current minute
         '''
-        t = datetime.now(tz=Config.load().timezone).timetuple()
-        return HHMMTime(t.tm_hour, t.tm_min)
+        return HHMMTime._TABLE[Clock.default().minuteOfDay()]
 
-    def __init__(self, value, minutes=None):
+    def __new__(cls, value, minutes=None):
         '''
-        Create a new HHMMTime given either a string of the format hh:mm
-        or a number.  Raises a ValueError if the string is badly formatted
-        or the value is out of range.
+        Return the HHMMTime given either a string of the format hh:mm, a
+        number of minutes or hours and minutes.  Raises a ValueError if the
+        string is badly formatted or the value is out of range.
         '''
-        if minutes is not None:
+        if minutes is None:
+            if type(value) is int:
+                # The fast path
+                if 0 <= value <= HHMMTime.ONE_DAY:
+                    return HHMMTime._TABLE[value]
+                return HHMMTime._TABLE[HHMMTime.__wrap(value)]
+            if isinstance(value, HHMMTime):
+                return value
+            if isinstance(value, str):
+                (hh, mm) = HHMMTime.__parse(value)
+            else:
+                # Make sure value is an in-range integer
+                return HHMMTime._TABLE[HHMMTime.__wrap(value)]
+        else:
             hh = int(value)
             mm = int(minutes)
-        elif isinstance(value, str):
-            (hh, mm) = HHMMTime.__parse(value)
-        elif isinstance(value, HHMMTime):
-            hh = value.hours
-            mm = value.minutes
-        else:
-            # Make sure value is an in-range integer
-            value = self.__wrap(value)
-            # Extract the hours and minutes
-            (hh, mm) = divmod(value, 60)
         if hh < 0 or hh > 24 or (hh == 24 and mm > 0) or mm < 0 or mm > 59:
             raise ValueError(f"HHMMTimes must be between 00:00 and 24:00 not '{hh:02d}:{mm:02d}")
-        self.hours = hh
-        self.minutes = mm
-        self.value = hh*60 + mm
+        return HHMMTime._TABLE[hh*60 + mm]
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"HHMMTimes can't be changed")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"HHMMTimes can't be changed")
+
+    # They are shared so there is no need to copy them
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (HHMMTime, (self.value,))
 
     # Allow for addition and subtraction.  Note HHMMTimes wrap around the clock
-    # for addition and subtraction.
+    # for addition and subtraction so the result is never 24:00.
     def __add__(self, other):
-        if not isinstance(other, HHMMTime):
-            other = HHMMTime(other)
-        result = self.value + other.value
-        if result == HHMMTime.ONE_DAY:
-            result = 0
-        return HHMMTime(HHMMTime.__wrap(result))
+        if type(other) is not int:
+            other = HHMMTime(other).value
+        return HHMMTime._TABLE[(self.value + other) % HHMMTime.ONE_DAY]
 
     def __sub__(self, other):
-        if not isinstance(other, HHMMTime):
-            other = HHMMTime(other)
-        result = self.value - other.value
-        if result == HHMMTime.ONE_DAY:
-            result = 0
-        return HHMMTime(HHMMTime.__wrap(result))
-
-    # And for comparison and equivalence
+        if type(other) is not int:
+            other = HHMMTime(other).value
+        return HHMMTime._TABLE[(self.value - other) % HHMMTime.ONE_DAY]
+
+    # And for comparison and equivalence.  HHMMTimes can also be compared
+    # with a number of minutes.
     def __eq__(self, other):
-        # Note that 24:00 == 00:00 so we need to explicitly handle that
-        assert isinstance(other, HHMMTime)
-        sv = 0 if self.value == HHMMTime.ONE_DAY else self.value
-        ov = 0 if other.value == HHMMTime.ONE_DAY else other.value
-        return sv == ov
+        # Note that 24:00 == 00:00 so compare the keys
+        if isinstance(other, HHMMTime):
+            return self._key == other._key
+        if type(other) is int:
+            return self._key == other % HHMMTime.ONE_DAY
+        return NotImplemented
+
+    def __hash__(self):
+        return self._key
 
     def __lt__(self, other):
-        assert isinstance(other, HHMMTime)
-        return self.value < other.value
+        if isinstance(other, HHMMTime):
+            return self.value < other.value
+        if type(other) is int:
+            return self.value < other
+        return NotImplemented
 
     def __le__(self, other):
-        return self < other or self == other
+        if isinstance(other, HHMMTime):
+            return self.value <= other.value or self._key == other._key
+        if type(other) is int:
+            return self.value <= other or self._key == other % HHMMTime.ONE_DAY
+        return NotImplemented
 
     def __gt__(self, other):
-        assert isinstance(other, HHMMTime)
-        return self.value > other.value
+        if isinstance(other, HHMMTime):
+            return self.value > other.value
+        if type(other) is int:
+            return self.value > other
+        return NotImplemented
 
     def __ge__(self, other):
-        return self > other or self == other
+        if isinstance(other, HHMMTime):
+            return self.value >= other.value or self._key == other._key
+        if type(other) is int:
+            return self.value >= other or self._key == other % HHMMTime.ONE_DAY
+        return NotImplemented
 
     # and string representations
     def __repr__(self):
@@ -135,3 +189,5 @@ class HHMMTime(object):
 
     def __str__(self):
         return f'{self.hours:02d}:{self.minutes:02d}'
+
+HHMMTime._intern()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# A tiny, dependency free metrics registry that can render itself in the
+# Prometheus/OpenMetrics text exposition format.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import math
+import threading
+import time
+
+# Default histogram buckets (in seconds).  The dongle is slow so the
+# interesting range is from a few milliseconds up to the 10 second timeout.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def formatValue(value):
+    '''
+    Format a number the way Prometheus expects it.
+    '''
+    if value is None:
+        return 'NaN'
+    value = float(value)
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value.is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(value)
+
+def formatLabels(labels):
+    '''
+    Format a tuple of (name, value) label pairs as {name="value",...}
+    '''
+    if not labels:
+        return ''
+    pairs = []
+    for (name, value) in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+class Counter(object):
+    '''
+    A monotonically increasing counter.
+    '''
+    def __init__(self, lock):
+        self._lock = lock
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield (name, labels, self.value)
+
+class Gauge(object):
+    '''
+    A value that can go up and down.
+    '''
+    def __init__(self, lock):
+        self._lock = lock
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name, labels):
+        yield (name, labels, self.value)
+
+class _Timer(object):
+    '''
+    Context manager that observes the elapsed time of its block.
+    '''
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+class Histogram(object):
+    '''
+    A cumulative histogram of observations.
+    '''
+    def __init__(self, lock, buckets=DEFAULT_BUCKETS):
+        self._lock = lock
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        with self._lock:
+            self.sum += value
+            self.count += 1
+            for (i, bound) in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def time(self):
+        '''
+        :returns: a context manager that times the enclosed block
+        '''
+        return _Timer(self)
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for (bound, n) in zip(self.buckets, self.counts):
+            cumulative += n
+            yield (f'{name}_bucket', labels + (('le', formatValue(bound)),), cumulative)
+        yield (f'{name}_bucket', labels + (('le', '+Inf'),), self.count)
+        yield (f'{name}_sum', labels, self.sum)
+        yield (f'{name}_count', labels, self.count)
+
+class MetricsRegistry(object):
+    '''
+    Holds all of the process metrics.  Metrics are created on first use and
+    identified by their name plus an optional set of labels, e.g.
+
+        METRICS.histogram('optmybat_client_request_seconds', 'Request latency', method='get')
+    '''
+    _KINDS = {'counter': Counter, 'gauge': Gauge, 'histogram': Histogram}
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._families = dict()
+
+    def _get(self, kind, name, help, labels, **kwargs):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            family = self._families.get(name)
+            if family is None:
+                family = self._families[name] = {'kind': kind, 'help': help, 'children': dict()}
+            elif family['kind'] != kind:
+                raise ValueError(f"Metric {name} is a {family['kind']} not a {kind}")
+            metric = family['children'].get(key)
+            if metric is None:
+                metric = family['children'][key] = self._KINDS[kind](self._lock, **kwargs)
+        return metric
+
+    def counter(self, name, help, **labels):
+        return self._get('counter', name, help, labels)
+
+    def gauge(self, name, help, **labels):
+        return self._get('gauge', name, help, labels)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS, **labels):
+        return self._get('histogram', name, help, labels, buckets=buckets)
+
+    def render(self):
+        '''
+        :returns: all of the metrics in the Prometheus text exposition format
+        '''
+        lines = []
+        with self._lock:
+            families = [(name, dict(f, children=dict(f['children']))) for (name, f) in sorted(self._families.items())]
+        for (name, family) in families:
+            lines.append(f"# HELP {name} {family['help']}")
+            lines.append(f"# TYPE {name} {family['kind']}")
+            for (labels, metric) in family['children'].items():
+                for (sample, slabels, value) in metric.samples(name, labels):
+                    lines.append(f'{sample}{formatLabels(slabels)} {formatValue(value)}')
+        return '\n'.join(lines) + '\n' if lines else ''
+
+#-----------------------------------------------------------------
+# The process wide registry
+METRICS = MetricsRegistry()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# A rate limiter shared by all the processes talking to a device.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import logging
+import math
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    # No file locking (e.g. Windows) - only limit this process
+    fcntl = None
+
+# The state is the time the next request can go, as a double
+_STATE = struct.Struct('d')
+
+# The longest anyone waits, in seconds.  A state further ahead than this
+# comes from a clock going backwards or a corrupt file and is reset.
+MAX_WAIT = 60
+
+class RateLimiter(object):
+    '''
+    A token bucket, implemented as the Generic Cell Rate Algorithm, that
+    is shared through a small, locked state file.  Every process using
+    the same file shares the same budget.  By default each user has their
+    own file, so processes run by different users don't share a limit.
+
+    Each caller reserves the next free slot while holding the lock then
+    waits for it outside the lock, so callers go in the order they asked
+    and nobody is starved.
+
+    If the state file can't be used, only this process is limited.
+    '''
+    def __init__(self, name, rate, burst=1, directory=None):
+        '''
+        :param name: what is being limited (e.g. the host name) - callers
+                using the same name share the limit
+        :param rate: the long term requests per second
+        :param burst: how many requests can go at once after a quiet spell
+        :param directory: where to keep the state.  Defaults to the temp
+                directory, with a file for each user.
+        '''
+        if rate <= 0:
+            raise ValueError(f"The rate must be more than 0 - not {rate}")
+        if burst < 1:
+            raise ValueError(f"The burst must be at least 1 - not {burst}")
+        self.interval = 1.0 / rate
+        self.burst = burst
+        if directory is None:
+            directory = tempfile.gettempdir()
+        # A user ID rather than a name - e.g. a container user may not have one
+        uid = os.getuid() if hasattr(os, 'getuid') else 0
+        name = re.sub(r'[^\w.-]', '_', f'{uid}-{name}')
+        self.path = os.path.join(directory, f"optmybat-{name}.rate")
+        # Threads in this process take turns too
+        self._lock = threading.Lock()
+        # The state when limiting only this process
+        self._tat = 0.0
+
+    def reserve(self, now=None):
+        '''
+        Reserve the next request slot
+
+        :param now: the current time.  Defaults to time.time().
+        :returns: the number of seconds to wait before making the request
+        '''
+        with self._lock:
+            if now is None:
+                now = time.time()
+            if self.path is not None:
+                try:
+                    tat = self._reserveShared(now)
+                except OSError as err:
+                    logging.getLogger().warning(f"Only limiting the request rate for this process - {err}")
+                    self.path = None
+            if self.path is None:
+                tat = self._tat = self._next(self._tat, now)
+        return max(tat - now - self.burst * self.interval, 0.0)
+
+    def _reserveShared(self, now):
+        '''
+        Reserve the next slot in the state file
+
+        :returns: the new theoretical arrival time
+        '''
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            state = os.pread(fd, _STATE.size, 0)
+            tat = self._next(_STATE.unpack(state)[0] if len(state) == _STATE.size else now, now)
+            os.pwrite(fd, _STATE.pack(tat), 0)
+        finally:
+            # Closing releases the lock
+            os.close(fd)
+        return tat
+
+    def _next(self, tat, now):
+        '''
+        :param tat: the theoretical arrival time of the next request
+        :returns: the theoretical arrival time after this request
+        '''
+        if not math.isfinite(tat) or tat > now + self.burst * self.interval + MAX_WAIT:
+            tat = now
+        # A request is allowed once it's no more than burst intervals ahead
+        return max(tat, now) + self.interval
+
+    def acquire(self):
+        '''
+        Wait until a request can be made
+
+        :returns: the number of seconds waited
+        '''
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# A fixed size, array backed ring buffer of timestamped numeric samples.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+from array import array
+import bisect
+import math
+import threading
+
+class RingBuffer(object):
+    '''
+    Holds the most recent `capacity` samples of a fixed set of numeric fields.
+    Timestamps are kept as doubles and values as 32 bit floats so a day of
+    30 second samples of five fields takes about 20KB.  Missing or non-numeric
+    values are stored as NaN.
+
+    Samples must be appended in time order.
+    '''
+    def __init__(self, fields, capacity):
+        '''
+        :param fields: the names of the fields to keep
+        :param capacity: the maximum number of samples to keep
+        '''
+        if capacity < 1:
+            raise ValueError(f'RingBuffer capacity must be at least 1 not {capacity}')
+        self.fields = tuple(fields)
+        self.capacity = int(capacity)
+        self._times = array('d', [0.0]) * self.capacity
+        self._values = {f: array('f', [0.0]) * self.capacity for f in self.fields}
+        self._count = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, timestamp, values):
+        '''
+        Add a sample, overwriting the oldest if the buffer is full.
+
+        :param timestamp: the sample time in seconds since the epoch
+        :param values: a dict (or dict-like) containing the field values
+        '''
+        with self._lock:
+            i = self._next
+            self._times[i] = timestamp
+            for (name, column) in self._values.items():
+                try:
+                    column[i] = float(values[name])
+                except (KeyError, TypeError, ValueError):
+                    column[i] = math.nan
+            self._next = (i + 1) % self.capacity
+            if self._count < self.capacity:
+                self._count += 1
+
+    def _order(self):
+        '''
+        :returns: the ring indexes from oldest to newest
+        '''
+        start = (self._next - self._count) % self.capacity
+        return [(start + n) % self.capacity for n in range(self._count)]
+
+    def latest(self):
+        '''
+        :returns: the most recent sample as a dict or None if empty
+        '''
+        with self._lock:
+            if self._count == 0:
+                return None
+            i = (self._next - 1) % self.capacity
+            sample = {'timestamp': self._times[i]}
+            for (name, column) in self._values.items():
+                sample[name] = column[i]
+            return sample
+
+    def since(self, timestamp, fields=None):
+        '''
+        Return all samples newer than timestamp.
+
+        :param timestamp: only return samples with a later timestamp
+        :param fields: the fields to return (defaults to all)
+        :returns: a dict of lists keyed by 'timestamp' and the field names
+        '''
+        fields = self.fields if fields is None else [f for f in fields if f in self._values]
+        with self._lock:
+            order = self._order()
+            times = [self._times[i] for i in order]
+            first = bisect.bisect_right(times, timestamp)
+            order = order[first:]
+            result = {'timestamp': times[first:]}
+            for name in fields:
+                column = self._values[name]
+                result[name] = [column[i] for i in order]
+        return result
+
+    def rate(self, name, seconds):
+        '''
+        The least squares rate of change of a field over the most recent
+        samples, ignoring missing values.
+
+        :param name: the field
+        :param seconds: use the samples from the last `seconds` before the newest
+        :returns: the change per second or None without two usable samples
+        '''
+        column = self._values[name]
+        with self._lock:
+            i = (self._next - 1) % self.capacity
+            newest = self._times[i]
+            (n, sx, sy, sxx, sxy) = (0, 0.0, 0.0, 0.0, 0.0)
+            for _ in range(self._count):
+                x = self._times[i] - newest
+                if x < -seconds:
+                    break
+                y = column[i]
+                if not math.isnan(y):
+                    n += 1
+                    sx += x
+                    sy += y
+                    sxx += x * x
+                    sxy += x * y
+                i = (i - 1) % self.capacity
+        divisor = n * sxx - sx * sx
+        if n < 2 or divisor == 0:
+            return None
+        return (n * sxy - sx * sy) / divisor
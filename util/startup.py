@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# A simple import time profiler used by `optmybat --profile-startup`.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import builtins
+import sys
+import time
+
+class ImportProfiler(object):
+    '''
+    Records how long each newly imported module takes to load, both in
+    total (including the modules it imports) and by itself.
+    '''
+    def __init__(self):
+        self.timings = dict()
+        self._stack = list()
+        self._original = None
+
+    def start(self):
+        '''
+        Start recording imports
+        '''
+        self._original = builtins.__import__
+        builtins.__import__ = self._import
+        self.started = time.perf_counter()
+
+    def stop(self):
+        '''
+        Stop recording imports
+        '''
+        self.elapsed = time.perf_counter() - self.started
+        builtins.__import__ = self._original
+
+    def importModule(self, name):
+        '''
+        Import a module by name (e.g. tools.scanner) while recording
+        '''
+        builtins.__import__(name)
+        return sys.modules[name]
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # Only time modules that actually get loaded - either the module
+        # itself or, for "from package import module", the submodules
+        if level != 0:
+            return self._original(name, globals, locals, fromlist, level)
+        if name not in sys.modules:
+            candidates = [name]
+        elif fromlist:
+            candidates = [f'{name}.{f}' for f in fromlist if f'{name}.{f}' not in sys.modules]
+        else:
+            candidates = []
+        if not candidates:
+            return self._original(name, globals, locals, fromlist, level)
+        self._stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self._original(name, globals, locals, fromlist, level)
+        finally:
+            total = time.perf_counter() - start
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += total
+            loaded = [c for c in candidates if c in sys.modules]
+            if loaded:
+                self.timings[loaded[0]] = (total, total - children)
+
+    def report(self, out=sys.stderr, limit=30):
+        '''
+        Print the slowest imports, sorted by their cumulative time
+        '''
+        print(f"{'module':40} {'self ms':>10} {'total ms':>10}", file=out)
+        ranked = sorted(self.timings.items(), key=lambda item: item[1][0], reverse=True)
+        for (name, (total, own)) in ranked[:limit]:
+            print(f"{name:40} {own * 1000:10.1f} {total * 1000:10.1f}", file=out)
+        print(f"{len(self.timings)} modules imported in {self.elapsed * 1000:.1f} ms", file=out)
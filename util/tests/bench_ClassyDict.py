@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# A micro-benchmark comparing ClassyDict with a plain dict for the access
+# patterns used by Services and Parameters.  Run it with:
+#
+#   python -m util.tests.bench_ClassyDict
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import timeit
+
+from util.classydict import ClassyDict
+
+# Roughly the shape of a cached stats response
+KEYS = [f'stat_{n}' for n in range(40)]
+BASE = {k: '12.5' for k in KEYS}
+
+# (operation, plain dict statement, ClassyDict statement).  Plain dicts don't
+# do attributes so they use the equivalent item access.
+CASES = [
+    ('construct', 'dict(BASE)', 'ClassyDict(BASE)'),
+    ('d[key]', "d['stat_7']", "d['stat_7']"),
+    ('d.key', "d['stat_7']", 'd.stat_7'),
+    ('d[key] = v', "d['stat_7'] = '1'", "d['stat_7'] = '1'"),
+    ('d.key = v', "d['stat_7'] = '1'", "d.stat_7 = '1'"),
+    ('key in d', "'stat_7' in d", "'stat_7' in d"),
+]
+
+def bench(number=200000):
+    print(f"{'operation':14} {'dict ns':>10} {'ClassyDict ns':>14} {'ratio':>7}")
+    for (name, plain, classy) in CASES:
+        results = []
+        for (clz, stmt) in ((dict, plain), (ClassyDict, classy)):
+            env = {'ClassyDict': ClassyDict, 'BASE': BASE, 'd': clz(BASE)}
+            t = min(timeit.repeat(stmt, globals=env, number=number, repeat=5))
+            results.append(t / number * 1e9)
+        print(f"{name:14} {results[0]:10.1f} {results[1]:14.1f} {results[1] / results[0]:7.2f}")
+
+if __name__ == '__main__':
+    bench()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests the CircuitBreaker class and backoff.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from util.circuitbreaker import CircuitBreaker, backoff
+from util.clock import Clock
+
+@pytest.fixture
+def clock():
+    '''
+    A clock that only moves when told to
+    '''
+    now = [1000.0]
+    previous = Clock.install(Clock(lambda: now[0]))
+    yield now
+    Clock.install(previous)
+
+def test_backoff():
+    for attempt in range(10):
+        for _ in range(100):
+            assert 0 <= backoff(attempt, 0.5, 4) <= min(4, 0.5 * 2 ** attempt)
+
+def test_breaker(clock):
+    '''
+    Test opening, the half open trial and closing
+    '''
+    breaker = CircuitBreaker(threshold=3, cooldown=10, max_cooldown=30)
+    assert not breaker.failure()
+    assert not breaker.failure()
+    assert breaker.allow()
+    assert breaker.failure()
+    assert not breaker.allow()
+    # One trial after the cooldown - failing opens it for longer
+    clock[0] += 11.1
+    assert breaker.allow()
+    assert breaker.failure()
+    clock[0] += 11.1
+    assert not breaker.allow()
+    clock[0] += 11
+    assert breaker.allow()
+    # The cooldown is capped
+    breaker.failure()
+    assert breaker.opened_until <= clock[0] + 33
+    # Working closes it and resets the cooldown
+    clock[0] += 34
+    breaker.success()
+    assert breaker.allow() and breaker.failures == 0
+    breaker.failure(), breaker.failure(), breaker.failure()
+    assert breaker.opened_until <= clock[0] + 11
+    with pytest.raises(ValueError):
+        CircuitBreaker(threshold=0)
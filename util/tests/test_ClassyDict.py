@@ -134,3 +134,14 @@ def test_privateAttribues():
     del(obj['_private'])
     assert not hasattr(obj, '_private')
     assert obj.get('_private', None) == None
+
+def test_mixedPrivateKeys():
+    # Private items are found even when not all of the keys are strings
+    obj = ClassyDict({1: 'one', '_private': 2, '': 'empty'})
+    assert len(obj) == 2
+    assert obj._private == 2
+    assert obj[''] == 'empty'
+    with pytest.raises(KeyError):
+        obj['_missing']
+    with pytest.raises(AttributeError):
+        obj._missing
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests the Clock class.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+from datetime import datetime
+import pytest
+import pytz
+import time
+
+from sungrow.support import TimedTarget
+from util.clock import Clock
+from util.hhmmtime import HHMMTime
+
+SYDNEY = pytz.timezone('Australia/Sydney')
+
+@pytest.fixture
+def installed():
+    '''
+    Install a clock with a controllable time for the test
+    '''
+    now = [datetime(2024, 6, 3, 11, 45, tzinfo=pytz.utc).timestamp()]
+    previous = Clock.install(Clock(lambda: now[0], timezone=pytz.utc))
+    yield now
+    Clock.install(previous)
+
+def test_realClock():
+    '''
+    Test that the anchored clock follows the wall clock
+    '''
+    clock = Clock(timezone=None)
+    assert abs(clock.time() - time.time()) < 0.1
+    assert abs(clock.time() - time.time()) < 0.1
+    local = datetime.now()
+    assert clock.minuteOfDay() in (local.hour * 60 + local.minute, (local.hour * 60 + local.minute + 1) % 1440)
+    assert clock.weekday() in (local.weekday(), (local.weekday() + 1) % 7)
+
+def test_stepped(monkeypatch):
+    '''
+    Test following the wall clock when it's stepped (e.g. by NTP)
+    '''
+    (wall, mono) = ([1000.0], [50.0])
+    monkeypatch.setattr(time, 'time', lambda: wall[0])
+    monkeypatch.setattr(time, 'monotonic', lambda: mono[0])
+    clock = Clock(timezone=pytz.utc)
+    assert clock.time() == 1000.0
+    # Stepped forward an hour - followed within a minute
+    wall[0] += 3600 + 10
+    mono[0] += 10
+    assert clock.time() == 1010.0
+    wall[0] += Clock.ANCHOR_SECONDS
+    mono[0] += Clock.ANCHOR_SECONDS
+    assert clock.time() == 1000.0 + 3600 + 10 + Clock.ANCHOR_SECONDS
+
+def test_timezone():
+    '''
+    Test the time of day, including across daylight saving changes
+    '''
+    now = [0.0]
+    clock = Clock(lambda: now[0], timezone=SYDNEY)
+    # Step through the day that daylight saving started in Sydney
+    start = datetime(2024, 10, 5, 12, 0, tzinfo=pytz.utc).timestamp()
+    for minutes in range(0, 24 * 60, 7):
+        now[0] = start + minutes * 60
+        local = datetime.fromtimestamp(now[0], SYDNEY)
+        assert clock.minuteOfDay() == local.hour * 60 + local.minute
+        assert clock.weekday() == local.weekday()
+        assert clock.utcOffset() == local.utcoffset().total_seconds()
+
+def test_installed(installed):
+    '''
+    Test that HHMMTime and TimedTarget use the installed clock
+    '''
+    # 3rd June 2024 was a Monday
+    assert HHMMTime.now() == HHMMTime('11:45')
+    targets = [
+        {'start': '01:00', 'stop': '02:00', 'target': 20, 'days': [0]},
+        {'start': '03:00', 'stop': '04:00', 'target': 30, 'days': [1]}
+    ]
+    assert [t.target for t in TimedTarget.loadTargets(targets)] == [20]
+    # Fast forward a day
+    installed[0] += 24 * 3600 + 60
+    assert HHMMTime.now() == HHMMTime('11:46')
+    assert [t.target for t in TimedTarget.loadTargets(targets)] == [30]
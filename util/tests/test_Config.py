@@ -56,6 +56,31 @@ def test_update(tmpdir):
     Config.unload()
     assert c2.admin_passwd == 'frosty'
 
+def test_checkInterval(tmpdir):
+    '''
+    Test that the file is only checked once per config_check_interval.
+    '''
+    Config.unload()
+    config = f"{tmpdir}/config.yml"
+    with open(config, 'w') as cfd:
+        cfd.write("admin_passwd: freaky\nconfig_check_interval: 60")
+    saved = os.environ.get('SH5_CONFIG', None)
+    os.environ['SH5_CONFIG'] = config
+    c1 = Config.load()
+    with open(config, 'w') as cfd:
+        cfd.write("admin_passwd: frosty\nconfig_check_interval: 60")
+    os.utime(config, (time.time() + 10, time.time() + 10))
+    # Too soon to check
+    assert Config.load() is c1
+    # Pretend the interval has passed
+    c1._next_check = 0
+    c2 = Config.load()
+    if saved is not None:
+        os.environ['SH5_CONFIG'] = saved
+    Config.unload()
+    assert c2 is not c1
+    assert c2.admin_passwd == 'frosty'
+
 def test_config_path():
     '''
     Tests that config obeys the SH5_CONFIG environ variable.
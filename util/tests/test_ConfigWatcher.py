@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests reloading the config in the background.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import os
+import pytest
+import time
+
+from util.config import Config
+from util.configwatcher import ConfigWatcher
+
+@pytest.fixture
+def config(tmpdir):
+    '''
+    A config file that is only used by this test
+    '''
+    path = f"{tmpdir}/config.yml"
+    with open(path, 'w') as cfd:
+        cfd.write("admin_passwd: freaky\nconfig_check_interval: 0.1\n")
+    saved = os.environ.get('SH5_CONFIG', None)
+    os.environ['SH5_CONFIG'] = path
+    Config.unload()
+    yield path
+    if saved is None:
+        del os.environ['SH5_CONFIG']
+    else:
+        os.environ['SH5_CONFIG'] = saved
+    Config.unload()
+
+def rewrite(path, text):
+    with open(path, 'w') as cfd:
+        cfd.write(text)
+
+def waitFor(check, seconds=5):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        if check():
+            return True
+        time.sleep(0.05)
+    return False
+
+def rejectFrosty(config):
+    if config.admin_passwd == 'frosty':
+        raise ValueError('Not frosty')
+
+@pytest.mark.parametrize('use_inotify', [True, False])
+def test_reload(config, use_inotify):
+    '''
+    Test that changes are picked up in the background
+    '''
+    c1 = Config.load()
+    watcher = ConfigWatcher(validate=rejectFrosty, use_inotify=use_inotify).start()
+    try:
+        if not use_inotify:
+            assert watcher.mode == 'poll'
+        rewrite(config, "admin_passwd: jolly\nconfig_check_interval: 0.1\n")
+        assert waitFor(lambda: Config.load().admin_passwd == 'jolly')
+        assert Config.load() is not c1
+        # Broken YAML is ignored
+        c2 = Config.load()
+        rewrite(config, "admin_passwd: [oops\n")
+        time.sleep(0.5)
+        assert Config.load() is c2
+        # As is a config that doesn't validate
+        rewrite(config, "admin_passwd: frosty\nconfig_check_interval: 0.1\n")
+        time.sleep(0.5)
+        assert Config.load() is c2
+        # But the next good one is used
+        rewrite(config, "admin_passwd: merry\nconfig_check_interval: 0.1\n")
+        assert waitFor(lambda: Config.load().admin_passwd == 'merry')
+    finally:
+        watcher.stop()
+    assert not Config._watched
+
+def test_check(config):
+    '''
+    Test checking for changes without the background thread
+    '''
+    c1 = Config.load()
+    watcher = ConfigWatcher()
+    assert not watcher.check()
+    rewrite(config, "admin_passwd: jolly\n")
+    assert watcher.check()
+    assert Config.load().admin_passwd == 'jolly'
+    # Nothing has changed since
+    assert not watcher.check()
+    # An empty, half written, file is invalid
+    rewrite(config, "")
+    assert not watcher.check()
+    assert Config.load().admin_passwd == 'jolly'
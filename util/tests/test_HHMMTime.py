@@ -19,7 +19,9 @@
 #
 # You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
 
+import copy
 from datetime import datetime
+import pickle
 from util.config import Config
 import pytest
 
@@ -166,3 +168,45 @@ def test_validation():
         t = HHMMTime(24, 1)
     with pytest.raises(ValueError) as e:
         t = HHMMTime(-1, 0)
+
+def test_interning():
+    '''
+    Test that HHMMTimes are shared and immutable
+    '''
+    assert HHMMTime('11:45') is HHMMTime(11, 45)
+    assert HHMMTime(11 * 60 + 45) is HHMMTime('11:45')
+    assert HHMMTime(HHMMTime('11:45')) is HHMMTime('11:45')
+    assert HHMMTime('11:30') + 15 is HHMMTime('11:45')
+    assert HHMMTime('24:00') is not HHMMTime('00:00')
+    with pytest.raises(AttributeError):
+        HHMMTime('11:45').value = 0
+    with pytest.raises(AttributeError):
+        HHMMTime('11:45').hours = 0
+    assert copy.copy(HHMMTime('11:45')) is HHMMTime('11:45')
+    assert copy.deepcopy(HHMMTime('11:45')) is HHMMTime('11:45')
+    assert pickle.loads(pickle.dumps(HHMMTime('24:00'))) is HHMMTime('24:00')
+
+def test_hashing():
+    '''
+    Test that equal HHMMTimes hash the same, including 00:00 and 24:00
+    '''
+    assert len({HHMMTime('00:00'), HHMMTime('24:00'), HHMMTime('11:45')}) == 2
+    assert {HHMMTime('24:00'): 1}.get(HHMMTime('00:00')) == 1
+
+def test_minutes():
+    '''
+    Test comparing HHMMTimes with a number of minutes
+    '''
+    t = HHMMTime('01:00')
+    assert t == 60
+    assert t != 61
+    assert t < 61
+    assert t <= 60
+    assert t > 59
+    assert t >= 60
+    assert HHMMTime('24:00') == 0
+    assert HHMMTime('24:00') >= 0
+    assert HHMMTime('00:00') <= HHMMTime.ONE_DAY
+    assert t != '01:00'
+    with pytest.raises(TypeError):
+        t < '01:00'
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests the MetricsRegistry class and the exposition format.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import pytest
+
+from util.metrics import MetricsRegistry, formatValue
+
+def test_counter():
+    '''
+    Test that counters count and render with their labels
+    '''
+    registry = MetricsRegistry()
+    c = registry.counter('test_things_total', 'Things', kind='a')
+    c.inc()
+    c.inc(2)
+    assert registry.counter('test_things_total', 'Things', kind='a') is c
+    text = registry.render()
+    assert '# TYPE test_things_total counter' in text
+    assert 'test_things_total{kind="a"} 3' in text
+
+def test_histogram():
+    '''
+    Test that histogram buckets are cumulative
+    '''
+    registry = MetricsRegistry()
+    h = registry.histogram('test_seconds', 'Seconds', buckets=(0.1, 1.0))
+    h.observe(0.05)
+    h.observe(0.5)
+    h.observe(5)
+    with h.time():
+        pass
+    text = registry.render()
+    assert 'test_seconds_bucket{le="0.1"} 2' in text
+    assert 'test_seconds_bucket{le="1"} 3' in text
+    assert 'test_seconds_bucket{le="+Inf"} 4' in text
+    assert 'test_seconds_count 4' in text
+
+def test_kinds():
+    '''
+    Test that a name can't be reused for a different kind of metric
+    '''
+    registry = MetricsRegistry()
+    registry.gauge('test_value', 'Value').set(1.5)
+    assert 'test_value 1.5' in registry.render()
+    with pytest.raises(ValueError):
+        registry.counter('test_value', 'Value')
+
+def test_formatValue():
+    assert formatValue(3.0) == '3'
+    assert formatValue(0.25) == '0.25'
+    assert formatValue(None) == 'NaN'
+    assert formatValue(float('inf')) == '+Inf'
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests the RateLimiter shared between processes.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import os
+import multiprocessing
+import struct
+import time
+
+import pytest
+
+from util.ratelimit import RateLimiter
+
+def test_bucket(tmpdir):
+    '''
+    Test the burst then the steady rate
+    '''
+    limiter = RateLimiter('inverter', rate=2, burst=3, directory=tmpdir)
+    # The burst goes straight away
+    assert [limiter.reserve(100.0) for _ in range(3)] == [0, 0, 0]
+    # Then one every half second
+    assert limiter.reserve(100.0) == pytest.approx(0.5)
+    assert limiter.reserve(100.0) == pytest.approx(1.0)
+    # The bucket refills while idle
+    assert limiter.reserve(110.0) == 0
+    # Limiters with the same name share the budget
+    other = RateLimiter('inverter', rate=2, burst=3, directory=tmpdir)
+    assert [other.reserve(110.0) for _ in range(3)] == [0, 0, pytest.approx(0.5)]
+    # Others don't
+    assert RateLimiter('192.168.1.2', rate=2, directory=tmpdir).reserve(110.0) == 0
+    with pytest.raises(ValueError):
+        RateLimiter('inverter', rate=0)
+
+def _request(directory, out):
+    RateLimiter('shared', rate=20, burst=1, directory=directory).acquire()
+    out.put(time.time())
+
+def test_processes(tmpdir):
+    '''
+    Test that separate processes share the limit
+    '''
+    out = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=_request, args=(str(tmpdir), out)) for _ in range(6)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    times = sorted(out.get() for _ in workers)
+    # Six requests at 20 per second take at least a quarter of a second
+    assert times[-1] - times[0] >= 0.2
+
+def test_implausible(tmpdir):
+    '''
+    Test recovering from a state far in the future or corrupt
+    '''
+    limiter = RateLimiter('inverter', rate=1, burst=2, directory=tmpdir)
+    for state in (struct.pack('d', 1e12), struct.pack('d', float('nan')), b'junk'):
+        with open(limiter.path, 'wb') as ofd:
+            ofd.write(state)
+        assert limiter.reserve(100.0) == 0
+    # A clock stepping back is capped
+    for _ in range(10):
+        limiter.reserve(1000.0)
+    assert limiter.reserve(500.0) == 0
+
+def test_unshared(tmpdir):
+    '''
+    Test falling back to limiting this process
+    '''
+    limiter = RateLimiter('inverter', rate=1, burst=1, directory=f'{tmpdir}/missing')
+    assert limiter.reserve(100.0) == 0
+    assert limiter.path is None
+    assert limiter.reserve(100.0) == pytest.approx(1.0)
+    # A file for each user
+    assert f'optmybat-{os.getuid()}-inverter' in RateLimiter('inverter', rate=1).path
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+#
+# Copyright 2024 Magus Verde
+#
+# Tests the RingBuffer class.
+#
+# This file is part of Optmybat.
+#
+# Optmybat is free software: you can redistribute it and/or modify it under the
+# terms of the GNU Affero General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later
+# version.
+#
+# Optmybat is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Affero General Public License for more details.
+#
+# NO AI TRAINING: Any use of this code related to the development, or training
+# of AI systems is explicitly prohibited. Personal use, indexing for Internet
+# search engines, etc. is intended, permitted and encouraged.
+#
+# You can review the GNU Affero General Public License at <https://www.gnu.org/licenses/>.
+
+import math
+import pytest
+
+from util.ringbuffer import RingBuffer
+
+def test_empty():
+    r = RingBuffer(['a'], 3)
+    assert len(r) == 0
+    assert r.latest() is None
+    assert r.since(0) == {'timestamp': [], 'a': []}
+    with pytest.raises(ValueError):
+        RingBuffer(['a'], 0)
+
+def test_wrap():
+    '''
+    Test that the oldest samples are overwritten
+    '''
+    r = RingBuffer(['a', 'b'], 3)
+    for t in range(5):
+        r.append(t, {'a': t, 'b': '--'})
+    assert len(r) == 3
+    assert r.latest()['a'] == 4
+    assert math.isnan(r.latest()['b'])
+    window = r.since(1)
+    assert window['timestamp'] == [2, 3, 4]
+    assert window['a'] == [2, 3, 4]
+    assert r.since(3, ['a', 'nope']) == {'timestamp': [4], 'a': [4]}
+
+def test_rate():
+    '''
+    Test the least squares rate of change over the recent samples
+    '''
+    r = RingBuffer(['a'], 5)
+    assert r.rate('a', 60) is None
+    r.append(0, {'a': 10})
+    assert r.rate('a', 60) is None
+    for t in range(30, 300, 30):
+        r.append(t, {'a': 10 + t / 60})
+    assert r.rate('a', 60) == pytest.approx(1 / 60)
+    # Only the last two samples
+    r.append(300, {'a': 100})
+    assert r.rate('a', 30) == pytest.approx((100 - 10 - 270 / 60) / 30)
+    # Missing values are ignored
+    r.append(330, {'a': '--'})
+    assert r.rate('a', 30) is None
+    assert r.rate('a', 60) == pytest.approx((100 - 10 - 270 / 60) / 30)